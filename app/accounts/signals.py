@@ -3,6 +3,7 @@ from django.contrib.auth.models import User
 from django.dispatch import receiver
 from accounts.models import Profile
 from accounts.tasks import send_email
+from outbox.dispatch import enqueue
 
 
 @receiver(post_save, sender=User)
@@ -14,4 +15,4 @@ def create_profile(sender, instance, created, **kwargs):
 @receiver(post_save, sender=User)
 def user_update(sender, instance, created, **kwargs):
     if created and not instance.is_active:
-        send_email.delay(instance.pk)
+        enqueue(send_email, instance.pk)  # sent to the broker by the outbox relay after the commit
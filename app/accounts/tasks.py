@@ -4,6 +4,7 @@ from django.core.mail import send_mail
 from django.conf import settings
 from accounts.tokens import account_activation_token
 from blog_celery import app
+from blog import mail_queue
 from django.contrib.auth.models import User
 
 
@@ -22,3 +23,8 @@ def send_email(pk):
         [instance.email],
         fail_silently=False,
     )
+
+
+@app.task(ignore_result=True)
+def deliver_mail():
+    return mail_queue.deliver()
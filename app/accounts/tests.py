@@ -1,6 +1,7 @@
 from django.test import TestCase
 from django.contrib.auth.models import User
 from accounts.models import Profile
+from blog.query_budget import QueryBudgetMixin
 from django.urls import reverse, resolve
 import accounts.views as views
 import accounts.forms as forms
@@ -443,3 +444,18 @@ class AccountModelTests(TestCase):
     def test_profile_unique(self):
         with self.assertRaises(Exception):
             Profile.objects.create(user=self.user, bio='duplicate')
+
+
+class AccountQueryBudgetTests(QueryBudgetMixin, TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='test-login')
+
+    def test_anonymous_budgets(self):
+        self.assertQueryBudget('login')
+        self.assertQueryBudget('register')
+
+    def test_budgets(self):
+        self.client.force_login(self.user)
+        self.assertQueryBudget('profile')
+        self.assertQueryBudget('password_change')
@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class BlogConfig(AppConfig):
+    """Project-level tooling: database pools, replicas, mail queue and their commands"""
+    name = 'blog'
+
+    def ready(self):
+        import blog.signals
@@ -0,0 +1,80 @@
+"""
+Connection pools of the database.
+
+With DB_POOL every process has a psycopg pool of DB_POOL_MIN_SIZE to DB_POOL_MAX_SIZE connections, created by
+Django on the first query. A pool has worker threads, which do not survive a fork, so a process which forks
+workers (the gunicorn master with preload_app, the main Celery process) closes its pools first.
+
+Pool metrics are counters of a process. Every process adds them to shared counters in the cache at most once
+per DB_POOL_STATS_INTERVAL seconds, the db_pool_stats command shows the totals.
+"""
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+# names of the psycopg pool counters in the shared metrics
+COUNTERS = {
+    'requests_num': 'checkouts',
+    'requests_queued': 'waits',  # checkouts which waited for a free connection
+    'requests_wait_ms': 'wait_ms',
+    'requests_errors': 'timeouts',  # checkouts which got no connection in DB_POOL_TIMEOUT
+    'connections_errors': 'connection_errors',
+    'connections_lost': 'connections_lost',  # broken connections found by the health check
+}
+STATS_KEY = 'db_pool:{}'
+
+_last_published = 0.0
+
+
+def get_pools():
+    """Returns {alias: pool} of the databases with pooled connections, pools are created on first use"""
+    return {alias: connections[alias].pool for alias in connections
+            if getattr(connections[alias], 'pool', None) is not None}
+
+
+def close_pools():
+    """Closes the pools of the process before it forks, every child creates its own pools"""
+    for alias in connections:
+        if getattr(connections[alias], 'pool', None) is not None:
+            connections[alias].close_pool()
+
+
+def _add(key, value):
+    try:
+        cache.incr(key, value)
+    except ValueError:  # the counter does not exist yet or was evicted
+        if not cache.add(key, value, None):
+            cache.incr(key, value)
+
+
+def publish_stats(force=False):
+    """
+    Adds the pool counters of the process to the shared counters
+
+    Features:
+      * Runs at most once per DB_POOL_STATS_INTERVAL seconds unless force is given
+      * Counters are taken with pop_stats(), so a value is published once
+    """
+    global _last_published
+    now = time.monotonic()
+    if not force and now - _last_published < settings.DB_POOL_STATS_INTERVAL:
+        return
+    _last_published = now
+    for pool in get_pools().values():
+        stats = pool.pop_stats()
+        for name, counter in COUNTERS.items():
+            if stats.get(name):
+                _add(STATS_KEY.format(counter), stats[name])
+
+
+def get_stats():
+    """Returns the shared counters and the mean wait of a checkout which waited in milliseconds"""
+    values = cache.get_many([STATS_KEY.format(counter) for counter in COUNTERS.values()])
+    stats = {counter: values.get(STATS_KEY.format(counter), 0) for counter in COUNTERS.values()}
+    stats['mean_wait_ms'] = stats['wait_ms'] / stats['waits'] if stats['waits'] else None
+    return stats
+
+
+def reset_stats():
+    cache.delete_many([STATS_KEY.format(counter) for counter in COUNTERS.values()])
@@ -0,0 +1,122 @@
+"""
+Routing of reads to the read replicas of the database.
+
+Writes always go to the default database. Reads of posts, comments and tags go to a replica only inside
+replica_reads(): views with replica_reads = True (the home feed and post pages) run in it, the leaderboards
+enter it themselves, and PostSitemap reads from get_read_database(). Every other read, including sessions and
+users, stays on the primary, so a replica which lags behind never logs a user out.
+
+A request which writes posts, comments or tags pins its client to the primary for REPLICA_PIN_SECONDS with a
+signed cookie, so the author sees the change on the next pages even if the replicas have not caught up yet.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+PIN_COOKIE = 'db_primary'
+ROUTED_APPS = {'post', 'taggit'}
+
+
+class RoutingState:
+    """Routing of the current request, the middleware and the router change it in place"""
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned  # the client wrote recently, reads go to the primary
+        self.replica = False  # reads of the routed apps may go to a replica
+        self.wrote = False  # the request changed posts, comments or tags
+
+
+_state = ContextVar('db_routing_state', default=None)  # None in commands and Celery tasks, they have no client
+
+
+def get_read_database():
+    """Returns a random replica or the primary if there are no replicas or the client is pinned"""
+    state = _state.get()
+    if not settings.DATABASE_REPLICAS or state is not None and (state.pinned or state.wrote):
+        return 'default'
+    return random.choice(settings.DATABASE_REPLICAS)
+
+
+@contextmanager
+def replica_reads():
+    """Sends reads of posts, comments and tags in the block to the replicas"""
+    token = _state.set(RoutingState()) if _state.get() is None else None
+    state = _state.get()
+    previous, state.replica = state.replica, True
+    try:
+        yield
+    finally:
+        state.replica = previous
+        if token is not None:
+            _state.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Database router of the primary and its replicas
+
+    Features:
+      * Reads of the routed apps go to a replica inside replica_reads(), other reads are not routed
+      * Writes go to the primary and pin the client of the request to it
+      * Objects of the primary and the replicas are the same data, relations between them are allowed
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is not None and state.replica and model._meta.app_label in ROUTED_APPS:
+            return get_read_database()
+        return None
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None and model._meta.app_label in ROUTED_APPS:
+            state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {'default', *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+@sync_and_async_middleware
+def replica_routing_middleware(get_response):
+    """
+    Sets up the routing of a request
+
+    Features:
+      * Views with replica_reads = True read from the replicas while they run and while their templates are rendered
+      * A request which wrote sets the pin cookie, a valid pin cookie sends all reads to the primary
+    """
+
+    def start(request):
+        pinned = request.get_signed_cookie(PIN_COOKIE, None, max_age=settings.REPLICA_PIN_SECONDS) is not None
+        request.db_routing = RoutingState(pinned)
+        return _state.set(request.db_routing)
+
+    def finish(request, response, token):
+        _state.reset(token)
+        if request.db_routing.wrote:
+            response.set_signed_cookie(PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True,
+                                       samesite='Lax')
+        return response
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            token = start(request)
+            return finish(request, await get_response(request), token)
+    else:
+        def middleware(request):
+            token = start(request)
+            return finish(request, get_response(request), token)
+
+    def process_view(request, view_func, view_args, view_kwargs):
+        if getattr(getattr(view_func, 'view_class', None), 'replica_reads', False):
+            request.db_routing.replica = True
+
+    middleware.process_view = process_view
+    return middleware
@@ -0,0 +1,28 @@
+"""
+Email backend of the project, EMAIL_BACKEND = 'blog.mail_backend.QueuedEmailBackend'.
+
+Sending an email only serializes it and puts it into the mail queue (blog/mail_queue.py), the deliver_mail beat
+task sends it over MAIL_DELIVERY_BACKEND. So a view which sends email, like the password reset, never waits for
+the SMTP server, and a slow or unavailable server only delays the queue.
+"""
+from functools import partial
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import transaction
+from blog import mail_queue
+
+
+class QueuedEmailBackend(BaseEmailBackend):
+    """
+    Email backend which queues messages
+
+    Features:
+      * Messages are serialized when they are sent, later changes of the objects do not change them
+      * Messages are queued when the transaction is committed, a rolled back request sends nothing
+      * Messages are written to the spool if Redis is unavailable
+    """
+
+    def send_messages(self, email_messages):
+        messages = [mail_queue.make_message(email) for email in email_messages if email.recipients()]
+        if messages:
+            transaction.on_commit(partial(mail_queue.enqueue, messages))
+        return len(messages)
@@ -0,0 +1,364 @@
+"""
+Queue of outgoing email.
+
+Every email of the project is sent with EMAIL_BACKEND = QueuedEmailBackend (blog/mail_backend.py), which puts
+the serialized message into the queue. The deliver_mail beat task takes messages in batches and sends a batch over
+one connection of MAIL_DELIVERY_BACKEND, so a batch costs one SMTP handshake instead of one per message.
+
+Every recipient domain may get MAIL_DOMAIN_RATE_LIMIT messages per minute, messages above the limit wait in the
+queue for the next batch. A failed message is retried alone with a growing delay, the rest of the batch is not
+sent again, and after MAIL_MAX_ATTEMPTS it is moved to the dead letters. Messages which can not be queued because
+Redis is unavailable are written to MAIL_SPOOL_DIR and queued by the next delivery.
+"""
+import base64
+import json
+import logging
+import os
+import smtplib
+import threading
+import time
+import uuid
+from collections import deque
+from email import message_from_string
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.utils.module_loading import import_string
+from redis import RedisError, WatchError
+from blog.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+def serialize_email(email):
+    """Returns a JSON-compatible dict of an EmailMessage or EmailMultiAlternatives"""
+    attachments = []
+    for attachment in email.attachments:
+        if hasattr(attachment, 'as_string'):  # a MIME part
+            attachments.append({'mime': attachment.as_string()})
+            continue
+        filename, content, mimetype = attachment
+        if isinstance(content, bytes):
+            attachments.append({'filename': filename, 'base64': base64.b64encode(content).decode(),
+                                'mimetype': mimetype})
+        else:
+            attachments.append({'filename': filename, 'content': content, 'mimetype': mimetype})
+    return {
+        'subject': email.subject,
+        'body': email.body,
+        'from_email': email.from_email,
+        'to': list(email.to),
+        'cc': list(email.cc),
+        'bcc': list(email.bcc),
+        'reply_to': list(email.reply_to),
+        'headers': email.extra_headers,
+        'content_subtype': email.content_subtype,
+        'alternatives': [list(alternative) for alternative in getattr(email, 'alternatives', [])],
+        'attachments': attachments,
+    }
+
+
+def deserialize_email(data, connection=None):
+    email = EmailMultiAlternatives(data['subject'], data['body'], data['from_email'], data['to'], data['bcc'],
+                                   connection, headers=data['headers'], cc=data['cc'], reply_to=data['reply_to'],
+                                   alternatives=[tuple(alternative) for alternative in data['alternatives']])
+    email.content_subtype = data['content_subtype']
+    for attachment in data['attachments']:
+        if 'mime' in attachment:
+            email.attach(message_from_string(attachment['mime']))
+        elif 'base64' in attachment:
+            email.attach(attachment['filename'], base64.b64decode(attachment['base64']), attachment['mimetype'])
+        else:
+            email.attach(attachment['filename'], attachment['content'], attachment['mimetype'])
+    return email
+
+
+def make_message(email):
+    return {'id': uuid.uuid4().hex, 'email': serialize_email(email), 'attempts': 0, 'not_before': 0}
+
+
+def get_domains(message):
+    email = message['email']
+    return {address.rpartition('@')[2].strip('> ').lower() for address in email['to'] + email['cc'] + email['bcc']}
+
+
+class MemoryMailQueue:
+    """
+    In-process mail queue
+
+    Features:
+      * Used in tests and in single-process development servers
+      * Every process has its own queue, so it must be delivered by the same process
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._delivery_lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._queue = deque()
+            self._sending = {}
+            self._rates = {}
+            self.dead_letters = []
+
+    def push(self, messages):
+        with self._lock:
+            self._queue.extend(messages)
+
+    def claim(self, count):
+        """Moves up to count messages aside and returns them, a batch which was not finished is returned first"""
+        with self._lock:
+            while self._queue and len(self._sending) < count:
+                message = self._queue.popleft()
+                self._sending[message['id']] = message
+            return list(self._sending.values())
+
+    def ack(self, message):
+        with self._lock:
+            self._sending.pop(message['id'], None)
+
+    def requeue(self, message):
+        with self._lock:
+            self._sending.pop(message['id'], None)
+            self._queue.append(message)
+
+    def bury(self, message):
+        with self._lock:
+            self._sending.pop(message['id'], None)
+            self.dead_letters.append(message)
+
+    def take_rates(self, domains, limit):
+        """Counts a message to every domain in the current minute, returns False and counts nothing above a limit"""
+        minute = int(time.time() // 60)
+        with self._lock:
+            if self._rates and next(iter(self._rates))[1] != minute:
+                self._rates = {}  # counters of the previous minutes
+            keys = [(domain, minute) for domain in domains]
+            if any(self._rates.get(key, 0) >= limit for key in keys):
+                return False
+            for key in keys:
+                self._rates[key] = self._rates.get(key, 0) + 1
+            return True
+
+    def lock(self):
+        """Returns a token of the delivery lock or None if another thread is delivering"""
+        return uuid.uuid4().hex if self._delivery_lock.acquire(blocking=False) else None
+
+    def refresh_lock(self, token):
+        return True
+
+    def unlock(self, token):
+        self._delivery_lock.release()
+
+    def __len__(self):
+        return len(self._queue)
+
+
+class RedisMailQueue:
+    """
+    Redis mail queue shared by all workers
+
+    Features:
+      * Messages are JSON strings in a list
+      * A claimed batch is moved to a second list with LMOVE in one transaction, a sent message is removed from it
+        alone, so a worker which dies in the middle of a batch neither loses it nor sends the delivered messages again
+      * Only one worker delivers at a time, the holder of the lock token, which it refreshes before every message
+    """
+    key = 'mail:queue'
+    sending_key = 'mail:sending'
+    dead_key = 'mail:dead'
+    lock_key = 'mail:lock'
+    lock_timeout = 5 * 60
+
+    def clear(self):
+        get_redis().delete(self.key, self.sending_key, self.dead_key)
+
+    def push(self, messages):
+        get_redis().rpush(self.key, *[json.dumps(message) for message in messages])
+
+    def claim(self, count):
+        """Moves up to count messages aside and returns them, a batch which was not finished is returned first"""
+        client = get_redis()
+        if not client.exists(self.sending_key):  # only the holder of the lock claims
+            with client.pipeline() as pipe:
+                for _ in range(count):
+                    pipe.lmove(self.key, self.sending_key, 'LEFT', 'RIGHT')  # None once the queue is empty
+                pipe.execute()
+        return [json.loads(raw) | {'raw': raw} for raw in client.lrange(self.sending_key, 0, -1)]
+
+    def ack(self, message):
+        get_redis().lrem(self.sending_key, 1, message['raw'])
+
+    def requeue(self, message):
+        raw = message.pop('raw')
+        with get_redis().pipeline() as pipe:
+            pipe.rpush(self.key, json.dumps(message))
+            pipe.lrem(self.sending_key, 1, raw)
+            pipe.execute()
+
+    def bury(self, message):
+        raw = message.pop('raw')
+        with get_redis().pipeline() as pipe:
+            pipe.rpush(self.dead_key, json.dumps(message))
+            pipe.lrem(self.sending_key, 1, raw)
+            pipe.execute()
+
+    def take_rates(self, domains, limit):
+        """
+        Counts a message to every domain in the current minute, returns False and counts nothing above a limit
+
+        The counters are checked and then increased, only the holder of the lock changes them.
+        """
+        minute = int(time.time() // 60)
+        keys = [f'mail:rate:{domain}:{minute}' for domain in domains]
+        client = get_redis()
+        if any(int(count or 0) >= limit for count in client.mget(keys)):
+            return False
+        with client.pipeline() as pipe:
+            for key in keys:
+                pipe.incr(key)
+                pipe.expire(key, 2 * 60)
+            pipe.execute()
+        return True
+
+    def lock(self):
+        """Returns a token of the delivery lock or None if another worker is delivering"""
+        token = uuid.uuid4().hex
+        return token if get_redis().set(self.lock_key, token, nx=True, ex=self.lock_timeout) else None
+
+    def _if_locked(self, token, command):
+        """Runs a command on the lock key if the lock still has the token, returns False if it expired"""
+        with get_redis().pipeline() as pipe:
+            try:
+                pipe.watch(self.lock_key)
+                if pipe.get(self.lock_key) != token:
+                    return False
+                pipe.multi()
+                command(pipe)
+                pipe.execute()
+            except WatchError:  # the lock changed after it was read
+                return False
+        return True
+
+    def refresh_lock(self, token):
+        """Extends the lock, returns False if it expired and another worker may deliver"""
+        return self._if_locked(token, lambda pipe: pipe.expire(self.lock_key, self.lock_timeout))
+
+    def unlock(self, token):
+        self._if_locked(token, lambda pipe: pipe.delete(self.lock_key))
+
+    def __len__(self):
+        return get_redis().llen(self.key)
+
+
+_queues = {
+    'memory': MemoryMailQueue(),
+    'redis': RedisMailQueue(),
+}
+
+
+def get_mail_queue():
+    """Returns the mail queue configured by MAIL_QUEUE_BACKEND"""
+    return _queues[settings.MAIL_QUEUE_BACKEND]
+
+
+def enqueue(messages):
+    """Queues messages, they are written to the spool if the queue is unavailable"""
+    try:
+        get_mail_queue().push(messages)
+    except RedisError:
+        logger.warning('Mail queue is unavailable, %s messages are spooled to %s', len(messages),
+                       settings.MAIL_SPOOL_DIR)
+        spool(messages)
+
+
+def spool(messages):
+    """Writes messages to MAIL_SPOOL_DIR, a file is replaced atomically, so a half written one is never queued"""
+    os.makedirs(settings.MAIL_SPOOL_DIR, exist_ok=True)
+    for message in messages:
+        path = os.path.join(settings.MAIL_SPOOL_DIR, f'{message["id"]}.json')
+        with open(f'{path}.tmp', 'w') as file:
+            json.dump(message, file)
+        os.replace(f'{path}.tmp', path)
+
+
+def queue_spooled(queue):
+    """Moves the spooled messages to the queue and returns their number"""
+    if not os.path.isdir(settings.MAIL_SPOOL_DIR):
+        return 0
+    names = [name for name in os.listdir(settings.MAIL_SPOOL_DIR) if name.endswith('.json')]
+    for name in names:
+        path = os.path.join(settings.MAIL_SPOOL_DIR, name)
+        with open(path) as file:
+            queue.push([json.load(file)])
+        os.remove(path)
+    return len(names)
+
+
+def _retry(queue, message, error):
+    """Puts a failed message back with a growing delay or buries it after the last attempt"""
+    message['attempts'] += 1
+    permanent = isinstance(error, smtplib.SMTPRecipientsRefused) and all(
+        code >= 500 for code, _ in error.recipients.values())  # 4xx replies are temporary
+    if permanent or message['attempts'] >= settings.MAIL_MAX_ATTEMPTS:
+        logger.error('Mail to %s is not delivered after %s attempts: %s', ', '.join(message['email']['to']),
+                     message['attempts'], error)
+        queue.bury(message)
+    else:
+        message['not_before'] = time.time() + settings.MAIL_RETRY_DELAY * 2 ** (message['attempts'] - 1)
+        queue.requeue(message)
+
+
+def deliver(batch_size=None):
+    """
+    Sends a batch of queued messages over one connection and returns the number of sent messages
+
+    Features:
+      * Messages of a domain above its rate limit and messages waiting for a retry stay in the queue
+      * A failed message is retried alone, a dropped connection is opened again for the next message
+      * A connection which can not be opened leaves the batch claimed, the next delivery sends it
+      * The lock is refreshed before every message, a delivery which lost it stops
+    """
+    from blog.mail_backend import QueuedEmailBackend  # the backend module imports this one
+    if issubclass(import_string(settings.MAIL_DELIVERY_BACKEND), QueuedEmailBackend):
+        raise ImproperlyConfigured('MAIL_DELIVERY_BACKEND queues the messages again, set it to a sending backend')
+    queue = get_mail_queue()
+    token = queue.lock()
+    if token is None:  # another worker is delivering
+        return 0
+    try:
+        queue_spooled(queue)
+        messages = queue.claim(batch_size or settings.MAIL_BATCH_SIZE)
+        if not messages:
+            return 0
+        now = time.time()
+        ready = []
+        for message in messages:
+            if message['not_before'] > now or not queue.take_rates(get_domains(message),
+                                                                   settings.MAIL_DOMAIN_RATE_LIMIT):
+                queue.requeue(message)  # waits for the next batch, it is not an attempt
+            else:
+                ready.append(message)
+        if not ready:
+            return 0
+        sent = 0
+        with get_connection(settings.MAIL_DELIVERY_BACKEND) as connection:
+            for position, message in enumerate(ready):
+                if not queue.refresh_lock(token):  # the lock expired, the claimed rest is sent by its new holder
+                    logger.warning('Mail delivery lock expired, %s messages are left to the next delivery',
+                                   len(ready) - position)
+                    break
+                try:
+                    deserialize_email(message['email'], connection).send()
+                except (smtplib.SMTPException, OSError) as error:
+                    if isinstance(error, smtplib.SMTPServerDisconnected):
+                        connection.close()  # the next message opens a new connection
+                    _retry(queue, message, error)
+                else:
+                    queue.ack(message)
+                    sent += 1
+        return sent
+    finally:
+        queue.unlock(token)
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from blog import db_pool
+
+
+class Command(BaseCommand):
+    help = 'Shows checkouts, waits and timeouts of the database connection pools of all web and Celery workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Resets the counters after they are shown.')
+
+    def handle(self, *args, **options):
+        if not settings.DB_POOL:
+            self.stdout.write(self.style.WARNING('Connection pooling is disabled, counters are not collected'))
+        stats = db_pool.get_stats()
+        mean_wait = 'n/a' if stats['mean_wait_ms'] is None else f'{stats["mean_wait_ms"]:.1f} ms'
+        self.stdout.write(f'Database pools: {stats["checkouts"]} checkouts, {stats["waits"]} waits '
+                          f'(mean wait {mean_wait}), {stats["timeouts"]} timeouts, '
+                          f'{stats["connection_errors"]} connection errors, {stats["connections_lost"]} lost connections')
+        if options['reset']:
+            db_pool.reset_stats()
+            self.stdout.write(self.style.SUCCESS('Counters are reset'))
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from blog import task_stats
+
+
+class Command(BaseCommand):
+    help = 'Shows throughput, waits in the queue, run times and failures of the tasks of every Celery queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Resets the counters after they are shown.')
+
+    def handle(self, *args, **options):
+        queues = list(settings.TASK_QUEUES)
+        stats = task_stats.get_stats(queues)
+        backlog = task_stats.get_backlog(queues)
+        if backlog is None:
+            self.stdout.write(self.style.WARNING('Broker is unavailable, waiting tasks are not shown'))
+        for queue, queue_stats in stats.items():
+            throughput = 'n/a' if queue_stats['throughput'] is None else f'{queue_stats["throughput"]:.2f}/s'
+            mean_wait = 'n/a' if queue_stats['mean_wait_ms'] is None else f'{queue_stats["mean_wait_ms"]:.1f} ms'
+            mean_run = 'n/a' if queue_stats['mean_run_ms'] is None else f'{queue_stats["mean_run_ms"]:.1f} ms'
+            waiting = 'n/a' if backlog is None else backlog[queue]
+            self.stdout.write(f'{queue}: {queue_stats["tasks"]} tasks ({throughput}), {queue_stats["failures"]} '
+                              f'failures, mean wait {mean_wait}, mean run {mean_run}, {waiting} waiting')
+        if options['reset']:
+            task_stats.reset_stats(queues)
+            self.stdout.write(self.style.SUCCESS('Counters are reset'))
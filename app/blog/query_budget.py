@@ -0,0 +1,105 @@
+"""
+Query budgets of views.
+
+A budget is the maximum number of SQL queries and the maximum total SQL time of one request to a url name,
+measured with a cold cache. Tests check the budgets with QueryBudgetMixin, a budget which is exceeded fails
+the test and lists the queries of the request with the repeated ones first, which usually points to an N+1.
+"""
+import re
+from collections import Counter, namedtuple
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+Budget = namedtuple('Budget', ['queries', 'time_ms'])
+
+QUERY_BUDGETS = {
+    # a request of a logged in user loads its session and user with 2 queries
+    'home': Budget(queries=10, time_ms=250),  # the side panels fall back to the database without leaderboards
+    'search': Budget(queries=12, time_ms=250),  # the tag cloud is 1 query with a cold cache
+    'about': Budget(queries=6, time_ms=250),  # the state of the post for the ETag is 1 query
+    'create': Budget(queries=2, time_ms=100),
+    'edit': Budget(queries=6, time_ms=100),
+    'comment_add': Budget(queries=7, time_ms=250),
+    'post_send': Budget(queries=2, time_ms=100),
+    'profile': Budget(queries=3, time_ms=100),
+    'password_change': Budget(queries=2, time_ms=100),
+    'login': Budget(queries=1, time_ms=50),  # the current site, it is cached by the process after the first request
+    'register': Budget(queries=1, time_ms=50),
+    'sitemap': Budget(queries=3, time_ms=250),
+}
+
+LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+IN_LIST_RE = re.compile(r'\bIN \((?:\?, )*\?\)')
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def normalize_sql(sql):
+    """Replaces literals of a query, queries which differ by parameters only become equal"""
+    return IN_LIST_RE.sub('IN (...)', LITERAL_RE.sub('?', sql))
+
+
+def format_queries(queries):
+    """Lists the repeated queries and then all queries of a request"""
+    lines = []
+    repeated = [(sql, count) for sql, count in Counter(normalize_sql(query['sql']) for query in queries).most_common()
+                if count > 1]
+    if repeated:
+        lines.append('Repeated queries:')
+        lines.extend(f'  {count}x {sql}' for sql, count in repeated)
+    lines.append('Queries:')
+    lines.extend(f'  {number}. ({float(query["time"]) * 1000:.1f} ms) {query["sql"]}'
+                 for number, query in enumerate(queries, 1))
+    return '\n'.join(lines)
+
+
+def check_budget(name, queries, budget):
+    """Raises QueryBudgetExceeded if the captured queries exceed the budget"""
+    time_ms = sum(float(query['time']) for query in queries) * 1000
+    if len(queries) > budget.queries or time_ms > budget.time_ms:
+        raise QueryBudgetExceeded(
+            f'{name}: {len(queries)} queries (budget {budget.queries}), '
+            f'{time_ms:.1f} ms of SQL (budget {budget.time_ms} ms)\n{format_queries(queries)}')
+
+
+class QueryBudgetMixin:
+    """
+    Assertions of query budgets for TestCase
+
+    Features:
+      * assertQueryBudget requests a url name and checks it against QUERY_BUDGETS or a given budget
+      * assertConstantQueries grows the dataset between requests and checks the query count does not grow
+    """
+
+    def request_queries(self, url, method='get', data=None):
+        """Requests a url with a cold cache, returns the response and the captured queries"""
+        cache.clear()
+        with CaptureQueriesContext(connection) as captured:
+            response = getattr(self.client, method)(url, data)
+        return response, captured.captured_queries
+
+    def assertQueryBudget(self, url_name, args=None, query_string='', method='get', data=None, budget=None):
+        budget = budget or QUERY_BUDGETS[url_name]
+        response, queries = self.request_queries(reverse(url_name, args=args) + query_string, method, data)
+        self.assertLess(response.status_code, 400)
+        check_budget(url_name, queries, budget)
+        return response
+
+    def assertConstantQueries(self, url_name, grow, sizes=(1, 10, 30), args=None, query_string=''):
+        """Calls grow(size) to extend the dataset to every size and checks the requests run the same queries"""
+        url = reverse(url_name, args=args) + query_string
+        first = None
+        for size in sizes:
+            grow(size)
+            response, queries = self.request_queries(url)
+            self.assertLess(response.status_code, 400)
+            if first is None:
+                first = queries
+            elif len(queries) != len(first):
+                raise QueryBudgetExceeded(
+                    f'{url_name}: {len(first)} queries with a dataset of size {sizes[0]}, {len(queries)} queries '
+                    f'with size {size}\n{format_queries(queries)}')
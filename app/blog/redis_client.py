@@ -0,0 +1,16 @@
+import redis
+from django.conf import settings
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def get_redis(url=None):
+    """
+    Returns a shared Redis client
+
+    Features:
+      * One connection pool per url for the whole process
+      * Short timeouts, so an unavailable Redis never pins a worker
+    """
+    return redis.Redis.from_url(url or settings.REDIS_URL, socket_connect_timeout=1, socket_timeout=1,
+                                decode_responses=True)
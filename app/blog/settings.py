@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 from dotenv import load_dotenv
+from kombu import Exchange, Queue
 import os
 import sys
 
@@ -51,8 +52,10 @@ INSTALLED_APPS = [
     'django_recaptcha',
     'social_django',
     'taggit',
+    'blog',
     'post',
     'accounts',
+    'outbox',
 ]
 
 MIDDLEWARE = [
@@ -63,6 +66,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'blog.db_router.replica_routing_middleware',
 ]
 
 DEBUG_TOOLBAR_CONFIG = {}
@@ -75,6 +79,10 @@ if DEBUG:
 
 ROOT_URLCONF = 'blog.urls'
 
+# 'wsgi' runs gunicorn with sync workers, 'asgi' runs uvicorn workers and the async home and post views
+SERVER_MODE = os.getenv('SERVER_MODE') or 'wsgi'
+ASYNC_VIEWS = SERVER_MODE == 'asgi'
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -109,6 +117,46 @@ DATABASES = {
     }
 }
 
+# Pooled connections of psycopg 3 on PostgreSQL, the sizes are per process (a gunicorn or a Celery worker)
+DB_POOL = os.getenv('DB_POOL', 'True') == 'True' and 'postgresql' in (DATABASES['default']['ENGINE'] or '')
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE') or 2)
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE') or 10)
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT') or 10)  # seconds a request waits for a free connection
+DB_POOL_MAX_IDLE = float(os.getenv('DB_POOL_MAX_IDLE') or 10 * 60)  # idle connections above min size are closed
+DB_POOL_STATS_INTERVAL = int(os.getenv('DB_POOL_STATS_INTERVAL') or 30)  # seconds between publishing pool metrics
+
+if DB_POOL:
+    from psycopg_pool import ConnectionPool
+
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': DB_POOL_MIN_SIZE,
+            'max_size': DB_POOL_MAX_SIZE,
+            'timeout': DB_POOL_TIMEOUT,
+            'max_idle': DB_POOL_MAX_IDLE,
+            'check': ConnectionPool.check_connection,  # a connection broken while idle is replaced on checkout
+        },
+    }
+else:
+    # without a pool a connection is kept for 60 seconds and checked before it is reused
+    DATABASES['default']['CONN_MAX_AGE'] = int(os.getenv('DB_CONN_MAX_AGE') or 60)
+    DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
+# Read replicas of the default database, comma separated host[:port] or, with SQLite, paths of copies of the
+# database file. Reads of the feed, post pages, sitemaps and leaderboards go to them, see blog/db_router.py
+DATABASE_REPLICAS = []
+for number, replica in enumerate(filter(None, (os.getenv('DB_REPLICAS') or '').split(',')), 1):
+    if 'sqlite' in (DATABASES['default']['ENGINE'] or ''):
+        location = {'NAME': replica}
+    else:
+        host, _, port = replica.partition(':')
+        location = {'HOST': host, 'PORT': port or DATABASES['default']['PORT']}
+    DATABASES[f'replica{number}'] = {**DATABASES['default'], **location, 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['blog.db_router.ReplicaRouter']
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS') or 5)  # reads of a client who wrote go to the primary
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -156,7 +204,9 @@ LOGIN_URL = '/accounts/login/'
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = "/"
 
-EMAIL_BACKEND = os.getenv('EMAIL_BACKEND')
+EMAIL_BACKEND = 'blog.mail_backend.QueuedEmailBackend'  # email is queued and sent by the deliver_mail task
+# backend which sends the queued email
+MAIL_DELIVERY_BACKEND = os.getenv('EMAIL_BACKEND') or 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS')
 EMAIL_HOST = os.getenv('EMAIL_HOST')
 EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
@@ -178,6 +228,18 @@ SOCIAL_AUTH_GITHUB_SECRET = os.getenv('SOCIAL_AUTH_GITHUB_SECRET')
 SOCIAL_AUTH_GOOGLE_OAUTH2_KEY = os.getenv('SOCIAL_AUTH_GOOGLE_OAUTH2_KEY')
 SOCIAL_AUTH_GOOGLE_OAUTH2_SECRET = os.getenv('SOCIAL_AUTH_GOOGLE_OAUTH2_SECRET')
 
+# Text search configuration of PostgreSQL full-text search
+SEARCH_CONFIG = os.getenv('SEARCH_CONFIG') or 'english'
+
+# 'database' uses full-text search on PostgreSQL and icontains elsewhere, 'index' uses the inverted index file
+SEARCH_BACKEND = os.getenv('SEARCH_BACKEND') or 'database'
+SEARCH_INDEX_PATH = os.getenv('SEARCH_INDEX_PATH') or BASE_DIR / 'search_index' / 'posts.idx'
+SEARCH_INDEX_MAX_RESULTS = 1000
+
+# 'database' filters the feed by tags with joins, 'index' uses the tag bitmaps of the tag index file
+TAG_FILTER_BACKEND = os.getenv('TAG_FILTER_BACKEND') or 'database'
+TAG_INDEX_PATH = os.getenv('TAG_INDEX_PATH') or BASE_DIR / 'search_index' / 'tags.idx'
+
 CACHES = {
     'default': {
         'BACKEND': os.getenv('CACHE_BACKEND'),
@@ -188,5 +250,114 @@ CACHES = {
 REDIS_HOST = os.getenv('REDIS_HOST')
 REDIS_PORT = os.getenv('REDIS_PORT')
 BROKER_URL = 'redis://' + REDIS_HOST + ':' + REDIS_PORT + '/0'
-BROKER_TRANSPORT_OPTIONS = {'visibility_timeout': 3600}
+BROKER_TRANSPORT_OPTIONS = {
+    'visibility_timeout': 3600,
+    'queue_order_strategy': 'priority',  # a worker takes the tasks of priority 0 first, then 1, ... 9
+    'priority_steps': list(range(10)),
+    'sep': ':',
+}
+BROKER_CONNECTION_RETRY_ON_STARTUP = True
 CELERY_RESULT_BACKEND = 'redis://' + REDIS_HOST + ':' + REDIS_PORT + '/0'
+CELERY_IGNORE_RESULT = True  # no caller reads the results of tasks
+REDIS_URL = os.getenv('REDIS_URL') or 'redis://' + REDIS_HOST + ':' + REDIS_PORT + '/1'
+
+# Post views are buffered ('redis' or 'memory' for a single process) and flushed by the beat task below
+VIEW_COUNTER_BACKEND = os.getenv('VIEW_COUNTER_BACKEND') or 'redis'
+VIEW_COUNTER_FLUSH_INTERVAL = int(os.getenv('VIEW_COUNTER_FLUSH_INTERVAL') or 10)
+
+# Most viewed and most commented posts are kept in Redis sorted sets ('redis' or 'memory')
+LEADERBOARD_BACKEND = os.getenv('LEADERBOARD_BACKEND') or 'redis'
+LEADERBOARD_RECONCILE_INTERVAL = int(os.getenv('LEADERBOARD_RECONCILE_INTERVAL') or 60 * 60)
+
+# Sitemap files are pre-rendered to SITEMAP_ROOT by the beat task below and served by nginx
+SITEMAP_ROOT = BASE_DIR / 'sitemaps'
+SITEMAP_URL = '/sitemaps/'
+SITEMAP_PAGE_SIZE = int(os.getenv('SITEMAP_PAGE_SIZE') or 10000)  # posts per page by primary key, at most 50000
+SITEMAP_GZIP = os.getenv('SITEMAP_GZIP', 'True') == 'True'
+SITEMAP_DOMAIN = os.getenv('SITEMAP_DOMAIN')  # the domain of the current Site by default
+SITEMAP_PROTOCOL = os.getenv('SITEMAP_PROTOCOL') or 'https'
+SITEMAP_REFRESH_INTERVAL = int(os.getenv('SITEMAP_REFRESH_INTERVAL') or 5 * 60)
+
+# Outgoing email is queued ('redis' or 'memory' for a single process) and sent in batches by the beat task below
+MAIL_QUEUE_BACKEND = os.getenv('MAIL_QUEUE_BACKEND') or 'redis'
+MAIL_DELIVERY_INTERVAL = int(os.getenv('MAIL_DELIVERY_INTERVAL') or 5)
+MAIL_BATCH_SIZE = int(os.getenv('MAIL_BATCH_SIZE') or 100)  # messages sent over one SMTP connection
+MAIL_DOMAIN_RATE_LIMIT = int(os.getenv('MAIL_DOMAIN_RATE_LIMIT') or 100)  # messages per minute to one domain
+MAIL_MAX_ATTEMPTS = int(os.getenv('MAIL_MAX_ATTEMPTS') or 5)
+MAIL_RETRY_DELAY = int(os.getenv('MAIL_RETRY_DELAY') or 60)  # seconds before the first retry, doubled after it
+MAIL_SPOOL_DIR = os.getenv('MAIL_SPOOL_DIR') or BASE_DIR / 'mail_spool'  # email which could not be queued
+
+# Tasks of views and signals are written to the outbox table and sent to the broker by the beat task below
+OUTBOX_RELAY_INTERVAL = float(os.getenv('OUTBOX_RELAY_INTERVAL') or 1)
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE') or 500)  # tasks sent over one broker connection
+
+# Periodic tasks expire after their interval, a run which waited longer is replaced by the next one
+CELERYBEAT_SCHEDULE = {
+    'flush-post-views': {
+        'task': 'post.tasks.flush_post_views',
+        'schedule': VIEW_COUNTER_FLUSH_INTERVAL,
+        'options': {'expires': VIEW_COUNTER_FLUSH_INTERVAL},
+    },
+    'reconcile-leaderboards': {
+        'task': 'post.tasks.reconcile_leaderboards',
+        'schedule': LEADERBOARD_RECONCILE_INTERVAL,
+        'options': {'expires': LEADERBOARD_RECONCILE_INTERVAL},
+    },
+    'refresh-sitemaps': {
+        'task': 'post.tasks.refresh_sitemaps',
+        'schedule': SITEMAP_REFRESH_INTERVAL,
+        'options': {'expires': SITEMAP_REFRESH_INTERVAL},
+    },
+    'deliver-mail': {
+        'task': 'accounts.tasks.deliver_mail',
+        'schedule': MAIL_DELIVERY_INTERVAL,
+        'options': {'expires': MAIL_DELIVERY_INTERVAL},
+    },
+    'relay-outbox': {
+        'task': 'outbox.tasks.relay_outbox',
+        'schedule': OUTBOX_RELAY_INTERVAL,
+        'options': {'expires': OUTBOX_RELAY_INTERVAL},
+    },
+}
+
+# Celery queues, every queue has its own workers (see docker-compose.prod.yml):
+#   email - sending and queueing of email, acks late, prefetch 1, so a slow SMTP server holds one task per process
+#   counters - frequent short jobs of view counters, leaderboards and the outbox, a lost run is redone by the next
+#   media - processing of images, acks late, prefetch 1
+#   maintenance - long periodic jobs, acks late, prefetch 1
+# Tasks of a queue are {task: priority}, 0 is the highest priority
+TASK_QUEUES = {
+    'email': {
+        'acks_late': True,
+        'tasks': {
+            'accounts.tasks.send_email': 0,  # the user waits for the activation link
+            'post.tasks.post_share': 3,
+            'accounts.tasks.deliver_mail': 3,
+        },
+    },
+    'counters': {
+        'acks_late': False,
+        'tasks': {
+            'outbox.tasks.relay_outbox': 0,
+            'post.tasks.flush_post_views': 3,
+            'post.tasks.reconcile_leaderboards': 6,
+        },
+    },
+    'media': {
+        'acks_late': True,
+        'tasks': {},
+    },
+    'maintenance': {
+        'acks_late': True,
+        'tasks': {
+            'post.tasks.refresh_sitemaps': 6,
+        },
+    },
+}
+CELERY_QUEUES = [Queue(name, Exchange(name), routing_key=name) for name in TASK_QUEUES]
+CELERY_DEFAULT_QUEUE = 'maintenance'  # tasks without a route
+CELERY_ROUTES = {task: {'queue': name, 'priority': priority}
+                 for name, queue in TASK_QUEUES.items() for task, priority in queue['tasks'].items()}
+CELERY_ANNOTATIONS = {task: {'acks_late': queue['acks_late']}
+                      for queue in TASK_QUEUES.values() for task in queue['tasks']}
+TASK_STATS_INTERVAL = int(os.getenv('TASK_STATS_INTERVAL') or 30)  # seconds between publications of task counters
@@ -0,0 +1,8 @@
+from django.core.signals import request_finished
+from django.dispatch import receiver
+from blog import db_pool
+
+
+@receiver(request_finished)
+def db_pool_stats_publish(sender, **kwargs):
+    db_pool.publish_stats()  # at most once per DB_POOL_STATS_INTERVAL
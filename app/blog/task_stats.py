@@ -0,0 +1,124 @@
+"""
+Throughput and latency of the Celery queues.
+
+A task is stamped with the time it was sent, the worker which runs it counts the task for its queue: the wait in
+the queue, the run time and failures. Like the pool metrics of blog/db_pool.py, the counters are kept by the
+process and added to shared counters in the cache at most once per TASK_STATS_INTERVAL seconds, the task_stats
+command shows the totals of every queue and the number of tasks waiting in the broker.
+"""
+import threading
+import time
+from collections import Counter
+from django.conf import settings
+from django.core.cache import cache
+from kombu.exceptions import ChannelError, OperationalError
+
+SENT_HEADER = 'sent_at'
+COUNTERS = ['tasks', 'failures', 'wait_ms', 'run_ms']
+STATS_KEY = 'task_stats:{}:{}'
+SINCE_KEY = 'task_stats:since'
+
+_lock = threading.Lock()
+_counters = Counter()  # (queue, counter): value of the process, not published yet
+_started = {}  # task_id: (queue, start of the run)
+_last_published = 0.0
+
+
+def stamp(headers):
+    """Adds the time of sending to the headers of a task message"""
+    headers[SENT_HEADER] = time.time()
+
+
+def task_started(task):
+    """Counts the wait of a task in its queue, eager tasks and tasks with an ETA are not counted"""
+    request = task.request
+    queue = (request.delivery_info or {}).get('routing_key')
+    if request.is_eager or not queue:
+        return
+    sent_at = getattr(request, SENT_HEADER, None)
+    with _lock:
+        _started[request.id] = (queue, time.monotonic())
+        if sent_at and not request.eta:
+            _counters[queue, 'wait_ms'] += max(time.time() - sent_at, 0) * 1000
+
+
+def task_finished(task_id, state):
+    started = _started.pop(task_id, None)
+    if started is None:
+        return
+    queue, start = started
+    with _lock:
+        _counters[queue, 'tasks'] += 1
+        _counters[queue, 'run_ms'] += (time.monotonic() - start) * 1000
+        if state == 'FAILURE':
+            _counters[queue, 'failures'] += 1
+
+
+def _add(key, value):
+    try:
+        cache.incr(key, value)
+    except ValueError:  # the counter does not exist yet or was evicted
+        if not cache.add(key, value, None):
+            cache.incr(key, value)
+
+
+def publish_stats(force=False):
+    """Adds the counters of the process to the shared counters, at most once per TASK_STATS_INTERVAL seconds"""
+    global _last_published
+    now = time.monotonic()
+    if not force and now - _last_published < settings.TASK_STATS_INTERVAL:
+        return
+    _last_published = now
+    with _lock:
+        counters = dict(_counters)
+        _counters.clear()
+    if not counters:
+        return
+    cache.add(SINCE_KEY, time.time(), None)
+    for (queue, counter), value in counters.items():
+        if value:
+            _add(STATS_KEY.format(queue, counter), round(value))  # counters of memcached are integers
+
+
+def get_backlog(queues):
+    """Returns {queue: number of tasks waiting in the broker} or None if the broker is unavailable"""
+    from blog_celery import app
+    backlog = {}
+    try:
+        with app.connection_for_read() as connection:
+            connection.ensure_connection(max_retries=1)
+            channel = connection.default_channel
+            for queue in queues:
+                try:
+                    backlog[queue] = channel.queue_declare(queue, passive=True).message_count
+                except ChannelError:  # the queue was never used
+                    backlog[queue] = 0
+    except OperationalError:
+        return None
+    return backlog
+
+
+def get_stats(queues):
+    """
+    Returns {queue: counters} of the shared counters
+
+    Features:
+      * throughput is tasks per second since the first publication after a reset
+      * mean_wait_ms and mean_run_ms are None for a queue without tasks
+    """
+    keys = [STATS_KEY.format(queue, counter) for queue in queues for counter in COUNTERS]
+    values = cache.get_many(keys + [SINCE_KEY])
+    elapsed = time.time() - values[SINCE_KEY] if SINCE_KEY in values else None
+    stats = {}
+    for queue in queues:
+        queue_stats = {counter: values.get(STATS_KEY.format(queue, counter), 0) for counter in COUNTERS}
+        tasks = queue_stats['tasks']
+        queue_stats['throughput'] = tasks / elapsed if elapsed else None
+        queue_stats['mean_wait_ms'] = queue_stats['wait_ms'] / tasks if tasks else None
+        queue_stats['mean_run_ms'] = queue_stats['run_ms'] / tasks if tasks else None
+        stats[queue] = queue_stats
+    return stats
+
+
+def reset_stats(queues):
+    cache.delete_many([STATS_KEY.format(queue, counter) for queue in queues for counter in COUNTERS] + [SINCE_KEY])
@@ -19,14 +19,39 @@ from django.urls import path, include
 from django.conf.urls.static import static
 from django.conf import settings
 from django.shortcuts import render
+from django.http import FileResponse, Http404
+from django.utils._os import safe_join
 from post.sitemaps import PostSitemap
-from django.contrib.sitemaps.views import sitemap
+from django.contrib.sitemaps.views import index, sitemap
+import os
 
 sitemaps = {
     'posts': PostSitemap,
 }
 
 
+def sitemap_file(request, name='sitemap.xml'):
+    """
+    Serves pre-rendered sitemap files when nginx does not
+
+    Features:
+      * Sends the gzipped copy of a file to clients which accept gzip
+      * Renders the index dynamically if the files are not built yet
+    """
+    path = safe_join(settings.SITEMAP_ROOT, name)
+    if not os.path.exists(path):
+        if name == 'sitemap.xml':
+            return index(request, sitemaps, sitemap_url_name='sitemap_section')
+        raise Http404('Sitemap not found')
+    if 'gzip' in request.headers.get('Accept-Encoding', '') and os.path.exists(f'{path}.gz'):
+        response = FileResponse(open(f'{path}.gz', 'rb'), content_type='application/xml')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = FileResponse(open(path, 'rb'), content_type='application/xml')
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
 def error_view(request, exception=None, code=500, message="Server error"):
     return render(request, 'errors/error_page.html', {'code': code, 'message': message}, status=code)
 
@@ -51,7 +76,9 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('post.urls')),
     path('accounts/', include('accounts.urls')),
-    path('sitemap.xml', sitemap, {'sitemaps': sitemaps}),
+    path('sitemap.xml', sitemap_file, name='sitemap'),
+    path('sitemaps/<str:name>', sitemap_file, name='sitemap_file'),
+    path('sitemap-<section>.xml', sitemap, {'sitemaps': sitemaps}, name='sitemap_section'),
     path('__debug__/', include('debug_toolbar.urls'))
 ]
 
@@ -1,7 +1,48 @@
 import os
 from celery import Celery
+from celery.signals import before_task_publish, task_postrun, task_prerun, worker_init, worker_process_shutdown
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'blog.settings')
-app = Celery('emails', broker_connection_rety=False, broker_connection_rety_on_startup=True)
+app = Celery('blog')
 app.config_from_object('django.conf:settings')
 app.autodiscover_tasks()
+
+
+@worker_init.connect
+def close_database_pools(**kwargs):
+    """The main process closes its database pools before it forks the pool of workers"""
+    from blog.db_pool import close_pools
+    close_pools()
+
+
+@task_postrun.connect
+def publish_database_pool_stats(**kwargs):
+    from blog.db_pool import publish_stats
+    publish_stats()
+
+
+@before_task_publish.connect
+def stamp_task(headers=None, **kwargs):
+    """Stamps a task with the time it was sent, the worker measures the wait of the task in its queue"""
+    from blog.task_stats import stamp
+    stamp(headers)
+
+
+@task_prerun.connect
+def count_task_start(task=None, **kwargs):
+    from blog.task_stats import task_started
+    task_started(task)
+
+
+@task_postrun.connect
+def count_task_finish(task_id=None, state=None, **kwargs):
+    from blog.task_stats import publish_stats, task_finished
+    task_finished(task_id, state)
+    publish_stats()
+
+
+@worker_process_shutdown.connect
+def publish_task_stats(**kwargs):
+    """A stopped worker process publishes the counters of its last tasks"""
+    from blog.task_stats import publish_stats
+    publish_stats(force=True)
@@ -0,0 +1,22 @@
+"""
+Gunicorn settings of the web container.
+
+SERVER_MODE=wsgi (default) runs sync workers with blog.wsgi, SERVER_MODE=asgi runs uvicorn workers with blog.asgi
+and the async home and post views.
+"""
+import os
+
+bind = os.getenv('GUNICORN_BIND') or '0.0.0.0:8000'
+
+if (os.getenv('SERVER_MODE') or 'wsgi') == 'asgi':
+    wsgi_app = 'blog.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+else:
+    wsgi_app = 'blog.wsgi:application'
+
+
+def pre_fork(server, worker):
+    """With preload_app the master has loaded Django, workers must not inherit its database pools"""
+    if server.cfg.preload_app:
+        from blog.db_pool import close_pools
+        close_pools()
@@ -0,0 +1,10 @@
+from django.contrib import admin
+from outbox.models import OutboxTask
+
+
+@admin.register(OutboxTask)
+class OutboxTaskAdmin(admin.ModelAdmin):
+    list_display = ['task', 'task_id', 'created_at']
+    list_filter = ['task']
+    readonly_fields = ['task_id', 'created_at']
+    ordering = ['id']
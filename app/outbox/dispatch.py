@@ -0,0 +1,57 @@
+"""
+Transactional outbox of Celery tasks.
+
+Views and signals do not send tasks to the broker. enqueue() writes the task to the OutboxTask table in the
+transaction of the request, so a task exists only if the request committed, and its worker never runs before
+the rows it reads are committed. The relay_outbox beat task sends the written tasks to the broker in batches over
+one connection and deletes them.
+
+A task is sent at least once: if the relay stops after sending a batch and before its transaction is committed,
+the next relay sends the batch again. The task keeps its Celery id, so a repeated task can be recognized.
+"""
+import logging
+from django.conf import settings
+from django.db import transaction
+from kombu.exceptions import OperationalError
+from blog_celery import app
+from outbox.models import OutboxTask
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(task, *args, **kwargs):
+    """Writes a task to the outbox, it is the outbox version of task.delay(*args, **kwargs)"""
+    return OutboxTask.objects.create(task=task.name, args=list(args), kwargs=kwargs)
+
+
+def relay(batch_size=None):
+    """
+    Sends the oldest tasks of the outbox to the broker and returns the number of sent tasks
+
+    Features:
+      * Rows are locked with SKIP LOCKED, so relays of several workers send different batches
+      * A batch is sent over one broker connection and deleted in one query
+      * If the broker is unavailable, the sent tasks are deleted and the rest waits for the next relay
+    """
+    with transaction.atomic():
+        rows = list(OutboxTask.objects.select_for_update(skip_locked=True).order_by('pk')[
+                    :batch_size or settings.OUTBOX_BATCH_SIZE])
+        if not rows:
+            return 0
+        done = []
+        with app.producer_or_acquire() as producer:
+            for row in rows:
+                task = app.tasks.get(row.task)
+                if task is None:  # the task was renamed or removed, it can never be sent
+                    logger.error('Task %s of the outbox is not registered, it is dropped', row.task)
+                    done.append(row.pk)
+                    continue
+                try:
+                    task.apply_async(row.args, row.kwargs, task_id=str(row.task_id), producer=producer)
+                except OperationalError as error:
+                    logger.warning('Broker is unavailable, %s tasks stay in the outbox: %s',
+                                   len(rows) - len(done), error)
+                    break
+                done.append(row.pk)
+        OutboxTask.objects.filter(pk__in=done).delete()
+        return len(done)
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.5 on 2026-10-18 07:12
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task', models.CharField(help_text='Имя задачи Celery.', max_length=200)),
+                ('args', models.JSONField(default=list, help_text='Позиционные аргументы задачи.')),
+                ('kwargs', models.JSONField(default=dict, help_text='Именованные аргументы задачи.')),
+                ('task_id', models.UUIDField(default=uuid.uuid4, editable=False, help_text='Id задачи в Celery, повторная отправка задачи использует тот же id.')),
+                ('created_at', models.DateTimeField(auto_now_add=True, help_text='Дата записи задачи.')),
+            ],
+            options={
+                'verbose_name': 'Исходящая задача',
+                'verbose_name_plural': 'Исходящие задачи',
+            },
+        ),
+    ]
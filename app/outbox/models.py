@@ -0,0 +1,18 @@
+import uuid
+from django.db import models
+
+
+class OutboxTask(models.Model):
+    task = models.CharField(max_length=200, help_text='Имя задачи Celery.')
+    args = models.JSONField(default=list, help_text='Позиционные аргументы задачи.')
+    kwargs = models.JSONField(default=dict, help_text='Именованные аргументы задачи.')
+    task_id = models.UUIDField(default=uuid.uuid4, editable=False,
+                               help_text='Id задачи в Celery, повторная отправка задачи использует тот же id.')
+    created_at = models.DateTimeField(auto_now_add=True, help_text='Дата записи задачи.')
+
+    def __str__(self):
+        return f'{self.task} {self.task_id}'
+
+    class Meta:
+        verbose_name = 'Исходящая задача'
+        verbose_name_plural = 'Исходящие задачи'
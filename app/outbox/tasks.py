@@ -0,0 +1,7 @@
+from blog_celery import app
+from outbox.dispatch import relay
+
+
+@app.task(ignore_result=True)
+def relay_outbox():
+    return relay()
@@ -0,0 +1,81 @@
+from unittest import mock
+from kombu.exceptions import OperationalError
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core import mail
+from django.db import transaction
+from django.urls import reverse
+from accounts.tasks import send_email
+from blog_celery import app
+from outbox.dispatch import enqueue, relay
+from outbox.models import OutboxTask
+from post.models import Post
+from post.tasks import post_share
+
+
+class OutboxTests(TestCase):
+
+    def create_inactive_user(self, username='test-user'):
+        return User.objects.create_user(username=username, email=f'{username}@example.com', password='Assembler7002',
+                                        is_active=False)
+
+    def test_signal_writes_to_outbox(self):
+        with mock.patch.object(send_email, 'apply_async') as apply_async:
+            user = self.create_inactive_user()
+        apply_async.assert_not_called()  # the request does not talk to the broker
+        row = OutboxTask.objects.get()
+        self.assertEqual((row.task, row.args, row.kwargs), ('accounts.tasks.send_email', [user.pk], {}))
+
+    def test_rolled_back_request_sends_nothing(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                self.create_inactive_user()
+                raise RuntimeError
+        self.assertFalse(OutboxTask.objects.exists())
+
+    def test_relay_runs_the_task(self):
+        self.create_inactive_user()
+        app.conf.task_always_eager = True  # the task runs in the test process
+        self.addCleanup(setattr, app.conf, 'task_always_eager', False)
+        self.assertEqual(relay(), 1)
+        self.assertFalse(OutboxTask.objects.exists())
+        self.assertEqual(mail.outbox[0].to, ['test-user@example.com'])
+
+    def test_relay_sends_a_batch_with_the_outbox_ids(self):
+        users = [self.create_inactive_user(f'test-user-{i}') for i in range(3)]
+        task_ids = [str(task_id) for task_id in OutboxTask.objects.order_by('pk').values_list('task_id', flat=True)]
+        with mock.patch.object(send_email, 'apply_async') as apply_async:
+            self.assertEqual(relay(batch_size=2), 2)
+            self.assertEqual(relay(batch_size=2), 1)
+        self.assertEqual([call.args[0] for call in apply_async.call_args_list], [[user.pk] for user in users])
+        self.assertEqual([call.kwargs['task_id'] for call in apply_async.call_args_list], task_ids)
+        producers = {id(call.kwargs['producer']) for call in apply_async.call_args_list[:2]}
+        self.assertEqual(len(producers), 1)  # one broker connection per batch
+
+    def test_unavailable_broker_keeps_the_rest(self):
+        for i in range(3):
+            self.create_inactive_user(f'test-user-{i}')
+        with mock.patch.object(send_email, 'apply_async', side_effect=[None, OperationalError]):
+            self.assertEqual(relay(), 1)
+        self.assertEqual(OutboxTask.objects.count(), 2)
+
+    def test_unknown_task_is_dropped(self):
+        OutboxTask.objects.create(task='outbox.tasks.removed_task')
+        self.assertEqual(relay(), 1)
+        self.assertFalse(OutboxTask.objects.exists())
+
+    def test_post_share_is_written_to_outbox(self):
+        user = User.objects.create_user(username='author', password='Assembler7002')
+        post = Post.objects.create(author=user, title='test title', content='test content')
+        self.client.login(username='author', password='Assembler7002')
+        with mock.patch.object(post_share, 'apply_async') as apply_async:
+            self.client.post(reverse('post_send', args=[post.slug]),
+                             {'email': 'friend@example.com', 'description': 'test description'})
+        apply_async.assert_not_called()
+        row = OutboxTask.objects.get()
+        self.assertEqual(row.task, 'post.tasks.post_share')
+        self.assertEqual(row.args[0], 'test title')
+
+    def test_enqueue_keeps_keyword_arguments(self):
+        enqueue(send_email, pk=1)
+        self.assertEqual(OutboxTask.objects.get().kwargs, {'pk': 1})
@@ -0,0 +1,157 @@
+"""
+Async versions of the hot read views, served when the project runs under ASGI (SERVER_MODE=asgi).
+
+The views reuse the querysets, cache keys and ETags of post/views.py and only change how the data of a page
+is fetched: independent reads are awaited together with asyncio.gather. Reads of Redis (the leaderboards and
+the view buffer) run in worker threads and overlap. Database and cache reads go through the async ORM and cache
+APIs of Django, which run them in the one thread of the request, so they do not block the event loop but still
+run one after another.
+"""
+import asyncio
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.contrib.auth import get_user
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.cache import cache
+from django.http import Http404
+from django.utils.cache import get_conditional_response
+from post import card_cache, feed_cache, leaderboards, tag_cloud
+from post.counters import arecord_view
+from post.models import Post, Comment
+from post.pagination import KeysetPaginator, KeysetPage, InvalidCursor
+from post.views import HomeView, PostDetailView
+
+
+async def aget_user(request):
+    """
+    Loads the user of the session in the thread of the request
+
+    The lazy request.user can not be loaded in the event loop, and request.auser() needs aget_user() of the
+    authentication backend, which the social auth backends do not have.
+    """
+    return await sync_to_async(get_user)(request)
+
+
+def has_messages(request):
+    """Reads the pending messages, the session may be loaded from the database"""
+    return bool(len(messages.get_messages(request)))
+
+
+class AsyncHomeView(HomeView):
+    """
+    Async home view
+
+    Features:
+      * The versions of the feed and its panels and the pending messages are read together, a current client gets
+        304 without more reads
+      * The page of the feed, both leaderboards and the tag cloud are fetched concurrently
+      * Renders the same template and context as HomeView
+    """
+
+    async def get(self, request, *args, **kwargs):
+        """Redirects search queries, answers conditional requests and renders the page"""
+        if request.GET.get('content'):
+            return super().get(request, *args, **kwargs)  # the redirect does not read anything
+        request.user = await aget_user(request)
+        pending_messages, version, panels_version = await asyncio.gather(
+            sync_to_async(has_messages)(request), feed_cache.aget_version(), feed_cache.aget_panels_version())
+        etag = None
+        if not pending_messages:  # messages are shown once, the page must be rendered
+            etag = self.get_etag((version, panels_version))
+            response = get_conditional_response(request, etag=etag)
+            if response is not None:
+                return self.set_validators(response, etag)
+
+        self.object_list = self.get_queryset()
+        page, most_viewed, most_commented, cloud = await asyncio.gather(
+            self.apaginate_queryset(self.object_list, self.get_paginate_by(self.object_list), version),
+            leaderboards.amost_viewed(),
+            leaderboards.amost_commented(),
+            tag_cloud.aget_cloud(),
+        )
+        posts = page.object_list
+        context = {
+            'view': self,
+            'paginator': None,
+            'page_obj': page,
+            'is_paginated': page.has_other_pages(),
+            'object_list': posts,
+            self.context_object_name: posts,
+            'most_viewed_posts': most_viewed,
+            'most_commented_posts': most_commented,
+            'tag_cloud': cloud,
+            'cards': await sync_to_async(card_cache.get_cards)(posts),
+        }
+        response = self.render_to_response(context)
+        return self.set_validators(response, etag) if etag else response
+
+    async def apaginate_queryset(self, queryset, page_size, version=None):
+        """Async version of HomeView.paginate_queryset(), returns the page of hydrated posts"""
+        cursor = self.get_cursor()
+        key = feed_cache.page_key(self.get_feed_filters(), cursor, version)
+        cached_page = await cache.aget(key)
+        if cached_page is None:  # if the page is not cached, paginates ids and caches them
+            paginator = await sync_to_async(self.get_keyset_paginator)(queryset, page_size)  # may look up tag ids
+            page = await paginator.apage(cursor)
+            cached_page = {'ids': [post.pk for post in page], 'has_next': page.has_next(),
+                           'has_previous': page.has_previous()}
+            await cache.aset(key, cached_page, feed_cache.FEED_CACHE_TIMEOUT)
+        posts = await feed_cache.aget_posts(cached_page['ids'])
+        return KeysetPage(posts, cached_page['has_next'], cached_page['has_previous'])
+
+
+class AsyncPostDetailView(PostDetailView):
+    """
+    Async post detail view
+
+    Features:
+      * The state of the post for the ETag and the pending messages are read together
+      * The post, the first page of comments and the hit of the view buffer are fetched concurrently
+      * Renders the same template as PostDetailView, the comments are passed as a fetched page
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        """Checks the login with the loaded user, LoginRequiredMixin would load the user in the event loop"""
+        request.user = await aget_user(request)
+        if not request.user.is_authenticated:
+            return self.handle_no_permission()
+        return await super(LoginRequiredMixin, self).dispatch(request, *args, **kwargs)
+
+    async def get(self, request, *args, **kwargs):
+        """Answers conditional requests and renders the post with its comments"""
+        pending_messages, state = await asyncio.gather(
+            sync_to_async(has_messages)(request), self.get_state_queryset().afirst())
+        parts = self.set_post_state(state)
+        if parts is None:
+            raise Http404('No post found matching the query')
+        hit = Post(pk=state['pk'], views=state['views'])
+        etag = None
+        if not pending_messages:  # messages are shown once, the page must be rendered
+            etag = self.get_etag(parts)
+            response = get_conditional_response(request, etag=etag, last_modified=self.get_last_modified())
+            if response is not None:
+                if response.status_code == 304:
+                    await arecord_view(hit)  # the reader who has the current page is counted
+                return self.set_validators(response, etag)
+
+        post, comments, views = await asyncio.gather(
+            self.aget_object(), self.aget_comments(state['pk']), arecord_view(hit))
+        post.views = views  # shows the views including the hits which are not flushed yet
+        self.object = post
+        context = {'view': self, 'object': post, self.context_object_name: post, 'comments': comments}
+        response = self.render_to_response(context)
+        return self.set_validators(response, etag) if etag else response
+
+    async def aget_object(self):
+        try:
+            return await self.get_queryset().aget(**{self.slug_field: self.kwargs[self.slug_url_kwarg]})
+        except Post.DoesNotExist:  # the post was deleted after its state was read
+            raise Http404('No post found matching the query')
+
+    async def aget_comments(self, post_id):
+        """Returns the page of comments of the ?c= cursor, an invalid cursor shows the first page"""
+        paginator = KeysetPaginator(Comment.objects.filter(post_id=post_id).select_related('author'), 5)
+        try:
+            return await paginator.apage(self.request.GET.get('c'))
+        except InvalidCursor:
+            return await paginator.apage()
@@ -0,0 +1,282 @@
+"""
+Latency benchmark of the hot endpoints.
+
+An endpoint is measured in-process with the test client, which also counts SQL queries and cache hits
+of every request, or over HTTP against a running server (for example a local gunicorn). Results are
+plain dicts, so a run is stored as JSON and compared with a baseline run. Two servers of the same database,
+for example the WSGI and the ASGI mode, are compared by sending the same requests to both.
+"""
+import math
+import random
+import statistics
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from post.models import Post
+
+ENDPOINTS = ('home', 'about', 'search', 'tag', 'comment_add', 'sitemap')
+CSRF_TOKEN = 'benchmark' * 3 + 'token'  # any 32 characters are accepted if the cookie and the header are equal
+
+
+class CacheCounter:
+    """Counts hits and misses of the default cache of the current thread, nested calls are counted once"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._depth = 0
+        self._cache = caches['default']
+
+    def __enter__(self):
+        original_get, original_get_many = self._cache.get, self._cache.get_many
+        sentinel = object()
+
+        def get(key, default=None, version=None):
+            self._depth += 1
+            try:
+                value = original_get(key, sentinel, version=version)
+            finally:
+                self._depth -= 1
+            if self._depth == 0:
+                if value is sentinel:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+            return default if value is sentinel else value
+
+        def get_many(keys, version=None):
+            keys = list(keys)
+            self._depth += 1
+            try:
+                values = original_get_many(keys, version=version)
+            finally:
+                self._depth -= 1
+            if self._depth == 0:
+                self.hits += len(values)
+                self.misses += len(keys) - len(values)
+            return values
+
+        self._cache.get, self._cache.get_many = get, get_many
+        return self
+
+    def __exit__(self, *exc_info):
+        del self._cache.get, self._cache.get_many  # the methods of the class are visible again
+
+
+def get_memcached_stats():
+    """Returns (hits, misses) summed over the memcached servers of the default cache or None"""
+    if 'memcached' not in settings.CACHES['default']['BACKEND'].lower():
+        return None
+    from pymemcache.client.base import Client as MemcacheClient
+    locations = settings.CACHES['default']['LOCATION']
+    hits = misses = 0
+    for location in [locations] if isinstance(locations, str) else locations:
+        host, _, port = location.rpartition(':')
+        try:
+            stats = MemcacheClient((host, int(port)), connect_timeout=1, timeout=1).stats()
+        except (OSError, ValueError):
+            return None
+        hits += stats[b'get_hits']
+        misses += stats[b'get_misses']
+    return hits, misses
+
+
+def get_client_host():
+    """Returns a host of ALLOWED_HOSTS for the test client, its default host testserver is allowed only in tests"""
+    for host in settings.ALLOWED_HOSTS:
+        if host and host != '*':
+            return host.lstrip('.')  # .example.com also allows example.com
+    return 'localhost'  # allowed by '*' and by an empty ALLOWED_HOSTS with DEBUG
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return None
+    return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+
+def summarize(latencies, elapsed, queries=None, cache_hits=None, cache_misses=None, errors=0):
+    latencies = sorted(latencies)
+    lookups = (cache_hits or 0) + (cache_misses or 0)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'mean_ms': statistics.fmean(latencies) if latencies else None,
+        'throughput_rps': len(latencies) / elapsed if elapsed else None,
+        'queries_mean': statistics.fmean(queries) if queries else None,
+        'queries_max': max(queries) if queries else None,
+        'cache_hit_ratio': cache_hits / lookups if lookups and cache_hits is not None else None,
+    }
+
+
+class Benchmark:
+    """
+    Drives the endpoints against the data of the current database
+
+    Features:
+      * Post pages, tags and search words are picked at random from the dataset with a fixed seed
+      * Warmup requests fill the caches and are not measured
+      * Requests are sent one by one in-process and by a pool of threads over HTTP
+    """
+
+    def __init__(self, user, base_url=None, session_id=None, requests=200, warmup=20, concurrency=1, seed=0):
+        self.user = user
+        self.base_url = base_url.rstrip('/') if base_url else None
+        self.session_id = session_id
+        self.requests = requests
+        self.warmup = warmup
+        self.concurrency = concurrency
+        self.rng = random.Random(seed)
+        self.slugs = list(Post.objects.order_by('-created_at').values_list('slug', flat=True)[:1000])
+        self.tags = list(Post.tags.most_common()[:50].values_list('slug', flat=True))
+        self.words = list({word for title in Post.objects.values_list('title', flat=True)[:200]
+                           for word in title.lower().split() if len(word) > 3}) or ['post']
+        if not self.slugs:
+            raise ValueError('The database has no posts, generate a dataset with the generate_data command')
+
+    def make_request(self, endpoint):
+        """Returns (method, url, data) of a random request to the endpoint"""
+        if endpoint == 'home':
+            return 'GET', reverse('home'), None
+        if endpoint == 'about':
+            return 'GET', reverse('about', args=[self.rng.choice(self.slugs)]), None
+        if endpoint == 'search':
+            return 'GET', f'{reverse("search")}?content={self.rng.choice(self.words)}', None
+        if endpoint == 'tag':
+            return 'GET', f'{reverse("home")}?tag={self.rng.choice(self.tags or [""])}', None
+        if endpoint == 'comment_add':
+            return 'POST', reverse('comment_add', args=[self.rng.choice(self.slugs)]), {'content': 'Benchmark comment'}
+        if endpoint == 'sitemap':
+            return 'GET', '/sitemap.xml', None
+        raise ValueError(f'Unknown endpoint {endpoint}')
+
+    def run(self, endpoints):
+        return {endpoint: self.run_endpoint(endpoint) for endpoint in endpoints}
+
+    def run_endpoint(self, endpoint):
+        """Returns the metrics of the endpoint, raises ValueError if every request failed"""
+        requests = [self.make_request(endpoint) for _ in range(self.warmup + self.requests)]
+        if self.base_url:
+            metrics = self.run_http(requests[self.warmup:], requests[:self.warmup])
+        else:
+            metrics = self.run_in_process(requests[self.warmup:], requests[:self.warmup])
+        if metrics['requests'] and metrics['errors'] == metrics['requests']:
+            raise ValueError(f'Every request to {endpoint} failed, check ALLOWED_HOSTS and the logs of the server')
+        return metrics
+
+    def run_in_process(self, requests, warmup):
+        client = Client(SERVER_NAME=get_client_host())
+        client.force_login(self.user)
+        for method, url, data in warmup:
+            self.send(client, method, url, data)
+        latencies, queries, errors = [], [], 0
+        with CacheCounter() as cache_counter:
+            started = time.perf_counter()
+            for method, url, data in requests:
+                with CaptureQueriesContext(connection) as captured:
+                    request_started = time.perf_counter()
+                    status = self.send(client, method, url, data)
+                    latencies.append((time.perf_counter() - request_started) * 1000)
+                queries.append(len(captured))
+                errors += status >= 400
+            elapsed = time.perf_counter() - started
+        return summarize(latencies, elapsed, queries, cache_counter.hits, cache_counter.misses, errors)
+
+    @staticmethod
+    def send(client, method, url, data):
+        response = client.post(url, data) if method == 'POST' else client.get(url)
+        return response.status_code
+
+    def run_http(self, requests, warmup):
+        for method, url, data in warmup:
+            self.send_http(method, url, data)
+        stats_before = get_memcached_stats()
+
+        def timed(request):
+            request_started = time.perf_counter()
+            status = self.send_http(*request)
+            return (time.perf_counter() - request_started) * 1000, status
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(self.concurrency) as executor:
+            results = list(executor.map(timed, requests))
+        elapsed = time.perf_counter() - started
+        stats_after = get_memcached_stats()
+        hits = misses = None
+        if stats_before and stats_after:
+            hits, misses = stats_after[0] - stats_before[0], stats_after[1] - stats_before[1]
+        return summarize([latency for latency, _ in results], elapsed, cache_hits=hits, cache_misses=misses,
+                         errors=sum(status >= 400 for _, status in results))
+
+    def send_http(self, method, url, data):
+        """Sends a request with the session cookie, CSRF protection of a POST is satisfied with the CSRF cookie"""
+        headers = {'Cookie': f'sessionid={self.session_id}; csrftoken={CSRF_TOKEN}', 'X-CSRFToken': CSRF_TOKEN,
+                   'Referer': self.base_url}
+        body = urllib.parse.urlencode(data).encode() if data else None
+        request = urllib.request.Request(self.base_url + url, data=body, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as error:
+            return error.code
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns the regressions of results against a baseline
+
+    Features:
+      * A latency percentile regresses if it grows by more than the tolerance (0.2 is 20%)
+      * A query count regresses if it grows at all, the query count of an endpoint does not depend on timing
+      * More error responses are a regression, an endpoint which fails fast has low latencies
+    """
+    regressions = []
+    for endpoint, metrics in results.items():
+        base = baseline.get(endpoint)
+        if not base:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if metrics[metric] is not None and base.get(metric) and metrics[metric] > base[metric] * (1 + tolerance):
+                regressions.append(f'{endpoint} {metric}: {base[metric]:.1f} -> {metrics[metric]:.1f}')
+        if metrics['queries_max'] is not None and base.get('queries_max') is not None \
+                and metrics['queries_max'] > base['queries_max']:
+            regressions.append(f'{endpoint} queries_max: {base["queries_max"]} -> {metrics["queries_max"]}')
+        if metrics['errors'] > base.get('errors', 0):
+            regressions.append(f'{endpoint} errors: {base.get("errors", 0)} -> {metrics["errors"]}')
+    return regressions
+
+
+def compare_servers(results, other_results):
+    """
+    Returns lines comparing the results of two servers which got the same requests
+
+    Features:
+      * Throughput is compared as a ratio, above 1.0 the second server is faster
+      * Latency percentiles are compared as differences in milliseconds
+    """
+    lines = []
+    for endpoint, metrics in results.items():
+        other = other_results.get(endpoint)
+        if not other:
+            continue
+        ratio = (other['throughput_rps'] / metrics['throughput_rps']
+                 if metrics['throughput_rps'] and other['throughput_rps'] else None)
+        deltas = '  '.join(f'{metric} {other[metric] - metrics[metric]:+.1f} ms'
+                           for metric in ('p50_ms', 'p95_ms', 'p99_ms')
+                           if metrics[metric] is not None and other[metric] is not None)
+        lines.append(f'{endpoint:<12} throughput x{ratio:.2f}  {deltas}' if ratio is not None
+                     else f'{endpoint:<12} {deltas}')
+    return lines
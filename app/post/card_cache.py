@@ -0,0 +1,91 @@
+"""
+Fragment cache of post cards.
+
+The part of a card which is the same for every reader (tags, dates and the excerpt of the content) is rendered
+once and cached by post id and tag version. A cached fragment also keeps updated_at of the post it was rendered
+from, a fragment of an older version of the post is rendered again. The counters, the Read button and the
+author-only Edit and Delete buttons are rendered around the fragment on every request.
+"""
+import time
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+CARD_CACHE_TIMEOUT = 60 * 60 * 24
+TAG_VERSION_KEY = 'card:tags:version'
+HITS_KEY = 'card:hits'
+MISSES_KEY = 'card:misses'
+
+
+def get_tag_version():
+    """Returns the current generation of tags, renamed and deleted tags start a new one"""
+    version = cache.get(TAG_VERSION_KEY)
+    if version is None:
+        cache.add(TAG_VERSION_KEY, int(time.time() * 1000), None)  # starts above every evicted generation
+        version = cache.get(TAG_VERSION_KEY)
+    return version
+
+
+def bump_tag_version():
+    """Invalidates the fragments of all posts at once"""
+    try:
+        cache.incr(TAG_VERSION_KEY)
+    except ValueError:  # the counter was evicted
+        get_tag_version()
+
+
+def card_key(post_id, tag_version=None):
+    return f'card:post:{post_id}:{tag_version or get_tag_version()}'
+
+
+def invalidate_post(post_id):
+    cache.delete(card_key(post_id))
+
+
+def _count(key, value):
+    if not value:
+        return
+    try:
+        cache.incr(key, value)
+    except ValueError:  # the counter does not exist yet or was evicted
+        if not cache.add(key, value, None):
+            cache.incr(key, value)
+
+
+def get_cards(posts):
+    """
+    Returns {post id: rendered fragment} of the posts
+
+    Features:
+      * Fragments are taken from the cache with one get_many call
+      * Only missing and outdated fragments are rendered, they are cached with one set_many call
+      * Hits and misses are counted in the cache, get_stats() returns them
+    """
+    tag_version = get_tag_version()
+    keys = {post.pk: card_key(post.pk, tag_version) for post in posts}
+    cached = cache.get_many(keys.values())
+    cards, missing = {}, {}
+    for post in posts:
+        updated_at, html = cached.get(keys[post.pk], (None, None))
+        if updated_at == post.updated_at:
+            cards[post.pk] = mark_safe(html)
+        else:  # the fragment was not cached or the post was changed after it was rendered
+            html = render_to_string('post/post_card_fragment.html', {'post': post})
+            cards[post.pk] = mark_safe(html)
+            missing[keys[post.pk]] = (post.updated_at, html)
+    if missing:
+        cache.set_many(missing, CARD_CACHE_TIMEOUT)
+    _count(HITS_KEY, len(posts) - len(missing))
+    _count(MISSES_KEY, len(missing))
+    return cards
+
+
+def get_stats():
+    """Returns (hits, misses, hit ratio or None) counted since the counters were reset"""
+    counters = cache.get_many([HITS_KEY, MISSES_KEY])
+    hits, misses = counters.get(HITS_KEY, 0), counters.get(MISSES_KEY, 0)
+    return hits, misses, hits / (hits + misses) if hits + misses else None
+
+
+def reset_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
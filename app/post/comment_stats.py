@@ -0,0 +1,52 @@
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from post.models import Post, Comment
+
+
+def comment_count_subquery():
+    return Coalesce(Subquery(
+        Comment.objects.filter(post=OuterRef('pk')).order_by().values('post').annotate(total=Count('pk')).values(
+            'total')
+    ), Value(0), output_field=IntegerField())
+
+
+def last_comment_at_subquery():
+    """The latest comment is found with the (post, -created_at) index"""
+    return Subquery(Comment.objects.filter(post=OuterRef('pk')).order_by('-created_at').values('created_at')[:1])
+
+
+def comment_added(comment):
+    """Increases the comment count of the post with one UPDATE, updated_at of the post is not touched"""
+    Post.objects.filter(pk=comment.post_id).update(
+        comment_count=F('comment_count') + 1,
+        last_comment_at=Greatest(Coalesce(F('last_comment_at'), Value(comment.created_at)),
+                                 Value(comment.created_at)),
+    )
+
+
+def comment_removed(comment):
+    """Decreases the comment count of the post and finds its latest remaining comment"""
+    Post.objects.filter(pk=comment.post_id, comment_count__gt=0).update(
+        comment_count=F('comment_count') - 1,
+        last_comment_at=last_comment_at_subquery(),
+    )
+
+
+def repair(queryset=None, chunk_size=1000):
+    """
+    Recomputes comment_count and last_comment_at from the comments table
+
+    Features:
+      * Posts are processed by ranges of primary keys, one UPDATE per chunk
+      * Yields the number of posts processed after every chunk
+    """
+    queryset = (queryset if queryset is not None else Post.objects.all()).order_by('pk')
+    last_pk = 0
+    while True:
+        pks = list(queryset.filter(pk__gt=last_pk).values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            return
+        Post.objects.filter(pk__in=pks).update(comment_count=comment_count_subquery(),
+                                               last_comment_at=last_comment_at_subquery())
+        last_pk = pks[-1]
+        yield len(pks)
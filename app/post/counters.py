@@ -0,0 +1,145 @@
+import logging
+import threading
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from redis import RedisError, ResponseError
+from blog.redis_client import get_redis
+from post.models import Post
+from post import feed_cache, leaderboards
+
+logger = logging.getLogger(__name__)
+
+FLUSH_CHUNK_SIZE = 500
+
+
+class MemoryViewBuffer:
+    """
+    In-process view buffer
+
+    Features:
+      * Used in tests and in single-process development servers
+      * Every process has its own buffer, so it must be flushed by the same process
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._claimed = {}
+
+    def incr(self, post_id, amount=1):
+        """Adds a hit to the buffer and returns the number of pending hits of the post"""
+        with self._lock:
+            self._counts[post_id] = self._counts.get(post_id, 0) + amount
+            return self._counts[post_id]
+
+    def claim(self):
+        """Moves the buffered hits aside and returns them as {post_id: hits}"""
+        with self._lock:
+            for post_id, hits in self._counts.items():
+                self._claimed[post_id] = self._claimed.get(post_id, 0) + hits
+            self._counts = {}
+            return dict(self._claimed)
+
+    def ack(self):
+        """Forgets the claimed hits after they are written to the database"""
+        with self._lock:
+            self._claimed = {}
+
+
+class RedisViewBuffer:
+    """
+    Redis view buffer shared by all web workers
+
+    Features:
+      * Hits are counted with HINCRBY in a single hash
+      * The hash is renamed with RENAMENX before a flush, so new hits are never lost while flushing
+      * Claimed hits stay in Redis until they are acknowledged, so a failed flush is retried
+      * One flush holds the claim at a time, an overlapping flush claims nothing, so no hit is counted twice
+    """
+    key = 'post:views:pending'
+    claimed_key = 'post:views:flushing'
+    lock_key = 'post:views:flushing:lock'
+    lock_timeout = 60  # seconds, a flush which died leaves its claimed hits to a flush after it
+
+    def incr(self, post_id, amount=1):
+        """Adds a hit to the buffer and returns the number of pending hits of the post"""
+        return get_redis().hincrby(self.key, post_id, amount)
+
+    def claim(self):
+        """Moves the buffered hits aside and returns them as {post_id: hits}"""
+        client = get_redis()
+        if not client.set(self.lock_key, 1, nx=True, ex=self.lock_timeout):  # another flush holds the claim
+            return {}
+        try:
+            client.renamenx(self.key, self.claimed_key)  # keeps the hits of a failed flush, they are retried first
+        except ResponseError:  # nothing is buffered
+            pass
+        pending = {int(post_id): int(hits) for post_id, hits in client.hgetall(self.claimed_key).items()}
+        if not pending:
+            client.delete(self.lock_key)
+        return pending
+
+    def ack(self):
+        """Forgets the claimed hits after they are written to the database and releases the claim"""
+        get_redis().delete(self.claimed_key, self.lock_key)
+
+
+_buffers = {
+    'memory': MemoryViewBuffer(),
+    'redis': RedisViewBuffer(),
+}
+
+
+def get_view_buffer():
+    """Returns the view buffer configured by VIEW_COUNTER_BACKEND"""
+    return _buffers[settings.VIEW_COUNTER_BACKEND]
+
+
+def record_view(post):
+    """
+    Records a hit of the post without touching the database
+
+    Features:
+      * Returns the number of views including hits which are not flushed yet
+      * If the buffer is unavailable, the hit is dropped and the page is still rendered
+    """
+    try:
+        pending = get_view_buffer().incr(post.pk)
+    except RedisError:
+        logger.warning('View buffer is unavailable, a hit of post %s is dropped', post.pk)
+        pending = 0
+    return post.views + pending
+
+
+async def arecord_view(post):
+    """Async version of record_view(), the buffer is written in a worker thread"""
+    return await sync_to_async(record_view, thread_sensitive=False)(post)
+
+
+def flush_views():
+    """
+    Writes the buffered hits to Post.views
+
+    Features:
+      * One UPDATE ... SET views = views + CASE ... per chunk of posts instead of a query per hit
+      * Uses F() expressions and update(), so updated_at is not touched and concurrent flushes do not lose hits
+      * Adds the flushed hits to the most viewed leaderboard and bumps the version of the feed panels
+      * Returns the number of flushed hits
+    """
+    view_buffer = get_view_buffer()
+    pending = view_buffer.claim()
+    if not pending:
+        return 0
+    items = sorted(pending.items())  # a stable order of row locks avoids deadlocks between flushes
+    with transaction.atomic():
+        for start in range(0, len(items), FLUSH_CHUNK_SIZE):
+            chunk = items[start:start + FLUSH_CHUNK_SIZE]
+            increment = Case(*[When(pk=post_id, then=Value(hits)) for post_id, hits in chunk],
+                             default=Value(0), output_field=IntegerField())
+            Post.objects.filter(pk__in=[post_id for post_id, _ in chunk]).update(views=F('views') + increment)
+    view_buffer.ack()
+    leaderboards.add_views(pending)
+    feed_cache.bump_panels_version()  # view counts and the most viewed posts of the feed pages changed
+    return sum(pending.values())
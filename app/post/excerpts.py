@@ -0,0 +1,54 @@
+"""
+Precomputed excerpt, word count and reading time of posts.
+
+The fields are filled by Post.save and by the backfill_excerpts command, so list pages show a post without
+loading and truncating its content.
+"""
+import math
+from django.utils.text import Truncator
+
+EXCERPT_WORDS = 80  # the excerpt is equal to the output of truncatewords:80
+WORDS_PER_MINUTE = 200
+FIELDS = ('excerpt', 'word_count', 'reading_time')
+
+
+def get_excerpt(content):
+    return Truncator(content).words(EXCERPT_WORDS, truncate=' …')
+
+
+def count_words(content):
+    return len(content.split())
+
+
+def get_reading_time(word_count):
+    """Returns the reading time in minutes, at least one minute"""
+    return max(1, math.ceil(word_count / WORDS_PER_MINUTE))
+
+
+def fill(post):
+    """Sets the precomputed fields of a post from its content"""
+    post.excerpt = get_excerpt(post.content)
+    post.word_count = count_words(post.content)
+    post.reading_time = get_reading_time(post.word_count)
+
+
+def backfill(queryset, chunk_size=500):
+    """
+    Recomputes the fields of posts from their content
+
+    Features:
+      * Posts are processed by ranges of primary keys, only pk and content are loaded
+      * Every chunk is written with one bulk_update, updated_at is not touched
+      * Yields the number of posts processed after every chunk
+    """
+    queryset = queryset.order_by('pk').only('pk', 'content')
+    last_pk = 0
+    while True:
+        posts = list(queryset.filter(pk__gt=last_pk)[:chunk_size])
+        if not posts:
+            return
+        for post in posts:
+            fill(post)
+        queryset.model.objects.bulk_update(posts, FIELDS)
+        last_pk = posts[-1].pk
+        yield len(posts)
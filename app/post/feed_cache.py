@@ -0,0 +1,120 @@
+import hashlib
+import time
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.utils.functional import cached_property
+from post.models import Post
+
+FEED_CACHE_TIMEOUT = 60
+VERSION_KEY = 'feed:version'
+
+
+PANELS_VERSION_KEY = 'feed:panels:version'
+
+
+def get_version(key=VERSION_KEY):
+    """Returns the current generation of the feed cache or of another versioned state"""
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, int(time.time() * 1000), None)  # starts above every evicted generation
+        version = cache.get(key)
+    return version
+
+
+def bump_version(key=VERSION_KEY):
+    """Starts a new generation, so every cached page of post ids is invalidated at once"""
+    try:
+        cache.incr(key)
+    except ValueError:  # the counter was evicted
+        get_version(key)
+
+
+def get_panels_version():
+    """
+    Returns the version of what the feed pages show besides the posts
+
+    It is bumped when flushed views change the view counts and the most viewed posts, when the leaderboards are
+    rebuilt and when the tag cloud changes, none of them changes the feed version.
+    """
+    return get_version(PANELS_VERSION_KEY)
+
+
+def bump_panels_version():
+    bump_version(PANELS_VERSION_KEY)
+
+
+def invalidate_post(post_id):
+    """Drops the cached post and invalidates every cached page"""
+    cache.delete(post_key(post_id))
+    bump_version()
+
+
+def post_key(post_id):
+    return f'feed:post:{post_id}'
+
+
+async def aget_version(key=VERSION_KEY):
+    """Async version of get_version()"""
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, int(time.time() * 1000), None)
+        version = await cache.aget(key)
+    return version
+
+
+async def aget_panels_version():
+    return await aget_version(PANELS_VERSION_KEY)
+
+
+def page_key(filters, page_number, version=None):
+    """Returns a memcached-safe key of a page of post ids for the given filters, the page may be any request input"""
+    digest = hashlib.md5(repr((sorted(filters.items()), str(page_number))).encode()).hexdigest()
+    return f'feed:page:{version or get_version()}:{digest}'
+
+
+def get_posts(post_ids):
+    """
+    Hydrates posts by ids keeping the order of ids
+
+    Features:
+      * Posts are taken from the per-post cache with one get_many call
+      * Only missing posts are loaded from the database, with their authors and tags
+      * Content and the search vector are deferred, lists show the precomputed excerpt
+    """
+    keys = {post_key(post_id): post_id for post_id in post_ids}
+    posts = {keys[key]: post for key, post in cache.get_many(keys).items()}
+    missing = [post_id for post_id in post_ids if post_id not in posts]
+    if missing:
+        loaded = get_posts_queryset().in_bulk(missing)
+        cache.set_many({post_key(post_id): post for post_id, post in loaded.items()}, FEED_CACHE_TIMEOUT)
+        posts.update(loaded)
+    return [posts[post_id] for post_id in post_ids if post_id in posts]
+
+
+async def aget_posts(post_ids):
+    """Async version of get_posts() using the async cache API and the async ORM"""
+    keys = {post_key(post_id): post_id for post_id in post_ids}
+    posts = {keys[key]: post for key, post in (await cache.aget_many(keys)).items()}
+    missing = [post_id for post_id in post_ids if post_id not in posts]
+    if missing:
+        loaded = await get_posts_queryset().ain_bulk(missing)
+        await cache.aset_many({post_key(post_id): post for post_id, post in loaded.items()}, FEED_CACHE_TIMEOUT)
+        posts.update(loaded)
+    return [posts[post_id] for post_id in post_ids if post_id in posts]
+
+
+def get_posts_queryset():
+    """Returns the queryset posts of the feed are hydrated from, the content is not needed by the cards"""
+    return Post.objects.select_related('author').prefetch_related('tags').defer('content', 'search_vector')
+
+
+class CountedPaginator(Paginator):
+    """Paginator which takes the number of objects from the cache instead of running COUNT(*)"""
+
+    def __init__(self, object_list, per_page, count, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self._count = count
+
+    @cached_property
+    def count(self):
+        return self._count
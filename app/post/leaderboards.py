@@ -0,0 +1,218 @@
+import heapq
+import logging
+import threading
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from redis import RedisError
+from blog.db_router import replica_reads
+from blog.redis_client import get_redis
+from post.models import Post
+from post import feed_cache
+
+logger = logging.getLogger(__name__)
+
+VIEWS = 'views'
+COMMENTS = 'comments'
+RECONCILE_CHUNK_SIZE = 5000
+
+
+class MemoryLeaderboard:
+    """In-process leaderboard used in tests and in single-process development servers"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._scores = {}
+            self._built = set()
+
+    def exists(self, board):
+        return board in self._built
+
+    def incr(self, board, increments):
+        with self._lock:
+            if board not in self._built:  # the first reconciliation counts the increments from the database
+                return
+            scores = self._scores.setdefault(board, {})
+            for post_id, amount in increments.items():
+                scores[post_id] = scores.get(post_id, 0) + amount
+
+    def remove(self, post_id):
+        with self._lock:
+            for scores in self._scores.values():
+                scores.pop(post_id, None)
+
+    def top(self, board, limit):
+        with self._lock:
+            return heapq.nlargest(limit, self._scores.get(board, {}).items(), key=lambda item: (item[1], -item[0]))
+
+    def replace(self, board, scores):
+        with self._lock:
+            self._scores[board] = dict(scores)
+            self._built.add(board)
+
+
+class RedisLeaderboard:
+    """
+    Leaderboard stored in Redis sorted sets
+
+    Features:
+      * Increments are sent with one pipeline per batch
+      * Top N is read with ZREVRANGE in O(log n + N)
+      * Reconciliation builds a new set aside and swaps it in with RENAME
+    """
+    prefix = 'leaderboard:'
+
+    def key(self, board):
+        return f'{self.prefix}{board}'
+
+    def exists(self, board):
+        """Returns True if the board was built by reconcile(), an empty sorted set does not exist in Redis"""
+        return bool(get_redis().exists(f'{self.key(board)}:built'))
+
+    def incr(self, board, increments):
+        """Increments the scores of a built board, a board which is not built would hold partial scores"""
+        if not self.exists(board):  # the first reconciliation counts the increments from the database
+            return
+        pipe = get_redis().pipeline(transaction=False)
+        for post_id, amount in increments.items():
+            pipe.zincrby(self.key(board), amount, post_id)
+        pipe.execute()
+
+    def remove(self, post_id):
+        pipe = get_redis().pipeline(transaction=False)
+        for board in (VIEWS, COMMENTS):
+            pipe.zrem(self.key(board), post_id)
+        pipe.execute()
+
+    def top(self, board, limit):
+        return [(int(post_id), int(score))
+                for post_id, score in get_redis().zrevrange(self.key(board), 0, limit - 1, withscores=True)]
+
+    def replace(self, board, scores):
+        client = get_redis()
+        tmp_key = f'{self.key(board)}:rebuild'
+        client.delete(tmp_key)
+        chunk = {}
+        for post_id, score in scores:
+            chunk[post_id] = score
+            if len(chunk) == RECONCILE_CHUNK_SIZE:
+                client.zadd(tmp_key, chunk)
+                chunk = {}
+        if chunk:
+            client.zadd(tmp_key, chunk)
+        if client.exists(tmp_key):
+            client.rename(tmp_key, self.key(board))
+        else:
+            client.delete(self.key(board))
+        client.set(f'{self.key(board)}:built', 1)
+
+
+_leaderboards = {
+    'memory': MemoryLeaderboard(),
+    'redis': RedisLeaderboard(),
+}
+
+
+def get_leaderboard():
+    """Returns the leaderboard configured by LEADERBOARD_BACKEND"""
+    return _leaderboards[settings.LEADERBOARD_BACKEND]
+
+
+def add_views(views):
+    """Adds flushed views {post_id: hits} to the most viewed leaderboard"""
+    try:
+        get_leaderboard().incr(VIEWS, views)
+    except RedisError:
+        logger.warning('Leaderboard is unavailable, views are reconciled later')
+
+
+def add_comments(post_id, amount):
+    """Adds created (amount=1) or deleted (amount=-1) comments of a post to the most commented leaderboard"""
+    try:
+        get_leaderboard().incr(COMMENTS, {post_id: amount})
+    except RedisError:
+        logger.warning('Leaderboard is unavailable, comments are reconciled later')
+
+
+def remove_post(post_id):
+    """Removes a deleted post from all leaderboards"""
+    try:
+        get_leaderboard().remove(post_id)
+    except RedisError:
+        logger.warning('Leaderboard is unavailable, post %s is removed by the next reconciliation', post_id)
+
+
+def reconcile():
+    """Rebuilds both leaderboards from the database, fixes increments lost while Redis was unavailable"""
+    leaderboard = get_leaderboard()
+    leaderboard.replace(VIEWS, Post.objects.filter(views__gt=0).values_list('pk', 'views').iterator(
+        chunk_size=RECONCILE_CHUNK_SIZE))
+    leaderboard.replace(COMMENTS, Post.objects.filter(comment_count__gt=0).values_list(
+        'pk', 'comment_count').iterator(chunk_size=RECONCILE_CHUNK_SIZE))
+    feed_cache.bump_panels_version()
+
+
+def _top_from_database(board, limit):
+    with replica_reads():
+        if board == VIEWS:
+            return list(Post.objects.order_by('-views').values_list('pk', 'views')[:limit])
+        return list(Post.objects.order_by('-comment_count').values_list('pk', 'comment_count')[:limit])
+
+
+def _get_top(board, limit, attribute):
+    """
+    Returns the top posts of a board, the score is set to the given attribute of every post
+
+    Features:
+      * Posts are hydrated from the per-post feed cache
+      * Falls back to the database if the leaderboard is unavailable or is not built yet
+    """
+    top = _read_top(board, limit)
+    if top is None:
+        top = _top_from_database(board, limit)
+    return _set_scores(feed_cache.get_posts([post_id for post_id, _ in top]), top, attribute)
+
+
+async def _aget_top(board, limit, attribute):
+    """Async version of _get_top(), Redis is read in a worker thread, so it does not hold the database thread"""
+    top = await sync_to_async(_read_top, thread_sensitive=False)(board, limit)
+    if top is None:
+        top = await sync_to_async(_top_from_database)(board, limit)
+    return _set_scores(await feed_cache.aget_posts([post_id for post_id, _ in top]), top, attribute)
+
+
+def _read_top(board, limit):
+    """Returns the top of a board or None if the leaderboard is unavailable or is not built yet"""
+    try:
+        leaderboard = get_leaderboard()
+        if not leaderboard.exists(board):  # e.g. after a deploy or a flush of Redis, before the reconciliation
+            return None
+        return leaderboard.top(board, limit)
+    except RedisError:
+        return None
+
+
+def _set_scores(posts, top, attribute):
+    scores = dict(top)
+    for post in posts:
+        setattr(post, attribute, scores[post.pk])
+    return posts
+
+
+def most_viewed(limit=5):
+    return _get_top(VIEWS, limit, 'views')
+
+
+def most_commented(limit=5):
+    return _get_top(COMMENTS, limit, 'num_comments')
+
+
+async def amost_viewed(limit=5):
+    return await _aget_top(VIEWS, limit, 'views')
+
+
+async def amost_commented(limit=5):
+    return await _aget_top(COMMENTS, limit, 'num_comments')
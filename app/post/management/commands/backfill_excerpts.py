@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from post import excerpts
+from post.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the excerpt, word count and reading time of posts from their content'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help='Number of posts updated per query.')
+
+    def handle(self, *args, **options):
+        total = 0
+        for processed in excerpts.backfill(Post.objects.all(), chunk_size=options['chunk_size']):
+            total += processed
+            self.stdout.write(f'{total} posts processed')
+        self.stdout.write(self.style.SUCCESS(f'Excerpts of {total} posts are backfilled'))
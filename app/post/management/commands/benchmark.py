@@ -0,0 +1,93 @@
+import json
+import platform
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from post.benchmark import ENDPOINTS, Benchmark, compare, compare_servers
+
+
+class Command(BaseCommand):
+    help = ('Measures latency, throughput, SQL queries and cache hit ratio of the hot endpoints. '
+            'Fails if the results regress against a baseline.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=ENDPOINTS,
+                            help='Endpoints to measure, comment_add writes comments to the database.')
+        parser.add_argument('--requests', type=int, default=200, help='Measured requests per endpoint.')
+        parser.add_argument('--warmup', type=int, default=20, help='Requests per endpoint sent before measuring.')
+        parser.add_argument('--url', help='Base url of a running server, e.g. http://127.0.0.1:8000. '
+                                          'Without it requests are sent in-process.')
+        parser.add_argument('--compare-url', help='Base url of a second server of the same database, e.g. the ASGI '
+                                                  'mode of the server of --url. Both get the same requests.')
+        parser.add_argument('--session-id', help='Session cookie of a logged in user, required with --url.')
+        parser.add_argument('--concurrency', type=int, default=1, help='Parallel requests with --url.')
+        parser.add_argument('--username', help='User of in-process requests, defaults to the first user.')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the random choice of pages.')
+        parser.add_argument('--output', help='Path of the JSON results.')
+        parser.add_argument('--baseline', help='Path of the JSON results of a previous run to compare with.')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Allowed growth of latency percentiles against the baseline, 0.2 is 20%%.')
+
+    def handle(self, *args, **options):
+        if options['url'] and not options['session_id']:
+            raise CommandError('--session-id is required with --url, the post pages need a logged in user')
+        if options['compare_url'] and not options['url']:
+            raise CommandError('--compare-url is compared with the server of --url')
+        user = User.objects.filter(**({'username': options['username']} if options['username'] else {})).order_by(
+            'pk').first()
+        if user is None:
+            raise CommandError('No user to send requests as')
+        try:
+            benchmark = Benchmark(user, options['url'], options['session_id'], options['requests'],
+                                  options['warmup'], options['concurrency'], options['seed'])
+        except ValueError as error:
+            raise CommandError(error)
+        results = self.run_endpoints(benchmark, options['endpoints'])
+        compared = None
+        if options['compare_url']:
+            self.stdout.write(f'Comparing with {options["compare_url"]}')
+            other = Benchmark(user, options['compare_url'], options['session_id'], options['requests'],
+                              options['warmup'], options['concurrency'], options['seed'])
+            compared = self.run_endpoints(other, options['endpoints'])
+            self.stdout.write('\n'.join(compare_servers(results, compared)))
+        run = {
+            'created_at': timezone.now().isoformat(),
+            'mode': 'http' if options['url'] else 'in-process',
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'results': results,
+        }
+        if compared is not None:
+            run.update({'compare_url': options['compare_url'], 'compare_results': compared})
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(run, file, indent=2)
+            self.stdout.write(f'Results are written to {options["output"]}')
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                baseline = json.load(file)['results']
+            regressions = compare(results, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError('Regressions against the baseline:\n  ' + '\n  '.join(regressions))
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
+
+    def run_endpoints(self, benchmark, endpoints):
+        results = {}
+        for endpoint in endpoints:
+            try:
+                results[endpoint] = metrics = benchmark.run_endpoint(endpoint)
+            except ValueError as error:
+                raise CommandError(error)
+            self.stdout.write(self.format_metrics(endpoint, metrics))
+        return results
+
+    @staticmethod
+    def format_metrics(endpoint, metrics):
+        def number(value, pattern='{:.1f}'):
+            return '-' if value is None else pattern.format(value)
+
+        return (f'{endpoint:<12} p50 {number(metrics["p50_ms"])} ms  p95 {number(metrics["p95_ms"])} ms  '
+                f'p99 {number(metrics["p99_ms"])} ms  {number(metrics["throughput_rps"])} req/s  '
+                f'queries {number(metrics["queries_mean"])}  cache hits {number(metrics["cache_hit_ratio"], "{:.0%}")}'
+                f'  errors {metrics["errors"]}')
@@ -0,0 +1,41 @@
+from collections import defaultdict
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from taggit.models import TaggedItem
+from post.models import Post
+from post.search_index import get_term_frequencies, write_index
+
+
+class Command(BaseCommand):
+    help = 'Builds the inverted search index of posts used with SEARCH_BACKEND=index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Number of posts loaded per query.')
+
+    def handle(self, *args, **options):
+        path = str(settings.SEARCH_INDEX_PATH)
+        docs = write_index(path, self.iter_documents(options['chunk_size']))
+        self.stdout.write(self.style.SUCCESS(f'Indexed {docs} posts into {path}'))
+
+    def iter_documents(self, chunk_size):
+        """Yields (post_id, term frequencies) of all posts, tags are loaded with one query per chunk"""
+        content_type = ContentType.objects.get_for_model(Post)
+        chunk = []
+        for post in Post.objects.values('pk', 'title', 'content').iterator(chunk_size=chunk_size):
+            chunk.append(post)
+            if len(chunk) == chunk_size:
+                yield from self.chunk_documents(chunk, content_type)
+                chunk = []
+        yield from self.chunk_documents(chunk, content_type)
+
+    @staticmethod
+    def chunk_documents(chunk, content_type):
+        tags = defaultdict(list)
+        tagged_items = TaggedItem.objects.filter(
+            content_type=content_type, object_id__in=[post['pk'] for post in chunk]
+        ).values_list('object_id', 'tag__name')
+        for post_id, name in tagged_items:
+            tags[post_id].append(name)
+        for post in chunk:
+            yield post['pk'], get_term_frequencies(post['title'], post['content'], tags[post['pk']])
@@ -0,0 +1,11 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from post import sitemap_files
+
+
+class Command(BaseCommand):
+    help = 'Renders all sitemap files to SITEMAP_ROOT, the refresh_sitemaps task keeps them up to date'
+
+    def handle(self, *args, **options):
+        pages = sitemap_files.build()
+        self.stdout.write(self.style.SUCCESS(f'Rendered {pages} sitemap pages into {settings.SITEMAP_ROOT}'))
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from taggit.models import TaggedItem
+from post.models import Post
+from post.tag_index import write_index
+
+
+class Command(BaseCommand):
+    help = ('Builds the tag bitmaps of posts used with TAG_FILTER_BACKEND=index. '
+            'Run it after bulk loads, they do not write to the log of the index.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Number of rows loaded per query.')
+
+    def handle(self, *args, **options):
+        path = str(settings.TAG_INDEX_PATH)
+        chunk_size = options['chunk_size']
+        posts = Post.objects.order_by('-created_at', '-pk').values_list('pk', 'created_at')
+        tagged_items = TaggedItem.objects.filter(content_type=ContentType.objects.get_for_model(Post)).values_list(
+            'object_id', 'tag_id')
+        docs = write_index(path, posts.iterator(chunk_size=chunk_size), tagged_items.iterator(chunk_size=chunk_size))
+        self.stdout.write(self.style.SUCCESS(f'Indexed tags of {docs} posts into {path}'))
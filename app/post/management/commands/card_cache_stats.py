@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from post import card_cache
+
+
+class Command(BaseCommand):
+    help = 'Shows hits and misses of the fragment cache of post cards'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Resets the counters after they are shown.')
+
+    def handle(self, *args, **options):
+        hits, misses, ratio = card_cache.get_stats()
+        ratio = 'n/a' if ratio is None else f'{ratio:.1%}'
+        self.stdout.write(f'Post card fragments: {hits} hits, {misses} misses, hit ratio {ratio}')
+        if options['reset']:
+            card_cache.reset_stats()
+            self.stdout.write(self.style.SUCCESS('Counters are reset'))
@@ -0,0 +1,27 @@
+import sys
+from django.core.management.base import BaseCommand
+from post.transfer import dump, RateMeter
+
+REPORT_EVERY = 10000
+
+
+class Command(BaseCommand):
+    help = 'Streams posts, comments and tags to a JSONL file in constant memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Path of the dump, "-" writes to stdout.')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Number of rows fetched per query.')
+
+    def handle(self, *args, **options):
+        meter = RateMeter()
+        file = sys.stdout if options['output'] == '-' else open(options['output'], 'w', encoding='utf-8')
+        try:
+            for line in dump(options['chunk_size']):
+                file.write(line + '\n')
+                meter.add(1)
+                if meter.rows % REPORT_EVERY == 0:
+                    self.stderr.write(f'{meter.rows} rows, {meter.rate:.0f} rows/s')
+        finally:
+            if file is not sys.stdout:
+                file.close()
+        self.stderr.write(self.style.SUCCESS(f'Dumped {meter.rows} rows, {meter.rate:.0f} rows/s'))
@@ -0,0 +1,224 @@
+import bisect
+import random
+from array import array
+from datetime import timedelta
+from itertools import accumulate
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from faker import Faker
+from redis import RedisError
+from taggit.models import Tag, TaggedItem
+from accounts.models import Profile
+from post.models import Post, Comment
+from post.search import update_search_vector
+from post.slugs import assign_slugs
+from post.transfer import RateMeter, keep_timestamps
+from post import excerpts, feed_cache, leaderboards, tag_cloud
+
+USER_FIELDS = ('id', 'username', 'password', 'email', 'first_name', 'last_name', 'is_active', 'is_staff',
+               'is_superuser', 'date_joined')
+PROFILE_FIELDS = ('id', 'user_id', 'avatar', 'bio')
+POST_FIELDS = ('id', 'title', 'content', 'excerpt', 'word_count', 'reading_time', 'slug', 'author_id', 'views',
+               'comment_count', 'last_comment_at', 'created_at', 'updated_at')
+COMMENT_FIELDS = ('id', 'post_id', 'author_id', 'content', 'created_at', 'updated_at')
+TAGGED_ITEM_FIELDS = ('id', 'content_type_id', 'object_id', 'tag_id')
+
+TEXT_POOL_SIZE = 1000
+
+
+class ZipfSampler:
+    """Samples ranks 0..n-1 with probability proportional to 1 / (rank + 1) ** skew, skew=0 is uniform"""
+
+    def __init__(self, n, skew, rng):
+        self.rng = rng
+        self.cum_weights = array('d', accumulate(1 / (rank + 1) ** skew for rank in range(n)))
+
+    def sample(self):
+        return bisect.bisect(self.cum_weights, self.rng.random() * self.cum_weights[-1])
+
+
+class CopyWriter:
+    """Writes rows with COPY FROM STDIN, available on PostgreSQL only"""
+
+    def write(self, model, fields, rows):
+        quote = connection.ops.quote_name
+        columns = ', '.join(quote(model._meta.get_field(field).column) for field in fields)
+        with connection.cursor() as cursor:
+            with cursor.copy(f'COPY {quote(model._meta.db_table)} ({columns}) FROM STDIN') as copy:
+                for row in rows:
+                    copy.write_row(row)
+
+
+class BulkCreateWriter:
+    """Writes rows with bulk_create, the dates of the rows are kept"""
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+
+    def write(self, model, fields, rows):
+        with keep_timestamps(model):
+            model.objects.bulk_create([model(**dict(zip(fields, row))) for row in rows], batch_size=self.batch_size)
+
+
+class Command(BaseCommand):
+    help = ('Generates users, profiles, posts with tags and comments for load testing. '
+            'Rows get explicit primary keys, do not run it while the site writes to the database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Number of users with profiles.')
+        parser.add_argument('--posts', type=int, default=10000, help='Number of posts.')
+        parser.add_argument('--tags', type=int, default=200, help='Size of the tag vocabulary.')
+        parser.add_argument('--tags-per-post', type=int, default=3, help='Maximum number of tags of a post.')
+        parser.add_argument('--tag-skew', type=float, default=1.1,
+                            help='Zipf exponent of tag popularity, 0 makes all tags equally popular.')
+        parser.add_argument('--author-skew', type=float, default=1.0,
+                            help='Zipf exponent of posts per author, 0 makes all users equally active.')
+        parser.add_argument('--comments-per-post', type=float, default=5, help='Mean number of comments of a post.')
+        parser.add_argument('--comments-distribution', choices=('fixed', 'geometric', 'pareto'), default='pareto',
+                            help='Distribution of comments per post, pareto gives a few posts most comments.')
+        parser.add_argument('--comments-skew', type=float, default=1.5,
+                            help='Shape of the pareto distribution, smaller values give a longer tail.')
+        parser.add_argument('--days', type=int, default=365, help='Posts are spread over the last days.')
+        parser.add_argument('--password', default='password', help='Password of all generated users.')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Number of rows written per transaction.')
+        parser.add_argument('--seed', type=int, help='Seed which makes the dataset reproducible.')
+        parser.add_argument('--locale', default='en_US', help='Faker locale of names and texts.')
+
+    def handle(self, *args, **options):
+        if options['comments_distribution'] == 'pareto' and options['comments_skew'] <= 1:
+            raise CommandError('--comments-skew must be greater than 1, the mean of the distribution is infinite')
+        if options['posts'] and not options['users']:
+            raise CommandError('Posts need at least one user')
+        self.options = options
+        self.rng = random.Random(options['seed'])
+        self.faker = Faker(options['locale'])
+        self.faker.seed_instance(options['seed'])
+        self.writer = CopyWriter() if connection.vendor == 'postgresql' else BulkCreateWriter(options['batch_size'])
+        self.meter = RateMeter()
+        self.sentences = [self.faker.sentence(nb_words=6) for _ in range(TEXT_POOL_SIZE)]
+        self.paragraphs = [self.faker.paragraph(nb_sentences=5) for _ in range(TEXT_POOL_SIZE)]
+        self.now = timezone.now()
+
+        first_user_id = self.generate_users()
+        tag_ids = self.get_tag_ids()
+        self.generate_posts(first_user_id, tag_ids)
+        self.reset_sequences()
+        tag_cloud.repair()
+        feed_cache.bump_version()
+        try:
+            leaderboards.reconcile()
+        except RedisError:
+            self.stderr.write('Leaderboards are unavailable, they are rebuilt by the reconcile_leaderboards task')
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {self.meter.rows} rows, {self.meter.rate:.0f} rows/s ({type(self.writer).__name__})'))
+
+    def write(self, model, fields, rows):
+        if rows:
+            self.writer.write(model, fields, rows)
+            self.meter.add(len(rows))
+
+    def report(self):
+        self.stdout.write(f'{self.meter.rows} rows, {self.meter.rate:.0f} rows/s')
+
+    @staticmethod
+    def next_id(model):
+        return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+    def generate_users(self):
+        """Writes users and their profiles, the post_save signals of users are not sent"""
+        first_id, profile_id = self.next_id(User), self.next_id(Profile)
+        password = make_password(self.options['password'])  # hashing is slow, all users share one hash
+        batch_size = self.options['batch_size']
+        for start in range(0, self.options['users'], batch_size):
+            users, profiles = [], []
+            for i in range(start, min(start + batch_size, self.options['users'])):
+                first_name, last_name = self.faker.first_name(), self.faker.last_name()
+                username = f'{first_name}.{last_name}.{first_id + i}'.lower()[:150]
+                date_joined = self.now - timedelta(days=self.rng.uniform(0, self.options['days']))
+                users.append((first_id + i, username, password, f'{username}@example.com', first_name, last_name,
+                              True, False, False, date_joined))
+                profiles.append((profile_id + i, first_id + i, 'default.png', self.rng.choice(self.sentences)))
+            with transaction.atomic():
+                self.write(User, USER_FIELDS, users)
+                self.write(Profile, PROFILE_FIELDS, profiles)
+            self.report()
+        return first_id
+
+    def get_tag_ids(self):
+        """Returns ids of the tag vocabulary ordered by popularity, the vocabulary is small so it uses the ORM"""
+        names = set()
+        while len(names) < self.options['tags']:
+            words = self.faker.words(nb=1 if len(names) < TEXT_POOL_SIZE else 2)
+            names.add('-'.join(words))
+        names = sorted(names)
+        self.rng.shuffle(names)
+        slugify = Tag().slugify
+        Tag.objects.bulk_create([Tag(name=name, slug=slugify(name)) for name in names], ignore_conflicts=True)
+        ids = dict(Tag.objects.filter(name__in=names).values_list('name', 'pk'))
+        return [ids[name] for name in names if name in ids]
+
+    def get_comment_count(self):
+        mean = self.options['comments_per_post']
+        distribution = self.options['comments_distribution']
+        if distribution == 'fixed':
+            return round(mean)
+        if distribution == 'geometric':
+            return int(self.rng.expovariate(1 / mean)) if mean > 0 else 0
+        skew = self.options['comments_skew']
+        return int(mean * (skew - 1) / skew * self.rng.paretovariate(skew))  # scaled to the requested mean
+
+    def generate_posts(self, first_user_id, tag_ids):
+        """Writes posts with their tags and comments, posts are created in the order of their ids"""
+        options = self.options
+        post_id, comment_id = self.next_id(Post), self.next_id(Comment)
+        tagged_item_id = self.next_id(TaggedItem)
+        content_type_id = ContentType.objects.get_for_model(Post).pk
+        authors = ZipfSampler(options['users'], options['author_skew'], self.rng) if options['posts'] else None
+        tags = ZipfSampler(len(tag_ids), options['tag_skew'], self.rng) if tag_ids else None
+        step = timedelta(days=options['days']) / max(options['posts'], 1)
+        started = self.now - timedelta(days=options['days'])
+        for start in range(0, options['posts'], options['batch_size']):
+            posts, comments, tagged_items = [], [], []
+            titles = [self.faker.sentence(nb_words=4)[:40].rstrip('.') for _ in range(
+                min(options['batch_size'], options['posts'] - start))]
+            slugs = [post.slug for post in assign_slugs(Post, [Post(title=title) for title in titles])]
+            for i, (title, slug) in enumerate(zip(titles, slugs), start):
+                created_at = started + step * i
+                last_comment_at = None
+                count = self.get_comment_count()
+                for _ in range(count):
+                    commented_at = min(created_at + timedelta(hours=self.rng.expovariate(1 / 24)), self.now)
+                    last_comment_at = max(last_comment_at or commented_at, commented_at)
+                    comments.append((comment_id, post_id, first_user_id + authors.sample(),
+                                     self.rng.choice(self.sentences), commented_at, commented_at))
+                    comment_id += 1
+                if tags:
+                    for tag in {tag_ids[tags.sample()] for _ in range(self.rng.randint(0, options['tags_per_post']))}:
+                        tagged_items.append((tagged_item_id, content_type_id, post_id, tag))
+                        tagged_item_id += 1
+                content = '\n\n'.join(self.rng.choices(self.paragraphs, k=self.rng.randint(2, 6)))
+                word_count = excerpts.count_words(content)
+                views = count * 20 + self.rng.randint(0, 200)
+                posts.append((post_id, title, content, excerpts.get_excerpt(content), word_count,
+                              excerpts.get_reading_time(word_count), slug, first_user_id + authors.sample(), views,
+                              count, last_comment_at, created_at, created_at))
+                post_id += 1
+            with transaction.atomic():
+                self.write(Post, POST_FIELDS, posts)
+                self.write(TaggedItem, TAGGED_ITEM_FIELDS, tagged_items)
+                self.write(Comment, COMMENT_FIELDS, comments)
+                update_search_vector([post[0] for post in posts])
+            self.report()
+
+    @staticmethod
+    def reset_sequences():
+        """Moves the sequences of the tables after the explicit primary keys"""
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [User, Profile, Post, Comment, TaggedItem]):
+                cursor.execute(sql)
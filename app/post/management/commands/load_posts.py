@@ -0,0 +1,49 @@
+import json
+import os
+from django.core.management.base import BaseCommand
+from post.transfer import Loader, RateMeter, read_batches
+
+
+class Command(BaseCommand):
+    help = ('Loads a dump of the dump_posts command with batched inserts. '
+            'Posts with a slug which already exists are skipped, their comments are added to the existing post.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='Path of the dump.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of rows inserted per transaction.')
+        parser.add_argument('--checkpoint', help='File with the offset of the last loaded batch, '
+                                                 'a restarted load continues after it. Defaults to <input>.checkpoint')
+
+    def handle(self, *args, **options):
+        checkpoint = options['checkpoint'] or f'{options["input"]}.checkpoint'
+        offset = self.read_checkpoint(checkpoint)
+        if offset:
+            self.stdout.write(f'Resuming from byte {offset}')
+        loader = Loader()
+        meter = RateMeter()
+        with open(options['input'], 'rb') as file:
+            for records, offset in read_batches(file, options['batch_size'], offset):
+                loader.load_batch(records)
+                self.write_checkpoint(checkpoint, offset)  # the batch is committed, it is not loaded again
+                meter.add(len(records))
+                self.stdout.write(f'{meter.rows} rows, {meter.rate:.0f} rows/s')
+        loader.finish()
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        self.stdout.write(self.style.SUCCESS(
+            f'Loaded {loader.posts} posts and {loader.comments} comments, skipped {loader.skipped} rows, '
+            f'{meter.rate:.0f} rows/s'))
+
+    @staticmethod
+    def read_checkpoint(path):
+        try:
+            with open(path) as file:
+                return json.load(file)['offset']
+        except FileNotFoundError:
+            return 0
+
+    @staticmethod
+    def write_checkpoint(path, offset):
+        with open(f'{path}.tmp', 'w') as file:
+            json.dump({'offset': offset}, file)
+        os.replace(f'{path}.tmp', path)
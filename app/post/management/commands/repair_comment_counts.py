@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from post import comment_stats
+
+
+class Command(BaseCommand):
+    help = 'Recomputes Post.comment_count and Post.last_comment_at from the comments table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Number of posts updated per query.')
+
+    def handle(self, *args, **options):
+        total = 0
+        for processed in comment_stats.repair(chunk_size=options['chunk_size']):
+            total += processed
+            self.stdout.write(f'{total} posts repaired')
+        self.stdout.write(self.style.SUCCESS(f'Comment counts of {total} posts are repaired'))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from post import tag_cloud
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the post counts of the tag cloud from the tagged items'
+
+    def handle(self, *args, **options):
+        updated = tag_cloud.repair()
+        self.stdout.write(self.style.SUCCESS(f'Post counts of {updated} tags are repaired'))
@@ -0,0 +1,102 @@
+# Generated by Django 5.2.5 on 2026-10-18 06:01
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+import django.db.models.deletion
+import taggit.managers
+from django.conf import settings
+from django.db import migrations, models
+
+SEARCH_VECTOR_INDEX = django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='post_search_vector_gin')
+
+POPULATE_SEARCH_VECTOR = """
+UPDATE post_post p SET search_vector =
+    setweight(to_tsvector(%(config)s, p.title), 'A')
+    || setweight(to_tsvector(%(config)s, coalesce((
+        SELECT string_agg(t.name, ' ') FROM taggit_taggeditem ti
+        JOIN taggit_tag t ON t.id = ti.tag_id
+        JOIN django_content_type ct ON ct.id = ti.content_type_id
+        WHERE ti.object_id = p.id AND ct.app_label = 'post' AND ct.model = 'post'
+    ), '')), 'B')
+    || setweight(to_tsvector(%(config)s, p.content), 'C')
+"""
+
+
+def add_search_vector_index(apps, schema_editor):
+    """GIN indexes exist only on PostgreSQL, other databases use the icontains fallback"""
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.add_index(apps.get_model('post', 'Post'), SEARCH_VECTOR_INDEX)
+        schema_editor.execute(POPULATE_SEARCH_VECTOR, {'config': settings.SEARCH_CONFIG})
+
+
+def remove_search_vector_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.remove_index(apps.get_model('post', 'Post'), SEARCH_VECTOR_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post', '0009_alter_comment_author_alter_comment_post_and_more'),
+        ('taggit', '0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, help_text='Поисковый вектор поста.', null=True),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='author',
+            field=models.ForeignKey(help_text='Автора поста', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='posts', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='content',
+            field=models.TextField(help_text='Содержание поста.'),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, help_text='Дата создания поста.'),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='slug',
+            field=models.SlugField(help_text='Slug поста.', unique=True),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='tags',
+            field=taggit.managers.TaggableManager(help_text='Теги поста.', through='taggit.TaggedItem', to='taggit.Tag', verbose_name='Tags'),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='title',
+            field=models.CharField(help_text='Заголовок поста.', max_length=100, verbose_name='Заголовок'),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, help_text='Дата обновления поста.'),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='views',
+            field=models.IntegerField(default=0, help_text='Количество просмотров поста.'),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='post',
+                    index=SEARCH_VECTOR_INDEX,
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(add_search_vector_index, remove_search_vector_index),
+            ],
+        ),
+    ]
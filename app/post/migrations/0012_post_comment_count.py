@@ -0,0 +1,37 @@
+# Generated by Django 5.2.5 on 2026-10-18 06:10
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_comment_stats(apps, schema_editor):
+    Post = apps.get_model('post', 'Post')
+    Comment = apps.get_model('post', 'Comment')
+    comments = Comment.objects.filter(post=OuterRef('pk')).order_by()
+    Post.objects.update(
+        comment_count=Coalesce(Subquery(comments.values('post').annotate(total=Count('pk')).values('total')),
+                               Value(0), output_field=IntegerField()),
+        last_comment_at=Subquery(comments.order_by('-created_at').values('created_at')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post', '0011_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Количество комментариев поста.'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='last_comment_at',
+            field=models.DateTimeField(blank=True, editable=False, help_text='Дата последнего комментария поста.', null=True),
+        ),
+        migrations.RunPython(populate_comment_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.5 on 2026-10-18 06:36
+
+from django.db import migrations, models
+from post import excerpts
+
+
+def populate_excerpts(apps, schema_editor):
+    Post = apps.get_model('post', 'Post')
+    for _ in excerpts.backfill(Post.objects.all()):
+        pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post', '0012_post_comment_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='excerpt',
+            field=models.TextField(blank=True, editable=False, help_text='Начало содержания поста для списков постов.'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='reading_time',
+            field=models.PositiveSmallIntegerField(default=1, editable=False, help_text='Время чтения поста в минутах.'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='word_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Количество слов поста.'),
+        ),
+        migrations.RunPython(populate_excerpts, migrations.RunPython.noop),
+    ]
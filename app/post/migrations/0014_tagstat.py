@@ -0,0 +1,41 @@
+# Generated by Django 5.2.5 on 2026-10-18 06:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_tag_stats(apps, schema_editor):
+    Tag = apps.get_model('taggit', 'Tag')
+    TagStat = apps.get_model('post', 'TagStat')
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    content_type = ContentType.objects.filter(app_label='post', model='post').first()
+    counts = Tag.objects.filter(taggit_taggeditem_items__content_type=content_type).annotate(
+        total=Count('taggit_taggeditem_items')).values_list('pk', 'total') if content_type else []
+    TagStat.objects.bulk_create([TagStat(tag_id=tag_id, post_count=total) for tag_id, total in counts],
+                                batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post', '0013_post_excerpt'),
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('taggit', '0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagStat',
+            fields=[
+                ('tag', models.OneToOneField(help_text='Тег.', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stat', serialize=False, to='taggit.tag')),
+                ('post_count', models.PositiveIntegerField(default=0, help_text='Количество постов с тегом.')),
+            ],
+            options={
+                'verbose_name': 'Статистика тега',
+                'verbose_name_plural': 'Статистика тегов',
+                'indexes': [models.Index(fields=['-post_count'], name='tagstat_post_count_idx')],
+            },
+        ),
+        migrations.RunPython(populate_tag_stats, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,12 @@
-from django.db import models
-from django.utils.text import slugify
+from django.db import models, transaction, IntegrityError
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from taggit.managers import TaggableManager
+from taggit.models import Tag
 from django.contrib.auth.models import User
 from django.urls import reverse
+from post.slugs import get_base_slug, next_free_slug
+from post import excerpts
 
 
 class Post(models.Model):
@@ -14,7 +18,21 @@ class Post(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE, null=True, related_name='posts',
                                help_text='Автора поста')
     views = models.IntegerField(default=0, help_text='Количество просмотров поста.')
+    comment_count = models.PositiveIntegerField(default=0, editable=False,
+                                                help_text='Количество комментариев поста.')
+    last_comment_at = models.DateTimeField(null=True, blank=True, editable=False,
+                                           help_text='Дата последнего комментария поста.')
+    excerpt = models.TextField(blank=True, editable=False, help_text='Начало содержания поста для списков постов.')
+    word_count = models.PositiveIntegerField(default=0, editable=False, help_text='Количество слов поста.')
+    reading_time = models.PositiveSmallIntegerField(default=1, editable=False,
+                                                    help_text='Время чтения поста в минутах.')
     tags = TaggableManager(help_text='Теги поста.')
+    search_vector = SearchVectorField(null=True, editable=False, help_text='Поисковый вектор поста.')
+
+    COMMENT_STATS_FIELDS = ('comment_count', 'last_comment_at')
+    # fields written with update() by the view flush and the signals, a full save of a stale instance skips them
+    UPDATED_FIELDS = (*COMMENT_STATS_FIELDS, 'views', 'search_vector')
+    SLUG_ATTEMPTS = 5  # attempts to allocate a slug taken by concurrent saves
 
     class Meta:
         verbose_name = 'Пост'
@@ -22,6 +40,8 @@ class Post(models.Model):
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['title']),
+            models.Index(fields=['-created_at', '-id'], name='post_created_at_id_idx'),
+            GinIndex(fields=['search_vector'], name='post_search_vector_gin'),
         ]
 
     def __str__(self):
@@ -32,15 +52,35 @@ class Post(models.Model):
 
     def save(self, *args, **kwargs):
         if not self.slug:
-            base_slug = slugify(self.title)
-            slug = base_slug
-            counter = 1
-            while Post.objects.filter(slug=slug).exists():
-                slug = f'{base_slug}-{counter}'
-                counter += 1
-            self.slug = slug
+            self._save_with_new_slug(*args, **kwargs)
+            return
+        if 'content' not in self.get_deferred_fields():
+            excerpts.fill(self)
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and 'content' in update_fields:
+                kwargs['update_fields'] = {*update_fields, *excerpts.FIELDS}
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            # the counters and the search vector are maintained by flushes and signals, a stale instance must not
+            # overwrite them
+            skipped = set(self.UPDATED_FIELDS) | self.get_deferred_fields()
+            kwargs['update_fields'] = [field.attname for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.attname not in skipped]
         super().save(*args, **kwargs)
 
+    def _save_with_new_slug(self, *args, **kwargs):
+        """Allocates a free slug with one query, retries if a concurrent save took the same slug"""
+        base_slug = get_base_slug(self.title)
+        for attempt in range(self.SLUG_ATTEMPTS):
+            self.slug = next_free_slug(Post, base_slug)
+            try:
+                with transaction.atomic():  # a savepoint keeps an outer transaction usable after the conflict
+                    self.save(*args, **kwargs)
+                return
+            except IntegrityError:
+                if attempt == self.SLUG_ATTEMPTS - 1 or not Post.objects.filter(slug=self.slug).exists():
+                    self.slug = ''
+                    raise  # the conflict is not caused by the slug
+
 
 class Comment(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
@@ -57,5 +97,21 @@ class Comment(models.Model):
         verbose_name_plural = 'Комментарии'
         ordering = ['-created_at']
         indexes = [
-            models.Index(fields=['created_at', 'post'])
+            models.Index(fields=['post', '-created_at', '-id'], name='comment_post_created_at_idx'),
+        ]
+
+
+class TagStat(models.Model):
+    tag = models.OneToOneField(Tag, on_delete=models.CASCADE, primary_key=True, related_name='stat',
+                               help_text='Тег.')
+    post_count = models.PositiveIntegerField(default=0, help_text='Количество постов с тегом.')
+
+    def __str__(self):
+        return f'{self.tag}: {self.post_count}'
+
+    class Meta:
+        verbose_name = 'Статистика тега'
+        verbose_name_plural = 'Статистика тегов'
+        indexes = [
+            models.Index(fields=['-post_count'], name='tagstat_post_count_idx'),
         ]
@@ -0,0 +1,109 @@
+import json
+from datetime import datetime
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+
+
+class InvalidCursor(InvalidPage):
+    pass
+
+
+def encode_cursor(obj, direction):
+    """Returns an opaque token pointing before ('p') or after ('n') the object"""
+    data = json.dumps([obj.created_at.isoformat(), obj.pk, direction], separators=(',', ':'))
+    return urlsafe_base64_encode(data.encode())
+
+
+def decode_cursor(cursor):
+    """Returns (created_at, pk, direction) of a token"""
+    try:
+        created_at, pk, direction = json.loads(urlsafe_base64_decode(cursor))
+        created_at = datetime.fromisoformat(created_at)
+    except (ValueError, TypeError):
+        raise InvalidCursor('Invalid cursor')
+    if direction not in ('n', 'p') or not isinstance(pk, int) or not -2 ** 63 <= pk < 2 ** 63 \
+            or created_at.tzinfo is None:
+        raise InvalidCursor('Invalid cursor')
+    return created_at, pk, direction
+
+
+class KeysetPage:
+    """A page of a keyset paginator, it has no number and no total count"""
+
+    def __init__(self, object_list, has_next, has_previous):
+        self.object_list = object_list
+        self._has_next = has_next
+        self._has_previous = has_previous
+        self.next_cursor = encode_cursor(object_list[-1], 'n') if has_next and object_list else None
+        self.previous_cursor = encode_cursor(object_list[0], 'p') if has_previous and object_list else None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+
+class KeysetPaginator:
+    """
+    Cursor paginator ordered by (-created_at, -pk)
+
+    Features:
+      * A page is fetched with an indexed range condition instead of OFFSET, so deep pages are as fast as the first one
+      * Never runs COUNT(*)
+      * Fetches one extra row to know if there is a next page
+    """
+
+    def __init__(self, queryset, per_page):
+        self.queryset = queryset
+        self.per_page = per_page
+
+    def page(self, cursor=None):
+        """Returns the page pointed by the cursor or the first page"""
+        queryset, direction = self._get_queryset(cursor)
+        page = self._make_page(list(queryset), direction)
+        return page if page is not None else self.page()
+
+    async def apage(self, cursor=None):
+        """Async version of page() using the async ORM"""
+        queryset, direction = self._get_queryset(cursor)
+        page = self._make_page([obj async for obj in queryset], direction)
+        return page if page is not None else await self.apage()
+
+    def _get_queryset(self, cursor):
+        """Returns the queryset of the page with one extra object and the direction of the cursor"""
+        if not cursor:
+            return self.queryset.order_by('-created_at', '-pk')[:self.per_page + 1], None
+        created_at, pk, direction = decode_cursor(cursor)
+        if direction == 'n':
+            return self.queryset.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk)
+            ).order_by('-created_at', '-pk')[:self.per_page + 1], direction
+        return self.queryset.filter(
+            Q(created_at__gt=created_at) | Q(created_at=created_at, pk__gt=pk)
+        ).order_by('created_at', 'pk')[:self.per_page + 1], direction
+
+    def _make_page(self, objects, direction):
+        """Returns the page of the fetched objects or None if a previous page cursor points before the first object"""
+        if direction is None:
+            return KeysetPage(objects[:self.per_page], len(objects) > self.per_page, False)
+        if direction == 'n':
+            return KeysetPage(objects[:self.per_page], len(objects) > self.per_page, True)
+        has_previous = len(objects) > self.per_page
+        objects = objects[:self.per_page][::-1]
+        if not objects:  # the cursor points before the first object
+            return None
+        return KeysetPage(objects, True, has_previous)
@@ -0,0 +1,111 @@
+import re
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import Case, F, IntegerField, OuterRef, Q, Subquery, TextField, Value, When
+from django.db.models.functions import Coalesce
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+from taggit.models import TaggedItem
+from post.models import Post
+from post.search_index import get_search_index
+
+# ts_headline does not escape html, so matches are marked with control characters and escaped afterwards
+START_SEL = '\x02'
+STOP_SEL = '\x03'
+SNIPPET_LENGTH = 250
+
+
+def is_full_text_search_available():
+    """Full-text search needs PostgreSQL, other databases fall back to icontains"""
+    return connection.vendor == 'postgresql'
+
+
+def get_search_backend():
+    """
+    Returns the engine used by search_posts
+
+    Features:
+      * 'index' if SEARCH_BACKEND is 'index', the inverted index of post/search_index.py is used
+      * 'postgres' on PostgreSQL, 'icontains' on other databases
+    """
+    if settings.SEARCH_BACKEND == 'index':
+        return 'index'
+    return 'postgres' if is_full_text_search_available() else 'icontains'
+
+
+def get_search_vector():
+    """Returns the tsvector expression of a post: title is weighted above tags, tags above content"""
+    tags = Subquery(
+        TaggedItem.objects.filter(
+            content_type=ContentType.objects.get_for_model(Post), object_id=OuterRef('pk')
+        ).values('object_id').annotate(names=StringAgg('tag__name', ' ')).values('names')
+    )
+    config = settings.SEARCH_CONFIG
+    return (SearchVector('title', weight='A', config=config)
+            + SearchVector(Coalesce(tags, Value(''), output_field=TextField()), weight='B', config=config)
+            + SearchVector('content', weight='C', config=config))
+
+
+def update_search_vector(post_ids):
+    """Recomputes Post.search_vector of the given posts with a single UPDATE"""
+    if is_full_text_search_available():
+        Post.objects.filter(pk__in=post_ids).update(search_vector=get_search_vector())
+
+
+def search_posts(queryset, query):
+    """
+    Filters posts by a search query
+
+    Features:
+      * On PostgreSQL uses the GIN-indexed search_vector and orders posts by rank
+      * With SEARCH_BACKEND='index' ranks posts with BM25 over the inverted index
+      * On other databases falls back to icontains over title, content and tags
+    """
+    backend = get_search_backend()
+    if backend == 'index':
+        ranked = get_search_index().search(query, settings.SEARCH_INDEX_MAX_RESULTS)
+        order = Case(*[When(pk=post_id, then=Value(position)) for position, (post_id, _) in enumerate(ranked)],
+                     output_field=IntegerField())
+        return queryset.filter(pk__in=[post_id for post_id, _ in ranked]).order_by(order) if ranked \
+            else queryset.none()
+    if backend == 'postgres':
+        search_query = SearchQuery(query, config=settings.SEARCH_CONFIG, search_type='websearch')
+        return queryset.filter(search_vector=search_query).annotate(
+            rank=SearchRank(F('search_vector'), search_query)).order_by('-rank', '-created_at')
+    return queryset.filter(
+        Q(content__icontains=query) | Q(title__icontains=query) | Q(tags__name__icontains=query)).distinct()
+
+
+def _mark(text):
+    """Escapes the text and turns the match markers into <mark> tags"""
+    return mark_safe(escape(text).replace(START_SEL, '<mark>').replace(STOP_SEL, '</mark>'))
+
+
+def _fallback_headline(content, query):
+    """Cuts a snippet around the first match and marks every word of the query in it"""
+    words = [re.escape(word) for word in query.split() if word]
+    if not words:
+        return content[:SNIPPET_LENGTH]
+    pattern = re.compile('|'.join(words), re.IGNORECASE)
+    match = pattern.search(content)
+    start = max(match.start() - SNIPPET_LENGTH // 3, 0) if match else 0
+    snippet = content[start:start + SNIPPET_LENGTH]
+    snippet = pattern.sub(lambda m: f'{START_SEL}{m.group(0)}{STOP_SEL}', snippet)
+    return ('...' if start else '') + snippet + ('...' if start + SNIPPET_LENGTH < len(content) else '')
+
+
+def get_headlines(post_ids, query):
+    """Returns {post_id: safe html snippet of the content with highlighted matches} for a page of posts"""
+    if get_search_backend() == 'postgres':
+        search_query = SearchQuery(query, config=settings.SEARCH_CONFIG, search_type='websearch')
+        headlines = Post.objects.filter(pk__in=post_ids).annotate(
+            headline=SearchHeadline('content', search_query, config=settings.SEARCH_CONFIG,
+                                    start_sel=START_SEL, stop_sel=STOP_SEL, max_words=40, min_words=20)
+        ).values_list('pk', 'headline')
+    else:
+        headlines = [(pk, _fallback_headline(content, query))
+                     for pk, content in Post.objects.filter(pk__in=post_ids).values_list('pk', 'content')]
+    return {pk: _mark(headline) for pk, headline in headlines}
@@ -0,0 +1,312 @@
+"""
+Inverted index over posts for deployments without PostgreSQL full-text search.
+
+The index consists of two files:
+  * a base segment built by the build_search_index command. It is memory-mapped read-only,
+    so every gunicorn worker shares the same pages of the OS page cache
+  * an append-only log of posts changed after the build, written from post signals.
+    Every worker replays new records of the log before a search
+
+Layout of the base segment (native byte order):
+  header | post ids (int64 * docs) | lengths (uint32 * docs) | postings | dictionary (json)
+Postings of a term are pairs of uint32 (document number, term frequency).
+"""
+import bisect
+import fcntl
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+from array import array
+from collections import Counter
+from django.conf import settings
+
+MAGIC = b'BLGIDX1' + (b'L' if sys.byteorder == 'little' else b'B')
+HEADER = struct.Struct('<8sQQQQ')  # magic, docs, total length of docs, dictionary offset, dictionary size
+
+TITLE_WEIGHT = 3
+TAG_WEIGHT = 2
+K1 = 1.2
+B = 0.75
+
+TOKEN_RE = re.compile(r'\w\w+')
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+def get_term_frequencies(title, content, tags):
+    """Returns the term frequencies of a post, terms of the title and tags are counted several times"""
+    frequencies = Counter(tokenize(content))
+    for term in tokenize(title):
+        frequencies[term] += TITLE_WEIGHT
+    for term in tokenize(' '.join(tags)):
+        frequencies[term] += TAG_WEIGHT
+    return frequencies
+
+
+def get_log_path(path):
+    return f'{path}.log'
+
+
+def write_index(path, documents):
+    """
+    Writes a base segment from (post_id, term frequencies) pairs and returns the number of documents
+
+    Features:
+      * The segment is written to a temporary file and atomically replaces the old one
+      * Log records written during the build are kept, they are idempotent and are replayed over the new segment
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    log_path = get_log_path(path)
+    log_start = os.path.getsize(log_path) if os.path.exists(log_path) else 0
+
+    post_ids, lengths, postings = array('q'), array('I'), {}
+    for post_id, frequencies in sorted(documents, key=lambda document: document[0]):
+        number = len(post_ids)
+        post_ids.append(post_id)
+        lengths.append(sum(frequencies.values()))
+        for term, frequency in frequencies.items():
+            postings.setdefault(term, array('I')).extend((number, frequency))
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(b'\0' * HEADER.size)
+        post_ids.tofile(file)
+        lengths.tofile(file)
+        dictionary = {}
+        for term in sorted(postings):
+            dictionary[term] = [file.tell(), len(postings[term]) // 2]
+            postings[term].tofile(file)
+        dictionary_offset = file.tell()
+        dictionary_bytes = json.dumps(dictionary, separators=(',', ':')).encode()
+        file.write(dictionary_bytes)
+        file.seek(0)
+        file.write(HEADER.pack(MAGIC, len(post_ids), sum(lengths), dictionary_offset, len(dictionary_bytes)))
+
+    replace_segment(path, tmp_path, log_start)
+    return len(post_ids)
+
+
+def replace_segment(path, tmp_path, log_start):
+    """Replaces a segment with a new one, records appended to the log since log_start are kept"""
+    log_path = get_log_path(path)
+    # the log is truncated before the segment is replaced, records of the new log are newer than both segments
+    with open(log_path, 'a+b') as log:
+        fcntl.flock(log, fcntl.LOCK_EX)
+        log.seek(log_start)
+        tail = log.read()
+        with open(f'{log_path}.tmp', 'wb') as new_log:
+            new_log.write(tail)
+        os.replace(f'{log_path}.tmp', log_path)
+    os.replace(tmp_path, path)
+
+
+def append_log(path, record):
+    """Appends a change of a post to the log, the lock keeps lines of concurrent writers whole"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    log_path = get_log_path(path)
+    while True:
+        with open(log_path, 'ab') as log:
+            fcntl.flock(log, fcntl.LOCK_EX)
+            try:
+                if os.fstat(log.fileno()).st_ino != os.stat(log_path).st_ino:
+                    continue  # the log was replaced by a rebuild while waiting for the lock
+            except FileNotFoundError:
+                continue
+            log.write(json.dumps(record, separators=(',', ':')).encode() + b'\n')
+            return
+
+
+class SegmentIndex:
+    """
+    Base of the read side of an index made of a memory-mapped segment and a log
+
+    Subclasses open the segment in _open_segment, clear changes of the log in _reset_log
+    and apply a record of the log in _apply.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._segment_stat = None
+        self._log_stat = None
+        self._log_offset = 0
+        self._mmap = None
+        self._open_segment()
+
+    def _open_segment(self):
+        raise NotImplementedError
+
+    def _reset_log(self):
+        raise NotImplementedError
+
+    def _apply(self, record):
+        raise NotImplementedError
+
+    def refresh(self):
+        """Reopens a rebuilt segment and replays records appended to the log since the last read"""
+        with self._lock:
+            try:
+                segment_stat = os.stat(self.path)
+            except FileNotFoundError:
+                segment_stat = None
+            if self._is_changed(segment_stat, self._segment_stat):
+                self._open_segment()
+            try:
+                log_stat = os.stat(get_log_path(self.path))
+            except FileNotFoundError:
+                return
+            if self._log_stat is not None and log_stat.st_ino != self._log_stat.st_ino:
+                self._reset_log()
+            self._log_stat = log_stat
+            if log_stat.st_size <= self._log_offset:
+                return
+            with open(get_log_path(self.path), 'rb') as log:
+                log.seek(self._log_offset)
+                data = log.read()
+            complete = data.rfind(b'\n') + 1  # a line being written is read by the next refresh
+            for line in data[:complete].splitlines():
+                self._apply(json.loads(line))
+            self._log_offset += complete
+
+    @staticmethod
+    def _is_changed(stat, old_stat):
+        if stat is None or old_stat is None:
+            return stat is not old_stat
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size) != (old_stat.st_ino, old_stat.st_mtime_ns,
+                                                                 old_stat.st_size)
+
+
+class SearchIndex(SegmentIndex):
+    """
+    Read side of the index
+
+    Features:
+      * Postings are read straight from the memory-mapped segment without copying
+      * Changed and deleted posts of the log mask their documents in the segment
+      * Ranks posts with BM25
+    """
+
+    def _open_segment(self):
+        self._close_segment()
+        self._segment_stat = None
+        self.post_ids, self.lengths, self.dictionary = array('q'), array('I'), {}
+        self.docs, self.total_length = 0, 0
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as file:
+                self._segment_stat = os.fstat(file.fileno())
+                self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, self.docs, self.total_length, dictionary_offset, dictionary_size = HEADER.unpack_from(self._mmap)
+            if magic != MAGIC:
+                raise ValueError(f'{self.path} is not a search index or has a different byte order')
+            view = memoryview(self._mmap)
+            ids_end = HEADER.size + 8 * self.docs
+            self.post_ids = view[HEADER.size:ids_end].cast('q')
+            self.lengths = view[ids_end:ids_end + 4 * self.docs].cast('I')
+            self.dictionary = json.loads(self._mmap[dictionary_offset:dictionary_offset + dictionary_size])
+        self._reset_log()
+
+    def _close_segment(self):
+        if self._mmap is not None:
+            self.post_ids.release()
+            self.lengths.release()
+            self._mmap.close()
+            self._mmap = None
+
+    def _reset_log(self):
+        self._log_stat = None
+        self._log_offset = 0
+        self.masked = set()  # segment documents replaced or deleted by the log
+        self.overlay = {}  # post_id: (term frequencies, length) of posts from the log
+        self.overlay_postings = {}  # term: {post_id: frequency}
+
+    def _segment_number(self, post_id):
+        number = bisect.bisect_left(self.post_ids, post_id)
+        return number if number < self.docs and self.post_ids[number] == post_id else None
+
+    def _apply(self, record):
+        post_id = record['id']
+        number = self._segment_number(post_id)
+        if number is not None:
+            self.masked.add(number)
+        old = self.overlay.pop(post_id, None)
+        if old:
+            for term in old[0]:
+                self.overlay_postings[term].pop(post_id, None)
+        if record['op'] == 'upsert':
+            frequencies = record['tf']
+            self.overlay[post_id] = (frequencies, sum(frequencies.values()))
+            for term, frequency in frequencies.items():
+                self.overlay_postings.setdefault(term, {})[post_id] = frequency
+
+    def search(self, query, limit=None):
+        """Returns up to limit (post_id, score) pairs ordered by BM25 score"""
+        self.refresh()
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        with self._lock:
+            docs = self.docs - len(self.masked) + len(self.overlay)
+            if docs <= 0:
+                return []
+            total_length = self.total_length + sum(length for _, length in self.overlay.values())
+            average_length = total_length / (self.docs + len(self.overlay)) or 1
+            scores = {}
+            for term in terms:
+                offset, segment_df = self.dictionary.get(term, (0, 0))
+                overlay_postings = self.overlay_postings.get(term, {})
+                df = segment_df + len(overlay_postings)
+                if not df:
+                    continue
+                idf = math.log(1 + (docs - df + 0.5) / (df + 0.5))
+                if segment_df:
+                    postings = memoryview(self._mmap)[offset:offset + 8 * segment_df].cast('I')
+                    for i in range(0, len(postings), 2):
+                        number, frequency = postings[i], postings[i + 1]
+                        if number in self.masked:
+                            continue
+                        post_id = self.post_ids[number]
+                        scores[post_id] = scores.get(post_id, 0) + idf * self._bm25(
+                            frequency, self.lengths[number], average_length)
+                    postings.release()
+                for post_id, frequency in overlay_postings.items():
+                    scores[post_id] = scores.get(post_id, 0) + idf * self._bm25(
+                        frequency, self.overlay[post_id][1], average_length)
+        if limit is None:
+            return sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+        return heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], -item[0]))
+
+    @staticmethod
+    def _bm25(frequency, length, average_length):
+        return frequency * (K1 + 1) / (frequency + K1 * (1 - B + B * length / average_length))
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_search_index():
+    """Returns the index of SEARCH_INDEX_PATH, one per process"""
+    path = str(settings.SEARCH_INDEX_PATH)
+    with _indexes_lock:
+        if path not in _indexes:
+            _indexes[path] = SearchIndex(path)
+        return _indexes[path]
+
+
+def index_post(post):
+    """Writes the current state of a post to the log"""
+    frequencies = get_term_frequencies(post.title, post.content, post.tags.names())
+    append_log(str(settings.SEARCH_INDEX_PATH), {'op': 'upsert', 'id': post.pk, 'tf': frequencies})
+
+
+def unindex_post(post_id):
+    """Writes a deletion of a post to the log"""
+    append_log(str(settings.SEARCH_INDEX_PATH), {'op': 'delete', 'id': post_id})
@@ -0,0 +1,161 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from taggit.models import Tag, TaggedItem
+from post.models import Post, Comment
+from post import card_cache, comment_stats, feed_cache, leaderboards, sitemap_files, tag_cloud
+from post.search import update_search_vector
+from post.search_index import index_post, unindex_post
+from post import tag_index
+
+
+def deleted_with_post(**kwargs):
+    """Returns True for comments deleted by the cascade of their post, the post handlers cover them"""
+    origin = kwargs.get('origin')
+    return isinstance(origin, Post) or isinstance(origin, QuerySet) and origin.model is Post
+
+
+@receiver(post_save, sender=Post)
+def post_search_vector_update(sender, instance, **kwargs):
+    update_search_vector([instance.pk])
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def post_tags_search_vector_update(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear') and isinstance(instance, Post):
+        update_search_vector([instance.pk])
+
+
+@receiver(post_save, sender=Post)
+def post_search_index_update(sender, instance, **kwargs):
+    if settings.SEARCH_BACKEND == 'index':
+        transaction.on_commit(lambda: index_post(instance))
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def post_tags_search_index_update(sender, instance, action, **kwargs):
+    if settings.SEARCH_BACKEND == 'index' and action in ('post_add', 'post_remove', 'post_clear') \
+            and isinstance(instance, Post):
+        transaction.on_commit(lambda: index_post(instance))
+
+
+@receiver(post_delete, sender=Post)
+def post_search_index_delete(sender, instance, **kwargs):
+    if settings.SEARCH_BACKEND == 'index':
+        post_id = instance.pk
+        transaction.on_commit(lambda: unindex_post(post_id))
+
+
+@receiver(post_save, sender=Comment)
+def comment_count_update(sender, instance, created, **kwargs):
+    if created:
+        comment_stats.comment_added(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_count_delete(sender, instance, **kwargs):
+    if not deleted_with_post(**kwargs):  # the post of the comment is deleted, its counters with it
+        comment_stats.comment_removed(instance)
+
+
+@receiver(post_save, sender=Comment)
+def comment_leaderboard_update(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: leaderboards.add_comments(instance.post_id, 1))
+
+
+@receiver(post_delete, sender=Comment)
+def comment_leaderboard_delete(sender, instance, **kwargs):
+    if deleted_with_post(**kwargs):  # post_leaderboard_delete removes the post from the boards once
+        return
+    transaction.on_commit(lambda: leaderboards.add_comments(instance.post_id, -1))
+
+
+@receiver(post_delete, sender=Post)
+def post_leaderboard_delete(sender, instance, **kwargs):
+    post_id = instance.pk
+    transaction.on_commit(lambda: leaderboards.remove_post(post_id))
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def post_sitemap_update(sender, instance, **kwargs):
+    post_id = instance.pk
+    transaction.on_commit(lambda: sitemap_files.mark_changed([post_id]))
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_sitemap_update(sender, instance, **kwargs):
+    # lastmod of a post changes with new and deleted comments
+    if kwargs.get('created', True) and not deleted_with_post(**kwargs):
+        transaction.on_commit(lambda: sitemap_files.mark_changed([instance.post_id]))
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def feed_version_update(sender, instance, **kwargs):
+    """Changes made outside of the views, e.g. in the admin, also invalidate the feed and its ETags"""
+    if sender is Comment and deleted_with_post(**kwargs):  # the deleted post bumps the version once
+        return
+    transaction.on_commit(feed_cache.bump_version)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def post_card_update(sender, instance, **kwargs):
+    post_id = instance.pk
+    transaction.on_commit(lambda: card_cache.invalidate_post(post_id))
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def post_tags_card_update(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear') and isinstance(instance, Post):
+        transaction.on_commit(lambda: card_cache.invalidate_post(instance.pk))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tag_card_update(sender, instance, **kwargs):
+    """A renamed or deleted tag changes the cards of all its posts and the tag cloud, a new tag is on no card yet"""
+    if not kwargs.get('created'):
+        transaction.on_commit(card_cache.bump_tag_version)
+        transaction.on_commit(tag_cloud.invalidate)
+
+
+@receiver(post_save, sender=TaggedItem)
+def tag_cloud_add(sender, instance, created, **kwargs):
+    if created and tag_cloud.is_post_tag(instance):
+        tag_cloud.tag_added(instance.tag_id)
+        transaction.on_commit(tag_cloud.invalidate)
+
+
+@receiver(post_delete, sender=TaggedItem)
+def tag_cloud_remove(sender, instance, **kwargs):
+    if tag_cloud.is_post_tag(instance):  # also called for the tags of a deleted post
+        tag_cloud.tag_removed(instance.tag_id)
+        transaction.on_commit(tag_cloud.invalidate)
+
+
+@receiver(post_save, sender=Post)
+def post_tag_index_update(sender, instance, created, **kwargs):
+    if settings.TAG_FILTER_BACKEND == 'index' and created:  # tags of a post do not change on other saves
+        transaction.on_commit(lambda: tag_index.index_post(instance))
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def post_tags_tag_index_update(sender, instance, action, **kwargs):
+    if settings.TAG_FILTER_BACKEND == 'index' and action in ('post_add', 'post_remove', 'post_clear') \
+            and isinstance(instance, Post):
+        transaction.on_commit(lambda: tag_index.index_post(instance))
+
+
+@receiver(post_delete, sender=Post)
+def post_tag_index_delete(sender, instance, **kwargs):
+    if settings.TAG_FILTER_BACKEND == 'index':
+        post_id = instance.pk
+        transaction.on_commit(lambda: tag_index.unindex_post(post_id))
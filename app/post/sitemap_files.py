@@ -0,0 +1,128 @@
+"""
+Pre-rendered sitemap files.
+
+Posts are split into pages by ranges of primary keys, page n has the posts with
+pk in ((n - 1) * SITEMAP_PAGE_SIZE, n * SITEMAP_PAGE_SIZE]. A post always stays on its page,
+so a changed post re-renders one page and the index. Pages changed since the last refresh are
+collected in a Redis set by post signals and rendered by the refresh_sitemaps beat task.
+Files are written to SITEMAP_ROOT, served by nginx or by the sitemap_file view.
+"""
+import gzip
+import logging
+import os
+from django.conf import settings
+from django.contrib.sitemaps.views import SitemapIndexItem
+from django.contrib.sites.models import Site
+from django.db.models import F, Max
+from django.template.loader import render_to_string
+from redis import RedisError
+from blog.redis_client import get_redis
+from post.models import Post
+from post.sitemaps import PostSitemap
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = 'sitemap.xml'
+CHANGED_PAGES_KEY = 'sitemap:changed'
+
+
+def get_page(post_id):
+    return (post_id - 1) // settings.SITEMAP_PAGE_SIZE + 1
+
+
+def get_page_name(page):
+    return f'posts-{page}.xml'
+
+
+def get_domain():
+    return settings.SITEMAP_DOMAIN or Site.objects.get_current().domain
+
+
+def _write(name, content):
+    """Replaces a file atomically, a gzipped copy is written next to it for gzip_static of nginx"""
+    os.makedirs(settings.SITEMAP_ROOT, exist_ok=True)
+    path = os.path.join(settings.SITEMAP_ROOT, name)
+    data = content.encode()
+    files = [(path, data)]
+    if settings.SITEMAP_GZIP:
+        files.append((f'{path}.gz', gzip.compress(data, mtime=0)))
+    for file_path, file_data in files:
+        with open(f'{file_path}.tmp', 'wb') as file:
+            file.write(file_data)
+        os.replace(f'{file_path}.tmp', file_path)
+
+
+def _remove(name):
+    path = os.path.join(settings.SITEMAP_ROOT, name)
+    for file_path in (path, f'{path}.gz'):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+
+def write_page(page):
+    """Renders the posts of a page, an empty page is removed"""
+    size = settings.SITEMAP_PAGE_SIZE
+    sitemap = PostSitemap(pk_range=((page - 1) * size + 1, page * size))
+    sitemap.limit = size
+    urls = sitemap.get_urls(site=Site(domain=get_domain()), protocol=settings.SITEMAP_PROTOCOL)
+    if urls:
+        _write(get_page_name(page), render_to_string('sitemap.xml', {'urlset': urls}))
+    else:
+        _remove(get_page_name(page))
+
+
+def get_pages():
+    """Returns {page: lastmod} of all pages with one aggregate query"""
+    pages = Post.objects.annotate(page=(F('pk') - 1) / settings.SITEMAP_PAGE_SIZE + 1).values('page').annotate(
+        updated_at=Max('updated_at'), last_comment_at=Max('last_comment_at')).order_by('page')
+    return {row['page']: max(filter(None, (row['updated_at'], row['last_comment_at']))) for row in pages}
+
+
+def write_index(pages):
+    """Renders the index of the pages and removes the files of pages which no longer exist"""
+    base_url = f'{settings.SITEMAP_PROTOCOL}://{get_domain()}{settings.SITEMAP_URL}'
+    items = [SitemapIndexItem(f'{base_url}{get_page_name(page)}', lastmod) for page, lastmod in pages.items()]
+    _write(INDEX_NAME, render_to_string('sitemap_index.xml', {'sitemaps': items}))
+    names = {get_page_name(page) for page in pages}
+    for name in os.listdir(settings.SITEMAP_ROOT):
+        if name.startswith('posts-') and name.removesuffix('.gz') not in names and not name.endswith('.tmp'):
+            os.remove(os.path.join(settings.SITEMAP_ROOT, name))
+
+
+def build():
+    """Renders all pages and the index"""
+    pages = get_pages()
+    for page in pages:
+        write_page(page)
+    write_index(pages)
+    return len(pages)
+
+
+def mark_changed(post_ids):
+    """Records the pages of changed posts, they are rendered by the next refresh"""
+    try:
+        get_redis().sadd(CHANGED_PAGES_KEY, *{get_page(post_id) for post_id in post_ids})
+    except RedisError:
+        logger.warning('Sitemap pages of posts %s are not marked, they are rendered by the next build', post_ids)
+
+
+def refresh():
+    """Renders the changed pages and the index, builds all files if the index does not exist yet"""
+    if not os.path.exists(os.path.join(settings.SITEMAP_ROOT, INDEX_NAME)):
+        try:
+            get_redis().delete(CHANGED_PAGES_KEY)  # every page is rendered by the build
+        except RedisError:
+            pass
+        return build()
+    client = get_redis()
+    changed = [int(page) for page in client.spop(CHANGED_PAGES_KEY, client.scard(CHANGED_PAGES_KEY)) or []]
+    if not changed:
+        return 0
+    try:
+        for page in changed:
+            write_page(page)
+        write_index(get_pages())
+    except Exception:
+        client.sadd(CHANGED_PAGES_KEY, *changed)  # the pages are rendered by the next refresh
+        raise
+    return len(changed)
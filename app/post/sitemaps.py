@@ -1,4 +1,5 @@
 from django.contrib.sitemaps import Sitemap
+from blog.db_router import get_read_database
 from post.models import Post
 
 
@@ -6,8 +7,18 @@ class PostSitemap(Sitemap):
     changefreq = 'weekly'
     priority = 0.9
 
+    def __init__(self, pk_range=None):
+        self.pk_range = pk_range  # (first, last) primary keys of a pre-rendered page
+
     def items(self):
-        return Post.objects.all()
+        """Loads only the fields of the url and lastmod from a read replica, the content of posts is not needed"""
+        posts = Post.objects.using(get_read_database()).only('slug', 'updated_at', 'last_comment_at').order_by('pk')
+        if self.pk_range:
+            return list(posts.filter(pk__range=self.pk_range))  # one query, the paginator does not count the page
+        return posts
 
     def lastmod(self, obj):
+        """A new comment changes the page of the post too"""
+        if obj.last_comment_at and obj.last_comment_at > obj.updated_at:
+            return obj.last_comment_at
         return obj.updated_at
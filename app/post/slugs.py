@@ -0,0 +1,79 @@
+import re
+from functools import reduce
+from operator import or_
+from django.db.models import Q
+from django.db.models.functions import Length
+from django.utils.text import slugify
+
+SLUG_QUERY_CHUNK_SIZE = 500
+SUFFIX_RE = re.compile(r'^(.+)-([1-9][0-9]*)$')
+
+
+def get_base_slug(title):
+    return slugify(title) or 'post'  # a title without letters and digits has an empty slug
+
+
+def _suffix_regex(base):
+    return rf'^{re.escape(base)}(-[1-9][0-9]*)?$'
+
+
+def _get_suffix(base, slug):
+    """Returns 0 for the base slug, the number of a suffixed slug or None if the slug belongs to another base"""
+    match = re.match(_suffix_regex(base), slug)
+    if match is None:
+        return None
+    return int(match.group(1)[1:]) if match.group(1) else 0
+
+
+def next_free_slug(model, base):
+    """
+    Returns the base slug or the base slug with a suffix after the largest taken one
+
+    Features:
+      * One query, the prefix condition uses the index of the slug column
+      * The longest and then the greatest slug has the largest numeric suffix
+    """
+    slug = model.objects.filter(slug__startswith=base, slug__regex=_suffix_regex(base)).order_by(
+        Length('slug').desc(), '-slug').values_list('slug', flat=True).first()
+    if slug is None:
+        return base
+    return f'{base}-{_get_suffix(base, slug) + 1}'
+
+
+def assign_slugs(model, objects):
+    """
+    Assigns unique slugs to unsaved objects without a slug, used by bulk imports before bulk_create
+
+    Features:
+      * Taken slugs are loaded with one query per chunk of distinct base slugs, only the base slugs and their
+        suffixed slugs are loaded, not every slug with the same prefix
+      * Objects of the batch with the same title get consecutive suffixes
+    """
+    pending = [obj for obj in objects if not obj.slug]
+    bases = [get_base_slug(obj.title) for obj in pending]
+    distinct_bases = sorted(set(bases))
+    largest = dict.fromkeys(distinct_bases)  # base: largest taken suffix or None if the base is free
+    for i in range(0, len(distinct_bases), SLUG_QUERY_CHUNK_SIZE):
+        chunk = distinct_bases[i:i + SLUG_QUERY_CHUNK_SIZE]
+        condition = reduce(or_, (Q(slug__startswith=base, slug__regex=_suffix_regex(base)) for base in chunk))
+        for slug in model.objects.filter(condition).values_list('slug', flat=True):
+            _take(largest, slug)
+    for obj in objects:  # slugs set explicitly in the batch are taken too
+        if obj.slug:
+            _take(largest, obj.slug)
+    for obj, base in zip(pending, bases):
+        suffix = largest[base]
+        obj.slug = base if suffix is None else f'{base}-{suffix + 1}'
+        largest[base] = 0 if suffix is None else suffix + 1
+    return objects
+
+
+def _take(largest, slug):
+    """Records a taken slug if it is a base slug of the batch or one of its suffixed slugs"""
+    candidates = [(slug, 0)]
+    match = SUFFIX_RE.match(slug)
+    if match:
+        candidates.append((match.group(1), int(match.group(2))))
+    for base, suffix in candidates:
+        if base in largest and (largest[base] is None or suffix > largest[base]):
+            largest[base] = suffix
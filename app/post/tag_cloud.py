@@ -0,0 +1,85 @@
+"""
+Tag cloud with post counts of tags.
+
+The number of posts of every tag is kept in TagStat and changed by the signals of tagged items, so a tag which
+is added to or removed from a post, and every tag of a deleted post, updates one row. Bulk loaders bypass the
+signals and call repair(). The cloud is read from the cache, a change of a counter drops it.
+"""
+import math
+from asgiref.sync import sync_to_async
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from taggit.models import Tag, TaggedItem
+from post.models import Post, TagStat
+from post import feed_cache
+
+CLOUD_KEY = 'tags:cloud'
+CLOUD_CACHE_TIMEOUT = 60 * 60
+CLOUD_SIZE = 30
+WEIGHTS = 5  # font sizes of the cloud
+
+
+def is_post_tag(tagged_item):
+    return tagged_item.content_type_id == ContentType.objects.get_for_model(Post).pk
+
+
+def tag_added(tag_id):
+    """Increases the post count of a tag, the row of a tag is created on its first post"""
+    if not TagStat.objects.filter(tag_id=tag_id).update(post_count=F('post_count') + 1):
+        TagStat.objects.bulk_create([TagStat(tag_id=tag_id)], ignore_conflicts=True)  # safe for concurrent adds
+        TagStat.objects.filter(tag_id=tag_id).update(post_count=F('post_count') + 1)
+
+
+def tag_removed(tag_id):
+    TagStat.objects.filter(tag_id=tag_id, post_count__gt=0).update(post_count=F('post_count') - 1)
+
+
+def repair():
+    """Recomputes the post counts of all tags with one INSERT and one UPDATE"""
+    TagStat.objects.bulk_create([TagStat(tag_id=tag_id) for tag_id in Tag.objects.filter(
+        stat__isnull=True).values_list('pk', flat=True)], ignore_conflicts=True)
+    content_type = ContentType.objects.get_for_model(Post)
+    counts = TaggedItem.objects.filter(tag=OuterRef('tag'), content_type=content_type).order_by().values(
+        'tag').annotate(total=Count('pk')).values('total')
+    updated = TagStat.objects.update(post_count=Coalesce(Subquery(counts), Value(0), output_field=IntegerField()))
+    invalidate()
+    return updated
+
+
+def invalidate():
+    cache.delete(CLOUD_KEY)
+    feed_cache.bump_panels_version()  # the feed pages show the cloud
+
+
+def get_cloud(limit=CLOUD_SIZE):
+    """
+    Returns the most used tags ordered by name, every tag has post_count and weight from 1 to WEIGHTS
+
+    Features:
+      * The top tags are read with the post_count index of TagStat, tags are never aggregated per request
+      * The cloud is cached until a post count changes
+      * Weights grow with the logarithm of the post count, so a few popular tags do not flatten the cloud
+    """
+    cloud = cache.get(CLOUD_KEY)
+    if cloud is None:
+        stats = TagStat.objects.filter(post_count__gt=0).select_related('tag').order_by('-post_count', 'tag_id')
+        cloud = [{'name': stat.tag.name, 'slug': stat.tag.slug, 'post_count': stat.post_count}
+                 for stat in stats[:CLOUD_SIZE]]
+        if cloud:
+            lowest, highest = math.log(cloud[-1]['post_count']), math.log(cloud[0]['post_count'])
+            for tag in cloud:
+                position = (math.log(tag['post_count']) - lowest) / (highest - lowest) if highest > lowest else 0
+                tag['weight'] = 1 + round(position * (WEIGHTS - 1))
+        cloud.sort(key=lambda tag: tag['name'].lower())
+        cache.set(CLOUD_KEY, cloud, CLOUD_CACHE_TIMEOUT)
+    return cloud[:limit]
+
+
+async def aget_cloud(limit=CLOUD_SIZE):
+    """Async version of get_cloud(), the cloud is read with the async cache API"""
+    cloud = await cache.aget(CLOUD_KEY)
+    if cloud is None:
+        return await sync_to_async(get_cloud)(limit)
+    return cloud[:limit]
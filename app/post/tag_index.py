@@ -0,0 +1,272 @@
+"""
+Tag index for filtering the feed by combinations of tags.
+
+The index has the layout of post/search_index.py: a base segment built by the build_tag_index command, which is
+memory-mapped by every worker, and an append-only log of posts changed after the build, written from post signals.
+
+Documents of the segment are ordered like the feed, by (-created_at, -id), so a document number is a position in
+the feed. Every tag has a bitmap of its documents, the posts of all or any of the tags are the AND or the OR of
+the bitmaps, and a page is read from the set bits next to the cursor. Only the post ids of a page are hydrated.
+
+Layout of the base segment (native byte order):
+  header | post ids (int64 * docs) | created_at in microseconds (int64 * docs) | bitmaps | dictionary (json)
+A bitmap is the little-endian bytes of an integer whose bit n is document n, the dictionary maps tag ids to
+(offset, size) of their bitmaps.
+"""
+import bisect
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from functools import reduce
+from itertools import islice
+from operator import and_, or_
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from post.pagination import KeysetPage, decode_cursor
+from post.search_index import SegmentIndex, append_log, get_log_path, replace_segment
+
+MAGIC = b'BLGTAG1' + (b'L' if sys.byteorder == 'little' else b'B')
+HEADER = struct.Struct('<8sQQQ')  # magic, docs, dictionary offset, dictionary size
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+IndexEntry = namedtuple('IndexEntry', ['pk', 'created_at'])
+
+
+def to_microseconds(value):
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def from_microseconds(value):
+    return EPOCH + timedelta(microseconds=value)
+
+
+def iter_bits(bitmap, start=0):
+    """Yields the positions of the set bits of a bitmap from start upwards"""
+    bitmap >>= start
+    while bitmap:
+        low = (bitmap & -bitmap).bit_length() - 1
+        start += low
+        yield start
+        bitmap >>= low + 1
+        start += 1
+
+
+def iter_bits_reversed(bitmap):
+    """Yields the positions of the set bits of a bitmap from the highest one downwards"""
+    while bitmap:
+        high = bitmap.bit_length() - 1
+        yield high
+        bitmap ^= 1 << high
+
+
+def write_index(path, posts, tagged_items):
+    """
+    Writes a base segment and returns the number of documents
+
+    Features:
+      * posts are (post_id, created_at) pairs in the order of the feed, tagged_items are (post_id, tag_id) pairs
+      * A bitmap ends with its highest document, so a rare tag of old posts takes a few bytes
+      * Log records written during the build are kept, they are replayed over the new segment
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    log_path = get_log_path(path)
+    log_start = os.path.getsize(log_path) if os.path.exists(log_path) else 0
+
+    post_ids, created = array('q'), array('q')
+    for post_id, created_at in posts:
+        post_ids.append(post_id)
+        created.append(to_microseconds(created_at))
+    documents = {post_id: number for number, post_id in enumerate(post_ids)}
+    positions = {}
+    for post_id, tag_id in tagged_items:
+        if post_id in documents:
+            positions.setdefault(tag_id, array('I')).append(documents[post_id])
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(b'\0' * HEADER.size)
+        post_ids.tofile(file)
+        created.tofile(file)
+        dictionary = {}
+        for tag_id, numbers in positions.items():
+            bitmap = bytearray(max(numbers) // 8 + 1)
+            for number in numbers:
+                bitmap[number >> 3] |= 1 << (number & 7)
+            dictionary[tag_id] = [file.tell(), len(bitmap)]
+            file.write(bitmap)
+        dictionary_offset = file.tell()
+        dictionary_bytes = json.dumps(dictionary, separators=(',', ':')).encode()
+        file.write(dictionary_bytes)
+        file.seek(0)
+        file.write(HEADER.pack(MAGIC, len(post_ids), dictionary_offset, len(dictionary_bytes)))
+    replace_segment(path, tmp_path, log_start)
+    return len(post_ids)
+
+
+class TagIndex(SegmentIndex):
+    """
+    Read side of the tag index
+
+    Features:
+      * Bitmaps are decoded from the memory-mapped segment on first use and kept until the segment is rebuilt
+      * Changed and deleted posts of the log are masked in the segment and kept in a small overlay
+      * AND and OR of tags are computed on whole bitmaps, the database only loads the posts of a page
+    """
+
+    def _open_segment(self):
+        self._close_segment()
+        self._segment_stat = None
+        self.post_ids, self.created = array('q'), array('q')
+        self.docs, self.dictionary = 0, {}
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as file:
+                self._segment_stat = os.fstat(file.fileno())
+                self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, self.docs, dictionary_offset, dictionary_size = HEADER.unpack_from(self._mmap)
+            if magic != MAGIC:
+                raise ValueError(f'{self.path} is not a tag index or has a different byte order')
+            view = memoryview(self._mmap)
+            ids_end = HEADER.size + 8 * self.docs
+            self.post_ids = view[HEADER.size:ids_end].cast('q')
+            self.created = view[ids_end:ids_end + 8 * self.docs].cast('q')
+            dictionary = json.loads(self._mmap[dictionary_offset:dictionary_offset + dictionary_size])
+            self.dictionary = {int(tag_id): location for tag_id, location in dictionary.items()}
+        self._bitmaps = {}
+        self._documents = None  # post_id: document number, built when the log is replayed
+        self._reset_log()
+
+    def _close_segment(self):
+        if self._mmap is not None:
+            self.post_ids.release()
+            self.created.release()
+            self._mmap.close()
+            self._mmap = None
+
+    def _reset_log(self):
+        self._log_stat = None
+        self._log_offset = 0
+        self.masked = 0  # bitmap of segment documents replaced or deleted by the log
+        self.overlay = {}  # post_id: (created_at in microseconds, tag ids) of posts from the log
+
+    def _apply(self, record):
+        if self._documents is None:
+            self._documents = {post_id: number for number, post_id in enumerate(self.post_ids)}
+        post_id = record['id']
+        number = self._documents.get(post_id)
+        if number is not None:
+            self.masked |= 1 << number
+        self.overlay.pop(post_id, None)
+        if record['op'] == 'upsert':
+            self.overlay[post_id] = (record['created_at'], frozenset(record['tags']))
+
+    def _get_bitmap(self, tag_id):
+        bitmap = self._bitmaps.get(tag_id)
+        if bitmap is None:
+            offset, size = self.dictionary.get(tag_id, (0, 0))
+            bitmap = int.from_bytes(self._mmap[offset:offset + size], 'little') if size else 0
+            self._bitmaps[tag_id] = bitmap
+        return bitmap
+
+    def _document_key(self, number):
+        return -self.created[number], -self.post_ids[number]
+
+    def find(self, tag_ids, match_all=True, after=None, before=None, limit=10):
+        """
+        Returns up to limit (created_at in microseconds, post_id) keys of posts with all or any of the tags
+
+        Keys are in the order of the feed. With after, the posts which follow the key are returned,
+        with before, the posts which precede the key and are the nearest to it.
+        """
+        self.refresh()
+        tags = set(tag_ids)
+        if not tags:
+            return []
+        with self._lock:
+            bitmap = reduce(and_ if match_all else or_, (self._get_bitmap(tag_id) for tag_id in tags))
+            bitmap &= ~self.masked
+            overlay = sorted(((created, post_id) for post_id, (created, post_tags) in self.overlay.items()
+                              if (tags <= post_tags if match_all else tags & post_tags)), reverse=True)
+            if before is None:
+                start = 0 if after is None else bisect.bisect_right(
+                    range(self.docs), (-after[0], -after[1]), key=self._document_key)
+                numbers = islice(iter_bits(bitmap, start), limit)
+                keys = [(self.created[number], self.post_ids[number]) for number in numbers]
+                keys += [key for key in overlay if after is None or key < after][:limit]
+                return sorted(keys, reverse=True)[:limit]
+            end = bisect.bisect_left(range(self.docs), (-before[0], -before[1]), key=self._document_key)
+            numbers = islice(iter_bits_reversed(bitmap & ((1 << end) - 1)), limit)
+            keys = [(self.created[number], self.post_ids[number]) for number in numbers]
+            keys += [key for key in overlay if key > before][-limit:]
+            return sorted(keys, reverse=True)[-limit:]
+
+
+class TagIndexPaginator:
+    """
+    Cursor paginator over the tag index, its cursors are the cursors of KeysetPaginator
+
+    Features:
+      * Pages contain IndexEntry objects, the posts of a page are hydrated by the caller
+      * Fetches one extra entry to know if there is a next page
+    """
+
+    def __init__(self, index, tag_ids, match_all, per_page):
+        self.index = index
+        self.tag_ids = tag_ids
+        self.match_all = match_all
+        self.per_page = per_page
+
+    def _find(self, **kwargs):
+        keys = self.index.find(self.tag_ids, self.match_all, limit=self.per_page + 1, **kwargs)
+        return [IndexEntry(post_id, from_microseconds(created)) for created, post_id in keys]
+
+    def page(self, cursor=None):
+        """Returns the page pointed by the cursor or the first page"""
+        if not cursor:
+            entries = self._find()
+            return KeysetPage(entries[:self.per_page], len(entries) > self.per_page, False)
+        created_at, pk, direction = decode_cursor(cursor)
+        key = (to_microseconds(created_at), pk)
+        if direction == 'n':
+            entries = self._find(after=key)
+            return KeysetPage(entries[:self.per_page], len(entries) > self.per_page, True)
+        entries = self._find(before=key)
+        has_previous = len(entries) > self.per_page
+        entries = entries[-self.per_page:]
+        if not entries:  # the cursor points before the first post
+            return self.page()
+        return KeysetPage(entries, True, has_previous)
+
+    async def apage(self, cursor=None):
+        """Async version of page(), the index is read in the database thread like other blocking reads"""
+        return await sync_to_async(self.page)(cursor)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_tag_index():
+    """Returns the index of TAG_INDEX_PATH, one per process"""
+    path = str(settings.TAG_INDEX_PATH)
+    with _indexes_lock:
+        if path not in _indexes:
+            _indexes[path] = TagIndex(path)
+        return _indexes[path]
+
+
+def index_post(post):
+    """Writes the current tags of a post to the log"""
+    tag_ids = list(post.tags.values_list('pk', flat=True))
+    append_log(str(settings.TAG_INDEX_PATH), {'op': 'upsert', 'id': post.pk,
+                                              'created_at': to_microseconds(post.created_at), 'tags': tag_ids})
+
+
+def unindex_post(post_id):
+    """Writes a deletion of a post to the log"""
+    append_log(str(settings.TAG_INDEX_PATH), {'op': 'delete', 'id': post_id})
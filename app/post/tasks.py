@@ -1,13 +1,14 @@
 from django.core.mail import send_mail
 from django.conf import settings
 from blog_celery import app
-from post.models import Post
+from post.counters import flush_views
+from post import leaderboards, sitemap_files
 
 
 @app.task
-def post_share(slug, full_url, username, description, email_to):
-    post = Post.objects.get(slug=slug)
-    subject = f"{username} shared this post: {post.title}"
+def post_share(title, full_url, username, description, email_to):
+    """The view passes the title of the post, so the post is not loaded again"""
+    subject = f"{username} shared this post: {title}"
     message = f"{description}\n\n\n Check out this post at: {full_url}"
     send_mail(
         subject,
@@ -15,3 +16,18 @@ def post_share(slug, full_url, username, description, email_to):
         settings.EMAIL_HOST_USER,
         [email_to],
     )
+
+
+@app.task(ignore_result=True)
+def flush_post_views():
+    return flush_views()
+
+
+@app.task(ignore_result=True)
+def reconcile_leaderboards():
+    leaderboards.reconcile()
+
+
+@app.task(ignore_result=True)
+def refresh_sitemaps():
+    return sitemap_files.refresh()
@@ -1,13 +1,17 @@
 from django import template
-from django.core.paginator import Paginator
+from post.pagination import KeysetPaginator, KeysetPage, InvalidCursor
 
 register = template.Library()
 
 
 @register.inclusion_tag('post/comments.html', takes_context=True)
 def show_comments(context, comments):
-    paginator = Paginator(comments, 5)
     request = context['request']
-    page = request.GET.get('c', 1)
-    comments = paginator.get_page(page)
+    if isinstance(comments, KeysetPage):  # the async post view fetches the page itself
+        return {'comments': comments, 'request': request}
+    paginator = KeysetPaginator(comments, 5)
+    try:
+        comments = paginator.page(request.GET.get('c'))
+    except InvalidCursor:  # an invalid cursor shows the first page
+        comments = paginator.page()
     return {'comments': comments, 'request': request}
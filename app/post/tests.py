@@ -1,9 +1,60 @@
-from django.test import TestCase, SimpleTestCase
+import json
+import os
+from io import StringIO
+import random
+import socketserver
+import threading
+import tempfile
+import time
+import warnings
+from types import SimpleNamespace
+from unittest import mock
+from celery.signals import before_task_publish, task_postrun, task_prerun
+from redis import RedisError
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, SimpleTestCase, override_settings
+from django.core.management import call_command, CommandError
 from post.forms import PostForm, CommentForm, PostShareForm
 from django.contrib.auth.models import User
-from django.urls import reverse, resolve
+from django.urls import include, path, reverse, resolve
+from django.db import connection
+from django.utils.connection import ConnectionDoesNotExist
+from django.core.cache import cache
+from django.core.cache.backends.base import CacheKeyWarning
+from django.core import mail
+from django.core.mail import EmailMultiAlternatives, send_mail
+from django.utils import timezone
+from django.template.defaultfilters import truncatewords
+from django.test.utils import CaptureQueriesContext
 import post.views as views
-from post.models import Post, Comment
+from blog import db_pool, db_router, mail_queue, task_stats
+from blog_celery import app as celery_app
+from outbox.models import OutboxTask
+from blog.query_budget import QueryBudgetMixin, QueryBudgetExceeded, Budget
+from taggit.models import Tag
+from post.models import Post, Comment, TagStat
+from post.counters import RedisViewBuffer, get_view_buffer
+from post import feed_cache
+from post.search_index import get_search_index
+from post.pagination import KeysetPaginator, InvalidCursor
+from post import slugs
+from post.slugs import assign_slugs
+from post.tag_index import TagIndexPaginator, get_tag_index
+from post import card_cache, leaderboards, sitemap_files, tag_cloud
+from post.tasks import reconcile_leaderboards
+from post.tasks import flush_post_views, post_share
+from post.async_views import AsyncHomeView, AsyncPostDetailView
+from post.benchmark import compare, compare_servers
+from post.sitemaps import PostSitemap
+
+# urls of the ASGI mode, AsyncViewTests use them with ROOT_URLCONF='post.tests'
+urlpatterns = [
+    path('', AsyncHomeView.as_view(), name='home'),
+    path('post/<str:slug>', AsyncPostDetailView.as_view(), name='about'),
+    path('', include('blog.urls')),
+]
 
 
 class PostFormTests(SimpleTestCase):
@@ -401,6 +452,41 @@ class PostModelTests(TestCase):
         self.assertEqual(self.post.slug, 'test-title')
         self.assertEqual(post1.slug, 'test-title-1')
 
+    def test_post_slug_one_query(self):
+        for _ in range(5):
+            Post.objects.create(author=self.author, title='test title', content='test content')
+        Post.objects.create(author=self.author, title='test title extra', content='test content')
+        post = Post(author=self.author, title='test title', content='test content')
+        with CaptureQueriesContext(connection) as queries:
+            post.save()
+        self.assertEqual(post.slug, 'test-title-6')
+        self.assertEqual(len([query for query in queries if 'SELECT' in query['sql']]), 1)
+
+    def test_post_slug_conflict_retry(self):
+        post = Post(author=self.author, title='test title', content='test content')
+        with mock.patch('post.models.next_free_slug', side_effect=['test-title', 'test-title-1']):
+            post.save()
+        self.assertEqual(post.slug, 'test-title-1')
+
+    def test_assign_slugs(self):
+        Post.objects.create(author=self.author, title='test title', content='test content')
+        Post.objects.create(author=self.author, title='other title', content='test content')
+        posts = [Post(author=self.author, title=title, content='test content')
+                 for title in ('test title', 'test title', 'other', 'new title', 'new title')]
+        with self.assertNumQueries(1):
+            assign_slugs(Post, posts)
+        self.assertEqual([post.slug for post in posts],
+                         ['test-title-2', 'test-title-3', 'other', 'new-title', 'new-title-1'])
+
+    def test_assign_slugs_loads_only_suffixed_slugs(self):
+        for title in ('post', 'post', 'post office', 'posting', 'postal'):
+            Post.objects.create(author=self.author, title=title, content='test content')
+        posts = [Post(author=self.author, title='post', content='test content')]
+        with mock.patch('post.slugs._take', wraps=slugs._take) as take:
+            assign_slugs(Post, posts)
+        self.assertEqual(posts[0].slug, 'post-2')
+        self.assertEqual(sorted(call.args[1] for call in take.call_args_list), ['post', 'post-1'])
+
     def test_post_tags(self):
         self.post.tags.add('test-tag')
         self.assertEqual(self.post.tags.count(), 1)
@@ -453,3 +539,1367 @@ class CommentModelTests(TestCase):
     def test_comment_deleted_with_post(self):
         self.post.delete()
         self.assertEqual(Comment.objects.count(), 0)
+
+
+@override_settings(VIEW_COUNTER_BACKEND='memory')
+class PostViewCounterTests(TestCase):
+
+    def setUp(self):
+        self.user = User(username='test-user', is_active=True)
+        self.user.set_password('Assembler7002')
+        self.user.save()
+        self.post = Post.objects.create(author=self.user, title='test title', content='test content')
+        self.client.login(username=self.user.username, password='Assembler7002')
+        get_view_buffer().claim()
+        get_view_buffer().ack()
+
+    def test_views_are_buffered(self):
+        url = reverse('about', args=[self.post.slug])
+        self.client.get(url)
+        response = self.client.get(url)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.views, 0)
+        self.assertEqual(response.context['post'].views, 2)
+
+    def test_views_flushed(self):
+        updated_at = self.post.updated_at
+        url = reverse('about', args=[self.post.slug])
+        for _ in range(3):
+            self.client.get(url)
+        self.assertEqual(flush_post_views(), 3)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.views, 3)
+        self.assertEqual(self.post.updated_at, updated_at)
+        self.assertEqual(flush_post_views(), 0)
+
+    def test_views_flushed_in_one_query(self):
+        post2 = Post.objects.create(author=self.user, title='test title2', content='test content2')
+        get_view_buffer().incr(self.post.pk, 5)
+        get_view_buffer().incr(post2.pk, 2)
+        with CaptureQueriesContext(connection) as queries:
+            flush_post_views()
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        post2.refresh_from_db()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.views, 5)
+        self.assertEqual(post2.views, 2)
+
+    def test_overlapping_redis_flush_claims_nothing(self):
+        client = mock.MagicMock()
+        client.set.return_value = None  # the claim lock is held by another flush
+        with mock.patch('post.counters.get_redis', return_value=client):
+            self.assertEqual(RedisViewBuffer().claim(), {})
+        client.renamenx.assert_not_called()
+        client.hgetall.assert_not_called()
+        client.set.return_value = True
+        client.hgetall.return_value = {str(self.post.pk): '3'}
+        with mock.patch('post.counters.get_redis', return_value=client):
+            self.assertEqual(RedisViewBuffer().claim(), {self.post.pk: 3})
+        client.renamenx.assert_called_once_with(RedisViewBuffer.key, RedisViewBuffer.claimed_key)
+        client.rename.assert_not_called()  # a claimed hash is never overwritten
+
+
+class FeedCacheTests(TestCase):
+
+    def setUp(self):
+        self.user = User(username='test-user', is_active=True)
+        self.user.set_password('Assembler7002')
+        self.user.save()
+        self.post = Post.objects.create(author=self.user, title='test title', content='test content')
+        cache.clear()
+
+    def test_home_page_served_from_cache(self):
+        self.client.get(reverse('home'))
+        Post.objects.filter(pk=self.post.pk).update(title='changed title')  # bypasses the invalidation
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, 'test title')
+        feed_cache.invalidate_post(self.post.pk)
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, 'changed title')
+
+    def test_page_cache_stores_only_ids(self):
+        self.client.get(reverse('home'))
+        cached_page = cache.get(feed_cache.page_key({'user': None, 'user_posts': False, 'tag': [], 'match': 'all'}, ''))
+        self.assertEqual(cached_page, {'ids': [self.post.pk], 'has_next': False, 'has_previous': False})
+
+    def test_created_post_invalidates_feed(self):
+        self.client.get(reverse('home'))
+        self.client.login(username=self.user.username, password='Assembler7002')
+        context = {'title': 'new-post', 'content': 'test-content-for-post', 'tags': 'hello'}
+        response = self.client.post(reverse('create'), context, follow=True)
+        self.assertContains(response, 'new-post')
+        self.assertEqual(len(response.context['posts']), 2)
+
+    def test_get_posts_keeps_order(self):
+        post2 = Post.objects.create(author=self.user, title='test title2', content='test content2')
+        feed_cache.get_posts([self.post.pk])
+        with self.assertNumQueries(2):  # posts with authors and their tags, only for the missing post
+            posts = feed_cache.get_posts([post2.pk, self.post.pk])
+        self.assertEqual(posts, [post2, self.post])
+
+    def test_filters_cached_separately(self):
+        self.post.tags.add('python')
+        Post.objects.create(author=self.user, title='other', content='other content')
+        response = self.client.get(reverse('search'), {'content': 'python'})
+        self.assertEqual(list(response.context['posts']), [self.post])
+        response = self.client.get(reverse('home'), {'tag': 'python'})
+        self.assertEqual(list(response.context['posts']), [self.post])
+        response = self.client.get(reverse('home'))
+        self.assertEqual(len(response.context['posts']), 2)
+
+    def test_invalid_page(self):
+        response = self.client.get(reverse('search'), {'content': 'test', 'page': 100})
+        self.assertEqual(response.status_code, 404)
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', CacheKeyWarning)  # the key of the page is memcached-safe
+            response = self.client.get(reverse('search'), {'content': 'test', 'page': 'invalid page ' * 30})
+        self.assertEqual(response.status_code, 404)
+
+
+class CardCacheTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='test-author')
+        self.post = Post.objects.create(author=self.user, title='test title', content='test content')
+        self.post.tags.add('python')
+        cache.clear()
+
+    def test_fragment_rendered_once(self):
+        cards = card_cache.get_cards([self.post])
+        self.assertIn('python', cards[self.post.pk])
+        with mock.patch('post.card_cache.render_to_string') as render:
+            self.assertEqual(card_cache.get_cards([self.post]), cards)
+        render.assert_not_called()
+        self.assertEqual(card_cache.get_stats(), (1, 1, 0.5))
+
+    def test_changed_post_rendered_again(self):
+        card_cache.get_cards([self.post])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.content = 'changed content'
+            self.post.save()
+        self.assertIn('changed content', card_cache.get_cards([self.post])[self.post.pk])
+
+    def test_outdated_fragment_rendered_again(self):
+        card_cache.get_cards([self.post])
+        Post.objects.filter(pk=self.post.pk).update(excerpt='changed content', updated_at=timezone.now())
+        self.post.refresh_from_db()  # the fragment was not invalidated, its updated_at is outdated
+        self.assertIn('changed content', card_cache.get_cards([self.post])[self.post.pk])
+
+    def test_tags_invalidate_fragment(self):
+        card_cache.get_cards([self.post])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.tags.add('django')
+        self.assertIn('django', card_cache.get_cards([self.post])[self.post.pk])
+        tag = self.post.tags.get(name='python')
+        with self.captureOnCommitCallbacks(execute=True):
+            tag.name = 'renamed'
+            tag.save()
+        self.post.refresh_from_db()
+        self.assertIn('renamed', card_cache.get_cards([self.post])[self.post.pk])
+
+    def test_author_buttons_not_cached(self):
+        other = User.objects.create(username='test-reader')
+        self.client.force_login(other)
+        response = self.client.get(reverse('home'))
+        self.assertNotContains(response, reverse('edit', args=[self.post.slug]))
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, reverse('edit', args=[self.post.slug]))
+        self.assertContains(response, 'python')
+        self.assertEqual(card_cache.get_stats()[:2], (1, 1))
+
+    def test_stats_command(self):
+        card_cache.get_cards([self.post])
+        out = StringIO()
+        call_command('card_cache_stats', '--reset', stdout=out)
+        self.assertIn('0 hits, 1 misses', out.getvalue())
+        self.assertEqual(card_cache.get_stats(), (0, 0, None))
+
+
+class ExcerptTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='test-author')
+        self.content = ' '.join(f'word{i}' for i in range(450))
+        self.post = Post.objects.create(author=self.user, title='test title', content=self.content)
+        cache.clear()
+
+    def test_fields_filled_on_save(self):
+        self.assertEqual(self.post.excerpt, truncatewords(self.content, 80))
+        self.assertEqual(self.post.word_count, 450)
+        self.assertEqual(self.post.reading_time, 3)
+        self.post.content = 'short content'
+        self.post.save(update_fields=['content'])
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.excerpt, self.post.word_count, self.post.reading_time), ('short content', 2, 1))
+
+    def test_backfill_command(self):
+        Post.objects.update(excerpt='', word_count=0)
+        out = StringIO()
+        call_command('backfill_excerpts', '--chunk-size', '1', stdout=out)
+        self.assertIn('Excerpts of 1 posts are backfilled', out.getvalue())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.excerpt, truncatewords(self.content, 80))
+        self.assertEqual(self.post.word_count, 450)
+
+    def test_feed_defers_content(self):
+        post = feed_cache.get_posts([self.post.pk])[0]
+        self.assertIn('content', post.get_deferred_fields())
+        with self.assertNumQueries(0):
+            card_cache.get_cards([post])
+
+    def test_home_shows_excerpt(self):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse('home'))
+        self.assertContains(response, truncatewords(self.content, 80))
+        self.assertNotContains(response, 'word449')
+        self.assertFalse(any('"content"' in query['sql'] for query in captured.captured_queries
+                             if 'post_post' in query['sql']))
+
+
+class TagCloudTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='test-author')
+        self.post = Post.objects.create(author=self.user, title='test title', content='test content')
+        self.post.tags.add('python', 'happy')
+        self.other = Post.objects.create(author=self.user, title='other title', content='other content')
+        self.other.tags.add('python')
+        cache.clear()
+
+    def get_counts(self):
+        return {tag['name']: tag['post_count'] for tag in tag_cloud.get_cloud()}
+
+    def test_tag_filter_exact(self):
+        response = self.client.get(reverse('home'), {'tag': 'py'})
+        self.assertEqual(list(response.context['posts']), [])
+        response = self.client.get(reverse('home'), {'tag': 'happy'})
+        self.assertEqual(list(response.context['posts']), [self.post])
+
+    def test_tag_filter_by_name(self):
+        self.post.tags.add('Django Tips')
+        response = self.client.get(reverse('home'), {'tag': 'Django Tips'})
+        self.assertEqual(list(response.context['posts']), [self.post])
+        self.assertContains(response, '/?tag=django-tips')
+
+    def test_counts_maintained(self):
+        self.assertEqual(self.get_counts(), {'happy': 1, 'python': 2})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.tags.remove('python')
+        self.assertEqual(self.get_counts(), {'happy': 1, 'python': 1})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.delete()
+        self.assertEqual(self.get_counts(), {})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.tags.set(['django', 'python'])
+        self.assertEqual(self.get_counts(), {'django': 1, 'python': 1})
+
+    def test_cloud_cached(self):
+        tag_cloud.get_cloud()
+        with self.assertNumQueries(0):
+            cloud = tag_cloud.get_cloud()
+        self.assertEqual([tag['name'] for tag in cloud], ['happy', 'python'])
+        self.assertEqual([tag['weight'] for tag in cloud], [1, 5])
+
+    def test_repair_command(self):
+        TagStat.objects.all().delete()
+        out = StringIO()
+        call_command('repair_tag_counts', stdout=out)
+        self.assertIn('Post counts of 2 tags are repaired', out.getvalue())
+        self.assertEqual(self.get_counts(), {'happy': 1, 'python': 2})
+
+    def test_cloud_rendered(self):
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, 'class="tag-cloud-weight-5"')
+
+
+class TagIndexTests(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(TAG_FILTER_BACKEND='index',
+                                                   TAG_INDEX_PATH=os.path.join(self.tmp_dir.name, 'tags.idx'))
+        self.settings_override.enable()
+        self.user = User.objects.create(username='test-author')
+        self.posts = []
+        for i in range(12):
+            post = Post.objects.create(author=self.user, title=f'test title {i}', content='test content')
+            post.tags.add(*[tag for tag, step in (('even', 2), ('third', 3), ('all', 1)) if i % step == 0])
+            self.posts.append(post)
+        call_command('build_tag_index', stdout=StringIO())
+        cache.clear()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.tmp_dir.cleanup()
+
+    def get_tag_ids(self, *names):
+        return [Tag.objects.get(name=name).pk for name in names]
+
+    def get_feed(self, tags, match='all'):
+        """Returns the post ids of all pages, pages are followed by their next cursors"""
+        post_ids, cursor = [], None
+        while True:
+            page = TagIndexPaginator(get_tag_index(), self.get_tag_ids(*tags), match == 'all', 2).page(cursor)
+            post_ids += [entry.pk for entry in page]
+            if not page.has_next():
+                return post_ids
+            cursor = page.next_cursor
+
+    def expected(self, test):
+        return [post.pk for post in reversed(self.posts) if test(self.posts.index(post))]
+
+    def test_and_or(self):
+        self.assertEqual(self.get_feed(['even', 'third']), self.expected(lambda i: i % 6 == 0))
+        self.assertEqual(self.get_feed(['even', 'third'], 'any'),
+                         self.expected(lambda i: i % 2 == 0 or i % 3 == 0))
+
+    def test_previous_page(self):
+        paginator = TagIndexPaginator(get_tag_index(), self.get_tag_ids('all'), True, 5)
+        second = paginator.page(paginator.page().next_cursor)
+        first = paginator.page(second.previous_cursor)
+        self.assertEqual([entry.pk for entry in first], self.expected(lambda i: i >= 7))
+        self.assertFalse(first.has_previous())
+
+    def test_incremental_update(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            new_post = Post.objects.create(author=self.user, title='new title', content='test content')
+        with self.captureOnCommitCallbacks(execute=True):
+            new_post.tags.add('even', 'third')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.posts[6].tags.remove('third')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.posts[0].delete()
+        self.assertEqual(self.get_feed(['even', 'third']), [new_post.pk])
+        call_command('build_tag_index', stdout=StringIO())
+        self.assertEqual(self.get_feed(['even', 'third']), [new_post.pk])
+
+    def test_home_filters_with_index(self):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse('home'), {'tag': ['even', 'third'], 'match': 'any'})
+        filters = [query['sql'] for query in captured.captured_queries
+                   if query['sql'].startswith('SELECT "post_post"."id", "post_post"."created_at"')]
+        self.assertEqual(filters, [])  # the page is read from the bitmaps, only its posts are loaded
+        self.assertEqual([post.pk for post in response.context['posts']],
+                         self.expected(lambda i: i % 2 == 0 or i % 3 == 0)[:5])
+        response = self.client.get(reverse('home'), {'tag': ['even', 'unknown']})
+        self.assertEqual(list(response.context['posts']), [])
+
+    @override_settings(TAG_FILTER_BACKEND='database')
+    def test_home_filters_with_database(self):
+        response = self.client.get(reverse('home'), {'tag': ['even', 'third']})
+        self.assertEqual([post.pk for post in response.context['posts']], self.expected(lambda i: i % 6 == 0))
+        response = self.client.get(reverse('home'), {'tag': ['even', 'third'], 'match': 'any'})
+        self.assertEqual([post.pk for post in response.context['posts']],
+                         self.expected(lambda i: i % 2 == 0 or i % 3 == 0)[:5])
+
+
+class PostSearchTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='test-author')
+        self.post = Post.objects.create(author=self.user, title='django tips',
+                                        content='<b>bold</b> text about the Django ORM and querysets')
+        self.post.tags.add('python')
+        self.other = Post.objects.create(author=self.user, title='other title', content='other content')
+        cache.clear()
+
+    def test_search_url_view(self):
+        url = reverse('search')
+        match = resolve(url)
+        self.assertEqual(match.func.view_class, views.SearchView)
+
+    def test_search_response(self):
+        response = self.client.get(reverse('search'), {'content': 'django'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'post/search.html')
+        self.assertEqual(list(response.context['posts']), [self.post])
+        self.assertContains(response, '<mark>Django</mark>')
+
+    def test_search_by_tag(self):
+        response = self.client.get(reverse('search'), {'content': 'python'})
+        self.assertEqual(list(response.context['posts']), [self.post])
+
+    def test_search_snippet_escaped(self):
+        response = self.client.get(reverse('search'), {'content': 'bold'})
+        self.assertContains(response, '&lt;b&gt;<mark>bold</mark>&lt;/b&gt;')
+
+    def test_search_empty_query(self):
+        response = self.client.get(reverse('search'), {'content': ' '})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Nothing found')
+
+
+class SearchIndexTests(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(SEARCH_BACKEND='index',
+                                                   SEARCH_INDEX_PATH=os.path.join(self.tmp_dir.name, 'posts.idx'))
+        self.settings_override.enable()
+        self.user = User.objects.create(username='test-author')
+        self.post = Post.objects.create(author=self.user, title='django tips', content='some text about models')
+        self.post.tags.add('python')
+        self.other = Post.objects.create(author=self.user, title='cooking',
+                                         content='django is mentioned once in a long text about cooking soup')
+        call_command('build_search_index', stdout=StringIO())
+        cache.clear()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.tmp_dir.cleanup()
+
+    def test_build_and_rank(self):
+        ranked = get_search_index().search('django')
+        self.assertEqual([post_id for post_id, _ in ranked], [self.post.pk, self.other.pk])
+
+    def test_search_by_tag(self):
+        ranked = get_search_index().search('python')
+        self.assertEqual([post_id for post_id, _ in ranked], [self.post.pk])
+
+    def test_incremental_update(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            new_post = Post.objects.create(author=self.user, title='soup recipes', content='more soup')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.delete()
+        ranked = get_search_index().search('soup')
+        self.assertEqual([post_id for post_id, _ in ranked], [new_post.pk])
+
+    def test_rebuild_keeps_log_consistent(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.title = 'flask tips'
+            self.post.save()
+        self.assertEqual([post_id for post_id, _ in get_search_index().search('flask')], [self.post.pk])
+        call_command('build_search_index', stdout=StringIO())
+        self.assertEqual([post_id for post_id, _ in get_search_index().search('flask')], [self.post.pk])
+        self.assertEqual([post_id for post_id, _ in get_search_index().search('django')], [self.other.pk])
+
+    def test_search_uses_index(self):
+        response = self.client.get(reverse('search'), {'content': 'django'})
+        self.assertEqual(list(response.context['posts']), [self.post, self.other])
+
+
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        self.user = User(username='test-user', is_active=True)
+        self.user.set_password('Assembler7002')
+        self.user.save()
+        self.posts = [Post.objects.create(author=self.user, title=f'test title {i}', content='test content')
+                      for i in range(12)]
+        Post.objects.update(created_at=self.posts[0].created_at)  # ties are ordered by id
+        self.posts.reverse()
+        cache.clear()
+
+    def test_pages_forward_and_backward(self):
+        paginator = KeysetPaginator(Post.objects.all(), 5)
+        first = paginator.page()
+        self.assertEqual(list(first), self.posts[:5])
+        self.assertFalse(first.has_previous())
+        second = paginator.page(first.next_cursor)
+        self.assertEqual(list(second), self.posts[5:10])
+        third = paginator.page(second.next_cursor)
+        self.assertEqual(list(third), self.posts[10:])
+        self.assertFalse(third.has_next())
+        self.assertEqual(list(paginator.page(third.previous_cursor)), self.posts[5:10])
+        previous = paginator.page(second.previous_cursor)
+        self.assertEqual(list(previous), self.posts[:5])
+        self.assertFalse(previous.has_previous())
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(InvalidCursor):
+            KeysetPaginator(Post.objects.all(), 5).page('invalid')
+        for cursor in ['invalid', 'invalid cursor', 'a' * 300]:  # checked before it is a part of the cache key
+            with mock.patch('post.feed_cache.page_key', wraps=feed_cache.page_key) as page_key:
+                response = self.client.get(reverse('home'), {'cursor': cursor})
+            self.assertEqual(response.status_code, 404)
+            page_key.assert_not_called()
+
+    def test_no_count_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            KeysetPaginator(Post.objects.all(), 5).page()
+        self.assertFalse([query for query in queries if 'COUNT' in query['sql']])
+
+    def test_home_cursor(self):
+        response = self.client.get(reverse('home'))
+        self.assertEqual(list(response.context['posts']), self.posts[:5])
+        response = self.client.get(reverse('home'), {'cursor': response.context['page_obj'].next_cursor})
+        self.assertEqual(list(response.context['posts']), self.posts[5:10])
+
+    def test_home_content_redirects_to_search(self):
+        response = self.client.get(reverse('home'), {'content': 'test'})
+        self.assertRedirects(response, f"{reverse('search')}?content=test")
+
+    def test_comments_cursor(self):
+        self.client.login(username=self.user.username, password='Assembler7002')
+        post = self.posts[0]
+        comments = [Comment.objects.create(author=self.user, post=post, content=f'comment {i}') for i in range(7)]
+        url = reverse('about', args=[post.slug])
+        response = self.client.get(url)
+        self.assertContains(response, 'comment 6')
+        self.assertNotContains(response, 'comment 1')
+        cursor = KeysetPaginator(post.comments.all(), 5).page().next_cursor
+        response = self.client.get(url, {'c': cursor})
+        self.assertContains(response, comments[1].content)
+        self.assertNotContains(response, 'comment 6')
+
+
+@override_settings(LEADERBOARD_BACKEND='memory', VIEW_COUNTER_BACKEND='memory')
+class LeaderboardTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='test-author')
+        self.post = Post.objects.create(author=self.user, title='test title', content='test content', views=10)
+        self.other = Post.objects.create(author=self.user, title='other title', content='other content', views=3)
+        Comment.objects.create(author=self.user, post=self.other, content='test comment')
+        cache.clear()
+        reconcile_leaderboards()
+        self.addCleanup(leaderboards.get_leaderboard().clear)  # the memory leaderboard lives as long as the process
+
+    def test_reconcile(self):
+        self.assertEqual([(post.pk, post.views) for post in leaderboards.most_viewed()],
+                         [(self.post.pk, 10), (self.other.pk, 3)])
+        self.assertEqual([(post.pk, post.num_comments) for post in leaderboards.most_commented()],
+                         [(self.other.pk, 1)])
+
+    def test_views_flush_updates_leaderboard(self):
+        get_view_buffer().incr(self.other.pk, 20)
+        flush_post_views()
+        self.assertEqual([(post.pk, post.views) for post in leaderboards.most_viewed()],
+                         [(self.other.pk, 23), (self.post.pk, 10)])
+
+    def test_comments_update_leaderboard(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(author=self.user, post=self.post, content='test comment')
+            Comment.objects.create(author=self.user, post=self.post, content='test comment')
+        self.assertEqual([(post.pk, post.num_comments) for post in leaderboards.most_commented()],
+                         [(self.post.pk, 2), (self.other.pk, 1)])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.comments.first().delete()
+        self.assertEqual(leaderboards.most_commented()[0].num_comments, 1)
+
+    def test_deleted_post_removed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.delete()
+        self.assertEqual([post.pk for post in leaderboards.most_viewed()], [self.other.pk])
+
+    def test_board_which_is_not_built(self):
+        leaderboards.get_leaderboard().clear()  # e.g. Redis was flushed
+        get_view_buffer().incr(self.other.pk, 20)
+        flush_post_views()
+        self.assertFalse(leaderboards.get_leaderboard().exists(leaderboards.VIEWS))  # no partial board
+        self.assertEqual([(post.pk, post.views) for post in leaderboards.most_viewed()],
+                         [(self.other.pk, 23), (self.post.pk, 10)])  # read from the database
+
+    def test_side_panel_without_aggregation(self):
+        self.client.get(reverse('home'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('home'))
+        self.assertFalse([query for query in queries if 'COUNT' in query['sql']])
+        self.assertTemplateUsed(response, 'post/side_info.html')
+        self.assertEqual(response.context['most_viewed_posts'], [self.post, self.other])
+
+
+class CommentCountTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='test-author')
+        self.post = Post.objects.create(author=self.user, title='test title', content='test content')
+
+    def test_comment_create_and_delete(self):
+        first = Comment.objects.create(author=self.user, post=self.post, content='first comment')
+        second = Comment.objects.create(author=self.user, post=self.post, content='second comment')
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 2)
+        self.assertEqual(self.post.last_comment_at, second.created_at)
+        second.delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+        self.assertEqual(self.post.last_comment_at, first.created_at)
+        first.delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 0)
+        self.assertIsNone(self.post.last_comment_at)
+
+    def test_cascade_delete(self):
+        commenter = User.objects.create(username='test-commenter')
+        Comment.objects.create(author=self.user, post=self.post, content='test comment')
+        Comment.objects.create(author=commenter, post=self.post, content='test comment')
+        commenter.delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+
+    def test_stale_post_save_keeps_count(self):
+        stale = Post.objects.get(pk=self.post.pk)
+        Comment.objects.create(author=self.user, post=self.post, content='test comment')
+        stale.title = 'new title'
+        stale.save()
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.title, self.post.comment_count), ('new title', 1))
+
+    def test_stale_post_save_keeps_views(self):
+        stale = Post.objects.get(pk=self.post.pk)
+        Post.objects.filter(pk=self.post.pk).update(views=5)  # e.g. a view flush
+        stale.title = 'new title'
+        stale.save()
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.title, self.post.views), ('new title', 5))
+
+    def test_repair_command(self):
+        Comment.objects.create(author=self.user, post=self.post, content='test comment')
+        empty = Post.objects.create(author=self.user, title='empty title', content='test content')
+        Post.objects.update(comment_count=7, last_comment_at=None)
+        call_command('repair_comment_counts', chunk_size=1, stdout=StringIO())
+        self.post.refresh_from_db()
+        empty.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+        self.assertIsNotNone(self.post.last_comment_at)
+        self.assertEqual(empty.comment_count, 0)
+
+    def test_deleted_post_does_not_update_its_counters(self):
+        for i in range(5):
+            Comment.objects.create(author=self.user, post=self.post, content=f'comment {i}')
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks() as callbacks:
+                self.post.delete()
+        self.assertFalse([query for query in queries if query['sql'].startswith('UPDATE')])
+        self.assertLess(len(callbacks), 10)  # the hooks of the post, not of every comment
+        self.assertFalse(Comment.objects.exists())
+
+
+class TransferCommandsTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='test-author')
+        self.commenter = User.objects.create(username='test-commenter')
+        self.post = Post.objects.create(author=self.user, title='test title', content='test content', views=5)
+        self.post.tags.add('django', 'python')
+        self.other = Post.objects.create(author=None, title='other title', content='other content')
+        self.comment = Comment.objects.create(author=self.commenter, post=self.post, content='test comment')
+        self.path = os.path.join(tempfile.mkdtemp(), 'posts.jsonl')
+
+    def dump_and_clear(self):
+        call_command('dump_posts', self.path, stderr=StringIO())
+        self.created_at = self.post.created_at
+        Post.objects.all().delete()
+        User.objects.filter(username='test-commenter').delete()
+
+    def test_dump_and_load(self):
+        self.dump_and_clear()
+        out = StringIO()
+        call_command('load_posts', self.path, batch_size=1, stdout=out)
+        self.assertIn('Loaded 2 posts and 1 comments, skipped 0 rows', out.getvalue())
+        self.assertIn('rows/s', out.getvalue())
+        post = Post.objects.get(slug='test-title')
+        self.assertEqual((post.title, post.author, post.views, post.created_at),
+                         ('test title', self.user, 5, self.created_at))
+        self.assertEqual(sorted(post.tags.names()), ['django', 'python'])
+        self.assertEqual(post.comment_count, 1)
+        comment = post.comments.get()
+        self.assertEqual((comment.content, comment.author.username), ('test comment', 'test-commenter'))
+        self.assertIsNone(Post.objects.get(slug='other-title').author)
+        self.assertFalse(os.path.exists(f'{self.path}.checkpoint'))
+
+    def test_load_twice_skips_posts(self):
+        self.dump_and_clear()
+        call_command('load_posts', self.path, stdout=StringIO())
+        Comment.objects.all().delete()
+        out = StringIO()
+        call_command('load_posts', self.path, stdout=out)
+        self.assertIn('Loaded 0 posts and 1 comments, skipped 2 rows', out.getvalue())
+        self.assertEqual(Post.objects.count(), 2)
+
+    def test_load_resumes_from_checkpoint(self):
+        self.dump_and_clear()
+        with open(self.path, 'rb') as file:
+            offset = len(file.readline())  # the first post is loaded
+        with open(f'{self.path}.checkpoint', 'w') as file:
+            file.write(f'{{"offset": {offset}}}')
+        out = StringIO()
+        call_command('load_posts', self.path, stdout=out)
+        self.assertIn(f'Resuming from byte {offset}', out.getvalue())
+        self.assertEqual(list(Post.objects.values_list('slug', flat=True)), ['other-title'])
+
+
+class GenerateDataCommandTests(TestCase):
+
+    def test_generate_data(self):
+        out = StringIO()
+        call_command('generate_data', users=20, posts=30, tags=10, comments_per_post=3, batch_size=7, seed=1,
+                     stdout=out)
+        self.assertFalse(OutboxTask.objects.exists())  # no activation email for generated users
+        self.assertIn('rows/s', out.getvalue())
+        self.assertEqual((User.objects.count(), Post.objects.count()), (20, 30))
+        self.assertEqual(User.objects.filter(profile__isnull=False).count(), 20)
+        self.assertTrue(self.client.login(username=User.objects.first().username, password='password'))
+        self.assertEqual(Post.objects.values('slug').distinct().count(), 30)
+        for post in Post.objects.all():
+            self.assertEqual(post.comment_count, post.comments.count())
+        self.assertTrue(Post.objects.filter(tags__isnull=False).exists())
+        post = Post.objects.create(author=User.objects.first(), title='test title', content='test content')
+        self.assertEqual(post.pk, 31)  # the sequence continues after the generated rows
+
+    def test_zipf_sampler(self):
+        from post.management.commands.generate_data import ZipfSampler
+        sampler = ZipfSampler(10, 1.5, random.Random(1))
+        samples = [sampler.sample() for _ in range(1000)]
+        self.assertTrue(all(0 <= sample < 10 for sample in samples))
+        self.assertGreater(samples.count(0), samples.count(9) * 5)
+
+
+class BenchmarkCommandTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='test-author')
+        for i in range(3):
+            post = Post.objects.create(author=self.user, title=f'test title {i}', content='test content')
+            post.tags.add('django')
+        self.path = os.path.join(tempfile.mkdtemp(), 'benchmark.json')
+        cache.clear()
+
+    def test_benchmark(self):
+        out = StringIO()
+        call_command('benchmark', requests=5, warmup=1, output=self.path, stdout=out)
+        with open(self.path) as file:
+            results = json.load(file)['results']
+        self.assertEqual(set(results), {'home', 'about', 'search', 'tag', 'comment_add', 'sitemap'})
+        for metrics in results.values():
+            self.assertEqual((metrics['requests'], metrics['errors']), (5, 0))
+            self.assertLessEqual(metrics['p50_ms'], metrics['p99_ms'])
+            self.assertGreater(metrics['queries_max'], 0)
+        self.assertIsNotNone(results['home']['cache_hit_ratio'])
+        self.assertEqual(Comment.objects.count(), 6)  # warmup and measured requests
+
+    def test_baseline_regression(self):
+        call_command('benchmark', endpoints=['home'], requests=5, warmup=1, output=self.path, stdout=StringIO())
+        call_command('benchmark', endpoints=['home'], requests=5, warmup=1, baseline=self.path, tolerance=100,
+                     stdout=StringIO())
+        with open(self.path) as file:
+            run = json.load(file)
+        run['results']['home']['queries_max'] = 0
+        with open(self.path, 'w') as file:
+            json.dump(run, file)
+        with self.assertRaisesMessage(CommandError, 'home queries_max: 0 ->'):
+            call_command('benchmark', endpoints=['home'], requests=5, warmup=1, baseline=self.path, tolerance=100,
+                         stdout=StringIO())
+
+    def test_allowed_host(self):
+        with override_settings(ALLOWED_HOSTS=['.example.com']):  # testserver of the test client is not allowed
+            call_command('benchmark', endpoints=['home'], requests=5, warmup=1, output=self.path, stdout=StringIO())
+        with open(self.path) as file:
+            self.assertEqual(json.load(file)['results']['home']['errors'], 0)
+
+    def test_every_request_failed(self):
+        with mock.patch('post.benchmark.Benchmark.send', return_value=500):
+            with self.assertRaisesMessage(CommandError, 'Every request to home failed'):
+                call_command('benchmark', endpoints=['home'], requests=5, warmup=1, stdout=StringIO())
+
+    def test_errors_regression(self):
+        baseline = {'home': {'p50_ms': 10.0, 'p95_ms': 20.0, 'p99_ms': 30.0, 'queries_max': 5, 'errors': 0}}
+        results = {'home': {'p50_ms': 1.0, 'p95_ms': 2.0, 'p99_ms': 3.0, 'queries_max': 1, 'errors': 5}}
+        self.assertEqual(compare(results, baseline, 0.2), ['home errors: 0 -> 5'])
+
+    def test_compare_servers(self):
+        wsgi = {'home': {'throughput_rps': 100.0, 'p50_ms': 10.0, 'p95_ms': 20.0, 'p99_ms': 30.0}}
+        asgi = {'home': {'throughput_rps': 150.0, 'p50_ms': 8.0, 'p95_ms': 15.0, 'p99_ms': None}}
+        self.assertEqual(compare_servers(wsgi, asgi), ['home         throughput x1.50  p50_ms -2.0 ms  p95_ms -5.0 ms'])
+        with self.assertRaisesMessage(CommandError, '--compare-url'):
+            call_command('benchmark', compare_url='http://127.0.0.1:8001', stdout=StringIO())
+
+
+@override_settings(LEADERBOARD_BACKEND='memory', VIEW_COUNTER_BACKEND='memory')
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+
+    def setUp(self):
+        leaderboards.get_leaderboard().clear()  # the budgets are measured without leaderboards
+        self.user = User.objects.create(username='test-author')
+        self.client.force_login(self.user)
+        self.posts = []
+        self.grow(6)
+
+    def grow(self, size):
+        """Adds tagged posts with comments until there are size posts"""
+        for i in range(len(self.posts), size):
+            post = Post.objects.create(author=self.user, title=f'test title {i}', content='test content')
+            post.tags.add('django', f'tag-{i}')
+            Comment.objects.create(author=self.user, post=post, content='test comment')
+            self.posts.append(post)
+
+    def grow_comments(self, size):
+        post = self.posts[0]
+        for _ in range(post.comments.count(), size):
+            Comment.objects.create(author=self.user, post=post, content='test comment')
+
+    def test_budgets(self):
+        post = self.posts[0]
+        self.assertQueryBudget('home')
+        self.assertQueryBudget('home', query_string='?tag=django')
+        self.assertQueryBudget('search', query_string='?content=test')
+        self.assertQueryBudget('about', args=[post.slug])
+        self.assertQueryBudget('create')
+        self.assertQueryBudget('edit', args=[post.slug])
+        self.assertQueryBudget('post_send', args=[post.slug])
+        self.assertQueryBudget('comment_add', args=[post.slug], method='post', data={'content': 'a long comment'})
+        self.assertQueryBudget('sitemap')
+
+    def test_constant_queries(self):
+        self.assertConstantQueries('home', self.grow)
+        self.assertConstantQueries('home', self.grow, sizes=(30, 40), query_string='?tag=django')
+        self.assertConstantQueries('search', self.grow, sizes=(40, 50), query_string='?content=test')
+        self.assertConstantQueries('sitemap', self.grow, sizes=(50, 60))
+        self.assertConstantQueries('about', self.grow_comments, args=[self.posts[0].slug])
+
+    def test_budget_exceeded_report(self):
+        with self.assertRaisesMessage(QueryBudgetExceeded, 'Repeated queries:') as context:
+            self.assertQueryBudget('home', budget=Budget(queries=1, time_ms=250))
+        self.assertIn('home: 10 queries (budget 1)', str(context.exception))
+        self.assertIn('IN (...)', str(context.exception))
+
+
+class SitemapFilesTests(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.settings = override_settings(SITEMAP_ROOT=self.root, SITEMAP_PAGE_SIZE=2, SITEMAP_DOMAIN='example.com')
+        self.settings.enable()
+        self.user = User.objects.create(username='test-author')
+        self.posts = [Post.objects.create(author=self.user, title=f'test title {i}', content='test content')
+                      for i in range(3)]
+        self.first_page = sitemap_files.get_page(self.posts[0].pk)
+
+    def tearDown(self):
+        self.settings.disable()
+
+    def read(self, name):
+        with open(os.path.join(self.root, name)) as file:
+            return file.read()
+
+    def test_build(self):
+        with self.assertNumQueries(3):  # pages with their lastmod, then the posts of every page
+            sitemap_files.build()
+        pages = sorted({sitemap_files.get_page(post.pk) for post in self.posts})
+        index = self.read('sitemap.xml')
+        for page in pages:
+            self.assertIn(f'https://example.com/sitemaps/posts-{page}.xml', index)
+            self.assertTrue(os.path.exists(os.path.join(self.root, f'posts-{page}.xml.gz')))
+        page = self.read(f'posts-{self.first_page}.xml')
+        self.assertIn(f'https://example.com{self.posts[0].get_absolute_url()}', page)
+
+    def test_refresh_changed_pages(self):
+        sitemap_files.build()
+        last_page = sitemap_files.get_page(self.posts[-1].pk)
+        self.posts[-1].delete()
+        client = mock.MagicMock()
+        client.spop.return_value = [str(last_page)]
+        with mock.patch('post.sitemap_files.get_redis', return_value=client):
+            self.assertEqual(sitemap_files.refresh(), 1)
+        if last_page != self.first_page:
+            self.assertFalse(os.path.exists(os.path.join(self.root, f'posts-{last_page}.xml')))
+        self.assertNotIn(self.posts[-1].slug, self.read('sitemap.xml') + self.read(f'posts-{self.first_page}.xml'))
+
+    def test_signals_mark_changed_pages(self):
+        with mock.patch('post.sitemap_files.mark_changed') as mark_changed:
+            with self.captureOnCommitCallbacks(execute=True):
+                Comment.objects.create(author=self.user, post=self.posts[0], content='test comment')
+        mark_changed.assert_called_once_with([self.posts[0].pk])
+
+    def test_sitemap_view(self):
+        response = self.client.get(reverse('sitemap'))
+        self.assertContains(response, '/sitemap-posts.xml')  # rendered dynamically until the files are built
+        sitemap_files.build()
+        response = self.client.get(reverse('sitemap'))
+        self.assertIn(b'example.com/sitemaps/', b''.join(response.streaming_content))
+        response = self.client.get(reverse('sitemap_file', args=[f'posts-{self.first_page}.xml']),
+                                   HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(self.client.get(reverse('sitemap_file', args=['posts-999.xml'])).status_code, 404)
+
+
+@override_settings(VIEW_COUNTER_BACKEND='memory')
+class ConditionalGetTests(TestCase):
+
+    def setUp(self):
+        flush_post_views()  # drops hits which other tests left in the buffer
+        self.user = User.objects.create(username='test-author')
+        self.post = Post.objects.create(author=self.user, title='test title', content='test content')
+        self.client.force_login(self.user)
+        self.url = reverse('about', args=[self.post.slug])
+        cache.clear()
+
+    def test_post_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response.headers['Cache-Control'])
+        flush_post_views()
+        with self.assertNumQueries(3):  # session, user and the state of the post
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response.headers['ETag'])
+        self.assertEqual(response.status_code, 304)
+        flush_post_views()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.views, 2)  # the hit of the 304 is recorded
+
+    def test_post_modified(self):
+        etag = self.client.get(self.url).headers['ETag']
+        comment = Comment.objects.create(author=self.user, post=self.post, content='test comment')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        comment.content = 'edited comment'
+        comment.save()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_etag_depends_on_viewer(self):
+        etag = self.client.get(self.url).headers['ETag']
+        self.client.force_login(User.objects.create(username='test-reader'))
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_last_modified(self):
+        last_modified = self.client.get(self.url).headers['Last-Modified']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+    def test_home_not_modified(self):
+        etag = self.client.get(reverse('home')).headers['ETag']
+        self.assertEqual(self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(reverse('home') + '?tag=test', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.create(author=self.user, title='new title', content='test content')
+        self.assertEqual(self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_home_panels_modified(self):
+        etag = self.client.get(reverse('home')).headers['ETag']
+        self.client.get(self.url)
+        flush_post_views()  # view counts and the most viewed posts change, the feed version does not
+        response = self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        self.assertEqual(self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        tag_cloud.invalidate()
+        self.assertEqual(self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_messages_are_rendered(self):
+        etag = self.client.get(self.url).headers['ETag']
+        self.client.post(reverse('post_send', args=[self.post.slug]),
+                         {'email': 'test@email.com', 'description': 'test-description'})
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'The post was successfully shared!')
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+@override_settings(ROOT_URLCONF='post.tests', LEADERBOARD_BACKEND='memory', VIEW_COUNTER_BACKEND='memory')
+class AsyncViewTests(TestCase):
+
+    def setUp(self):
+        flush_post_views()  # drops hits which other tests left in the buffer
+        self.user = User.objects.create(username='test-author')
+        self.post = Post.objects.create(author=self.user, title='test title', content='test content')
+        self.post.tags.add('django')
+        for i in range(6):
+            Comment.objects.create(author=self.user, post=self.post, content=f'test comment {i}')
+        self.url = reverse('about', args=[self.post.slug])
+        cache.clear()
+
+    def test_urls(self):
+        self.assertEqual(resolve(reverse('home')).func.view_class, AsyncHomeView)
+        self.assertEqual(resolve(self.url).func.view_class, AsyncPostDetailView)
+
+    async def test_home(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('home'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'post/home.html')
+        self.assertEqual([post.pk for post in response.context['posts']], [self.post.pk])
+        self.assertIn(self.post.pk, response.context['cards'])
+        self.assertEqual([tag['name'] for tag in response.context['tag_cloud']], ['django'])
+        self.assertEqual([post.pk for post in response.context['most_commented_posts']], [self.post.pk])
+        response = await self.async_client.get(reverse('home'), headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_home_filters(self):
+        response = await self.async_client.get(reverse('home') + '?tag=django&tag=python&match=any')
+        self.assertEqual([post.pk for post in response.context['posts']], [self.post.pk])
+        response = await self.async_client.get(reverse('home') + '?tag=django&tag=python')
+        self.assertEqual(list(response.context['posts']), [])
+        response = await self.async_client.get(reverse('home') + '?cursor=invalid')
+        self.assertEqual(response.status_code, 404)
+        response = await self.async_client.get(reverse('home') + '?content=test')
+        self.assertRedirects(response, reverse('search') + '?content=test', fetch_redirect_response=False)
+
+    async def test_detail(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'post/about.html')
+        self.assertEqual(response.context['post'].views, 1)
+        self.assertContains(response, 'test comment 5')
+        self.assertNotContains(response, 'test comment 0')  # the second page of comments
+        etag = response.headers['ETag']
+        response = await self.async_client.get(self.url + '?c=invalid')
+        self.assertContains(response, 'test comment 5')
+        response = await self.async_client.get(self.url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        await sync_to_async(flush_post_views)()
+        await self.post.arefresh_from_db()
+        self.assertEqual(self.post.views, 3)  # the hit of the 304 is recorded
+
+    async def test_detail_requires_login(self):
+        response = await self.async_client.get(self.url)
+        self.assertRedirects(response, f'{reverse("login")}?next={self.url}', fetch_redirect_response=False)
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('about', args=['unknown']))
+        self.assertEqual(response.status_code, 404)
+
+
+class FakePool:
+    """Counters of a psycopg pool, pop_stats() returns and resets them"""
+
+    def __init__(self):
+        self.stats = {}
+
+    def pop_stats(self):
+        stats, self.stats = self.stats, {}
+        return stats
+
+
+class DatabasePoolTests(TestCase):
+
+    def setUp(self):
+        self.pool = FakePool()
+        patcher = mock.patch('blog.db_pool.get_pools', return_value={'default': self.pool})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+
+    def test_publish_stats(self):
+        self.pool.stats = {'requests_num': 10, 'requests_queued': 2, 'requests_wait_ms': 30, 'requests_errors': 1,
+                           'pool_size': 4}
+        db_pool.publish_stats(force=True)
+        self.pool.stats = {'requests_num': 5}
+        db_pool.publish_stats(force=True)
+        stats = db_pool.get_stats()
+        self.assertEqual((stats['checkouts'], stats['waits'], stats['timeouts']), (15, 2, 1))
+        self.assertEqual(stats['mean_wait_ms'], 15)
+        db_pool.reset_stats()
+        self.assertEqual(db_pool.get_stats()['checkouts'], 0)
+
+    @override_settings(DB_POOL_STATS_INTERVAL=60)
+    def test_publish_interval(self):
+        db_pool.publish_stats(force=True)
+        self.pool.stats = {'requests_num': 3}
+        db_pool.publish_stats()
+        self.assertEqual(db_pool.get_stats()['checkouts'], 0)  # published with the next interval
+        self.client.get(reverse('home'))  # the end of a request publishes the counters when the interval passes
+        with mock.patch('blog.db_pool.time.monotonic', return_value=time.monotonic() + 60):
+            self.client.get(reverse('home'))
+        self.assertGreaterEqual(db_pool.get_stats()['checkouts'], 3)
+
+    def test_command(self):
+        self.pool.stats = {'requests_num': 7, 'requests_errors': 2}
+        db_pool.publish_stats(force=True)
+        out = StringIO()
+        call_command('db_pool_stats', reset=True, stdout=out)
+        self.assertIn('7 checkouts, 0 waits (mean wait n/a), 2 timeouts', out.getvalue())
+        self.assertEqual(db_pool.get_stats()['checkouts'], 0)
+
+    def test_close_pools_without_pool(self):
+        db_pool.close_pools()  # SQLite has no pool, its connections are kept
+        self.assertEqual(Post.objects.count(), 0)
+        self.assertEqual(connection.settings_dict['CONN_MAX_AGE'], 60)
+
+
+class TaskQueueTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        task_stats.reset_stats(list(settings.TASK_QUEUES))
+
+    def run_task(self, queue, task_id, waited, state='SUCCESS'):
+        """Runs the signal handlers of a worker for a task which waited in the queue for waited seconds"""
+        request = SimpleNamespace(id=task_id, delivery_info={'routing_key': queue}, is_eager=False, eta=None,
+                                  sent_at=time.time() - waited)
+        task_prerun.send(sender=None, task_id=task_id, task=SimpleNamespace(request=request))
+        task_postrun.send(sender=None, task_id=task_id, state=state)
+
+    def test_every_task_is_routed(self):
+        celery_app.loader.import_default_modules()
+        tasks = {name for name in celery_app.tasks if not name.startswith('celery.')}
+        routed = {task for queue in settings.TASK_QUEUES.values() for task in queue['tasks']}
+        self.assertEqual(tasks, routed)
+        route = celery_app.amqp.router.route({}, 'accounts.tasks.send_email')
+        self.assertEqual((route['queue'].name, route['priority']), ('email', 0))
+        self.assertTrue(celery_app.tasks['accounts.tasks.deliver_mail'].acks_late)
+        self.assertFalse(celery_app.tasks['post.tasks.flush_post_views'].acks_late)
+        self.assertTrue(celery_app.tasks['post.tasks.flush_post_views'].ignore_result)
+
+    def test_publish_stamps_the_task(self):
+        headers = {}
+        before_task_publish.send(sender='post.tasks.post_share', headers=headers)
+        self.assertAlmostEqual(headers['sent_at'], time.time(), delta=5)
+
+    def test_stats(self):
+        self.run_task('email', 'task-1', 0.2)
+        self.run_task('email', 'task-2', 0.4, state='FAILURE')
+        self.run_task('counters', 'task-3', 0)
+        task_stats.publish_stats(force=True)
+        stats = task_stats.get_stats(['email', 'counters', 'media'])
+        self.assertEqual((stats['email']['tasks'], stats['email']['failures']), (2, 1))
+        self.assertAlmostEqual(stats['email']['mean_wait_ms'], 300, delta=50)
+        self.assertEqual(stats['counters']['tasks'], 1)
+        self.assertIsNone(stats['media']['mean_run_ms'])
+        self.assertGreater(stats['email']['throughput'], 0)
+
+    def test_eager_task_is_not_counted(self):
+        flush_post_views.apply()  # runs in the test process, not in a worker
+        task_stats.publish_stats(force=True)
+        self.assertEqual(task_stats.get_stats(['counters'])['counters']['tasks'], 0)
+
+    def test_command(self):
+        self.run_task('maintenance', 'task-1', 0.1)
+        task_stats.publish_stats(force=True)
+        out = StringIO()
+        with mock.patch('blog.task_stats.get_backlog', return_value={queue: 0 for queue in settings.TASK_QUEUES}):
+            call_command('task_stats', reset=True, stdout=out)
+        self.assertIn('maintenance: 1 tasks', out.getvalue())
+        self.assertIn('0 failures', out.getvalue())
+        self.assertIn('email: 0 tasks (0.00/s), 0 failures, mean wait n/a', out.getvalue())
+        self.assertEqual(task_stats.get_stats(['maintenance'])['maintenance']['tasks'], 0)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'], LEADERBOARD_BACKEND='memory', VIEW_COUNTER_BACKEND='memory')
+class ReplicaRouterTests(TestCase):
+    """replica1 is not configured in tests, a query which is routed to it fails"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='test-author')
+        self.post = Post.objects.create(author=self.user, title='test title', content='test content')
+        self.client.force_login(self.user)
+        self.router = db_router.ReplicaRouter()
+        cache.clear()
+
+    def test_router(self):
+        self.assertIsNone(self.router.db_for_read(Post))
+        with db_router.replica_reads():
+            self.assertEqual(self.router.db_for_read(Post), 'replica1')
+            self.assertEqual(self.router.db_for_read(Tag), 'replica1')
+            self.assertIsNone(self.router.db_for_read(User))  # sessions and users stay on the primary
+            self.assertEqual(self.router.db_for_write(Comment), 'default')
+            self.assertEqual(self.router.db_for_read(Post), 'default')  # the block wrote
+        self.assertIsNone(self.router.db_for_read(Post))
+
+    def test_views_read_from_replicas(self):
+        with self.assertRaises(ConnectionDoesNotExist):
+            self.client.get(reverse('home'))
+        with self.assertRaises(ConnectionDoesNotExist):
+            self.client.get(reverse('about', args=[self.post.slug]))
+        self.assertEqual(self.client.get(reverse('create')).status_code, 200)
+        self.assertEqual(PostSitemap().items().db, 'replica1')
+
+    def test_writer_is_pinned(self):
+        response = self.client.post(reverse('comment_add', args=[self.post.slug]), {'content': 'test comment'})
+        self.assertIn(db_router.PIN_COOKIE, response.cookies)
+        cache.clear()
+        response = self.client.get(reverse('about', args=[self.post.slug]))  # the pin cookie is sent back
+        self.assertContains(response, 'test comment')
+        self.assertNotIn(db_router.PIN_COOKIE, response.cookies)  # reads do not extend the pin
+        self.client.cookies[db_router.PIN_COOKIE] = 'forged'
+        with self.assertRaises(ConnectionDoesNotExist):
+            self.client.get(reverse('home'))
+
+
+class SMTPStandInHandler(socketserver.StreamRequestHandler):
+    """Speaks enough SMTP for smtplib, recipients of server.refused are rejected and of server.deferred delayed"""
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 stand-in')
+        recipients = []
+        for line in self.rfile:
+            command = line.decode().strip()
+            verb = command[:4].upper()
+            if verb in ('EHLO', 'HELO', 'RSET', 'NOOP'):
+                self.reply('250 OK')
+            elif verb == 'MAIL':
+                recipients = []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                address = command.split(':', 1)[1].strip(' <>')
+                if address in self.server.refused:
+                    self.reply('550 No such user')
+                elif address in self.server.deferred:
+                    self.reply('451 Try again later')
+                else:
+                    recipients.append(address)
+                    self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                self.server.delivered.extend(recipients)
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Not implemented')
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+
+    def __init__(self, refused=(), deferred=()):
+        super().__init__(('127.0.0.1', 0), SMTPStandInHandler)
+        self.connections = 0
+        self.delivered = []
+        self.refused = set(refused)
+        self.deferred = set(deferred)
+
+
+@override_settings(EMAIL_BACKEND='blog.mail_backend.QueuedEmailBackend', MAIL_QUEUE_BACKEND='memory',
+                   MAIL_DELIVERY_BACKEND='django.core.mail.backends.locmem.EmailBackend', MAIL_BATCH_SIZE=10,
+                   MAIL_DOMAIN_RATE_LIMIT=100, MAIL_MAX_ATTEMPTS=2)
+class MailQueueTests(TestCase):
+
+    def setUp(self):
+        self.queue = mail_queue.get_mail_queue()
+        self.queue.clear()
+        self.addCleanup(self.queue.clear)
+        self.spool_dir = tempfile.mkdtemp()
+        spool_settings = self.settings(MAIL_SPOOL_DIR=self.spool_dir)
+        spool_settings.enable()
+        self.addCleanup(spool_settings.disable)
+
+    def start_server(self, refused=(), deferred=()):
+        server = SMTPStandIn(refused, deferred)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def smtp_settings(self, server):
+        return override_settings(MAIL_DELIVERY_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+                                 EMAIL_HOST='127.0.0.1', EMAIL_PORT=server.server_address[1], EMAIL_USE_TLS=False,
+                                 EMAIL_HOST_PASSWORD=None)
+
+    def send(self, *recipients):
+        """Sends a message to every recipient and commits"""
+        with self.captureOnCommitCallbacks(execute=True):
+            for recipient in recipients:
+                send_mail('test subject', 'test body', None, [recipient])
+
+    def test_batch_over_one_connection(self):
+        server = self.start_server()
+        self.send(*[f'reader{i}@example.com' for i in range(15)])
+        with self.smtp_settings(server):
+            self.assertEqual(mail_queue.deliver(), 10)
+            self.assertEqual(mail_queue.deliver(), 5)
+            self.assertEqual(mail_queue.deliver(), 0)
+        self.assertEqual(server.connections, 2)  # one connection per batch
+        self.assertEqual(len(server.delivered), 15)
+
+    def test_failed_message_is_retried_alone(self):
+        server = self.start_server(deferred=['busy@example.com'])
+        self.send('reader@example.com', 'busy@example.com')
+        with self.smtp_settings(server):
+            self.assertEqual(mail_queue.deliver(), 1)
+            self.assertEqual(len(self.queue), 1)  # waits for the retry delay
+            self.assertEqual(mail_queue.deliver(), 0)
+            self.assertEqual(self.queue.dead_letters, [])
+            server.deferred.clear()
+            with mock.patch('blog.mail_queue.time.time', return_value=time.time() + 60):
+                self.assertEqual(mail_queue.deliver(), 1)
+        self.assertEqual(server.delivered, ['reader@example.com', 'busy@example.com'])  # the first one is sent once
+
+    def test_refused_recipient_is_buried(self):
+        server = self.start_server(refused=['missing@example.com'])
+        self.send('missing@example.com')
+        with self.smtp_settings(server):
+            mail_queue.deliver()
+        self.assertEqual(len(self.queue), 0)
+        self.assertEqual(self.queue.dead_letters[0]['attempts'], 1)
+
+    @override_settings(MAIL_DOMAIN_RATE_LIMIT=2)
+    def test_domain_rate_limit(self):
+        self.send(*[f'reader{i}@example.com' for i in range(3)], 'reader@example.org')
+        self.assertEqual(mail_queue.deliver(), 3)
+        self.assertEqual(sorted(email.to[0] for email in mail.outbox),
+                         ['reader0@example.com', 'reader1@example.com', 'reader@example.org'])
+        self.assertEqual(len(self.queue), 1)
+
+    @override_settings(MAIL_DOMAIN_RATE_LIMIT=1)
+    def test_rate_limited_message_takes_no_slots(self):
+        self.send('reader@example.com')
+        with self.captureOnCommitCallbacks(execute=True):
+            send_mail('test subject', 'test body', None, ['copy@example.org', 'other@example.com'])
+        self.send('reader@example.org')
+        self.assertEqual(mail_queue.deliver(), 2)  # the second message waits and leaves the slot of example.org
+        self.assertEqual(sorted(email.to[0] for email in mail.outbox), ['reader@example.com', 'reader@example.org'])
+
+    def test_delivery_stops_without_the_lock(self):
+        self.send('reader@example.com', 'other@example.com')
+        with mock.patch.object(self.queue, 'refresh_lock', side_effect=[True, False]):
+            self.assertEqual(mail_queue.deliver(), 1)
+        self.assertEqual(mail_queue.deliver(), 1)  # the claimed rest is sent by the next delivery
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_unavailable_server_keeps_the_batch(self):
+        self.send('reader@example.com')
+        with override_settings(MAIL_DELIVERY_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+                               EMAIL_HOST='127.0.0.1', EMAIL_PORT=1, EMAIL_USE_TLS=False):
+            with self.assertRaises(OSError):
+                mail_queue.deliver()
+        self.assertEqual(mail_queue.deliver(), 1)  # the claimed batch is sent by the next delivery
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_queued_backend_is_not_a_delivery_backend(self):
+        self.send('reader@example.com')
+        with override_settings(MAIL_DELIVERY_BACKEND='blog.mail_backend.QueuedEmailBackend'):
+            with self.assertRaises(ImproperlyConfigured):
+                mail_queue.deliver()
+        self.assertEqual(mail_queue.deliver(), 1)  # the message stays in the queue
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_post_share_is_queued(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            post_share('test title', 'http://testserver/post/test', 'test-user', 'test description',
+                       'friend@example.com')
+        self.assertEqual(len(mail.outbox), 0)
+        mail_queue.deliver()
+        self.assertEqual(mail.outbox[0].subject, 'test-user shared this post: test title')
+        self.assertEqual(mail.outbox[0].to, ['friend@example.com'])
+
+    def test_mail_is_queued_on_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(send_mail('test subject', 'test body', None, ['reader@example.com']), 1)
+            self.assertEqual(len(self.queue), 0)  # a rolled back transaction would send nothing
+        self.assertEqual(len(callbacks), 1)
+        callbacks[0]()
+        self.assertEqual(len(self.queue), 1)
+
+    def test_message_is_delivered_unchanged(self):
+        email = EmailMultiAlternatives('test subject', 'test body', 'blog@example.com', ['reader@example.com'],
+                                       ['hidden@example.org'], cc=['copy@example.net'],
+                                       reply_to=['author@example.com'], headers={'X-Test': 'yes'})
+        email.attach_alternative('<p>test body</p>', 'text/html')
+        email.attach('test.bin', b'\x00\xfftest', 'application/octet-stream')
+        email.attach('test.txt', 'test text', 'text/plain')
+        with self.captureOnCommitCallbacks(execute=True):
+            email.send()
+        self.assertEqual(mail_queue.deliver(), 1)
+        delivered = mail.outbox[0]
+        for name in ['subject', 'body', 'from_email', 'to', 'cc', 'bcc', 'reply_to', 'extra_headers',
+                     'alternatives', 'attachments']:
+            self.assertEqual(getattr(delivered, name), getattr(email, name), name)
+
+    @override_settings(MAIL_QUEUE_BACKEND='redis')
+    def test_unavailable_queue_spools_the_mail(self):
+        with mock.patch('blog.mail_queue.RedisMailQueue.push', side_effect=RedisError):
+            self.send('reader@example.com')
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(len(os.listdir(self.spool_dir)), 1)
+        with override_settings(MAIL_QUEUE_BACKEND='memory'):  # the queue is back
+            self.assertEqual(mail_queue.deliver(), 1)
+        self.assertEqual(os.listdir(self.spool_dir), [])
+        self.assertEqual(mail.outbox[0].to, ['reader@example.com'])
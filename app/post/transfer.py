@@ -0,0 +1,207 @@
+"""
+Streaming transfer of posts, comments and tags between environments in JSONL.
+
+Every line of a dump is one record:
+  {"type": "post", "slug": ..., "title": ..., "content": ..., "author": username, "tags": [...], ...}
+  {"type": "comment", "post": slug of the post, "author": username, "content": ..., ...}
+Posts are written before comments, so a comment always follows its post. Records reference posts by slug
+and users by username, so a dump can be loaded into a database with different primary keys.
+"""
+import json
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import F
+from django.utils.dateparse import parse_datetime
+from taggit.models import Tag, TaggedItem
+from post.models import Post, Comment
+from post.search import update_search_vector
+from post import comment_stats, excerpts, feed_cache, tag_cloud
+
+POST_FIELDS = ('slug', 'title', 'content', 'views', 'created_at', 'updated_at')
+COMMENT_FIELDS = ('content', 'created_at', 'updated_at')
+DATETIME_FIELDS = ('created_at', 'updated_at')
+
+
+def _encode(record):
+    for field in DATETIME_FIELDS:
+        record[field] = record[field].isoformat()
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+
+
+def dump(chunk_size=2000):
+    """Yields the lines of a dump, rows are read with server-side cursors and tags with one query per chunk"""
+    content_type = ContentType.objects.get_for_model(Post)
+    chunk = []
+    posts = Post.objects.order_by('pk').values('pk', *POST_FIELDS, author_name=F('author__username'))
+    for post in posts.iterator(chunk_size=chunk_size):
+        chunk.append(post)
+        if len(chunk) == chunk_size:
+            yield from _dump_posts(chunk, content_type)
+            chunk = []
+    yield from _dump_posts(chunk, content_type)
+    comments = Comment.objects.order_by('pk').values(*COMMENT_FIELDS, post_slug=F('post__slug'),
+                                                     author_name=F('author__username'))
+    for comment in comments.iterator(chunk_size=chunk_size):
+        yield _encode({'type': 'comment', 'post': comment.pop('post_slug'), 'author': comment.pop('author_name'),
+                       **comment})
+
+
+def _dump_posts(chunk, content_type):
+    tags = defaultdict(list)
+    tagged_items = TaggedItem.objects.filter(
+        content_type=content_type, object_id__in=[post['pk'] for post in chunk]
+    ).order_by('pk').values_list('object_id', 'tag__name')
+    for post_id, name in tagged_items:
+        tags[post_id].append(name)
+    for post in chunk:
+        yield _encode({'type': 'post', 'author': post.pop('author_name'), 'tags': tags[post.pop('pk')], **post})
+
+
+@contextmanager
+def keep_timestamps(*models):
+    """Disables auto_now and auto_now_add of the models, so bulk_create keeps the dumped dates"""
+    fields = [field for model in models for field in model._meta.concrete_fields
+              if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)]
+    flags = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, flags):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Loader:
+    """
+    Loads a dump with batched inserts
+
+    Features:
+      * A batch of posts is inserted with one bulk_create, its tags with one insert into the through table
+      * Posts with a slug which already exists are skipped, so the posts of a batch can be loaded twice
+      * Post.save and post signals are not called, excerpts are computed before the insert, comment counts and
+        search vectors are updated per batch
+      * Authors missing in the database are created without a usable password
+    """
+
+    def __init__(self):
+        self.content_type = ContentType.objects.get_for_model(Post)
+        self.users = {}  # username: id
+        self.posts = 0
+        self.comments = 0
+        self.skipped = 0
+
+    def load_batch(self, records):
+        """Loads records of one type in one transaction"""
+        with transaction.atomic(), keep_timestamps(Post, Comment):
+            if records[0]['type'] == 'post':
+                self._load_posts(records)
+            else:
+                self._load_comments(records)
+
+    def finish(self):
+        tag_cloud.repair()  # tagged items are inserted without signals
+        feed_cache.bump_version()
+
+    def _get_user_ids(self, usernames):
+        missing = {username for username in usernames if username and username not in self.users}
+        if missing:
+            self.users.update(User.objects.filter(username__in=missing).values_list('username', 'pk'))
+            for username in missing - self.users.keys():
+                user = User.objects.create_user(username)  # the profile of the user is created by its signal
+                self.users[username] = user.pk
+        return self.users
+
+    def _load_posts(self, records):
+        existing = set(Post.objects.filter(slug__in=[record['slug'] for record in records]).values_list(
+            'slug', flat=True))
+        records = [record for record in records if record['slug'] not in existing]
+        self.skipped += len(existing)
+        if not records:
+            return
+        users = self._get_user_ids(record['author'] for record in records)
+        posts = [Post(author_id=users.get(record['author']), **self._fields(record, POST_FIELDS)) for record in records]
+        for post in posts:
+            excerpts.fill(post)
+        posts = Post.objects.bulk_create(posts)
+        if posts[0].pk is None:  # the database can not return primary keys of inserted rows
+            ids = dict(Post.objects.filter(slug__in=[post.slug for post in posts]).values_list('slug', 'pk'))
+        else:
+            ids = {post.slug: post.pk for post in posts}
+        self.posts += len(posts)
+        self._load_tags(records, ids)
+        update_search_vector(list(ids.values()))
+
+    def _load_tags(self, records, ids):
+        names = {name for record in records for name in record['tags']}
+        if not names:
+            return
+        tags = dict(Tag.objects.filter(name__in=names).values_list('name', 'pk'))
+        missing = names - tags.keys()
+        if missing:
+            slugify = Tag().slugify
+            Tag.objects.bulk_create([Tag(name=name, slug=slugify(name)) for name in missing], ignore_conflicts=True)
+            tags.update(Tag.objects.filter(name__in=missing).values_list('name', 'pk'))
+            for name in missing - tags.keys():  # the slug is taken by a tag with a similar name
+                tags[name] = Tag.objects.create(name=name).pk
+        TaggedItem.objects.bulk_create([
+            TaggedItem(content_type=self.content_type, object_id=ids[record['slug']], tag_id=tags[name])
+            for record in records for name in record['tags']
+        ], ignore_conflicts=True)
+
+    def _load_comments(self, records):
+        users = self._get_user_ids(record['author'] for record in records)
+        posts = dict(Post.objects.filter(slug__in={record['post'] for record in records}).values_list('slug', 'pk'))
+        comments = [Comment(post_id=posts[record['post']], author_id=users[record['author']],
+                            **self._fields(record, COMMENT_FIELDS))
+                    for record in records if record['post'] in posts]
+        Comment.objects.bulk_create(comments)
+        self.skipped += len(records) - len(comments)
+        self.comments += len(comments)
+        list(comment_stats.repair(Post.objects.filter(pk__in={comment.post_id for comment in comments})))
+
+    @staticmethod
+    def _fields(record, fields):
+        values = {field: record[field] for field in fields if field in record}
+        for field in DATETIME_FIELDS:
+            if field in values:
+                values[field] = parse_datetime(values[field])
+        return values
+
+
+def read_batches(file, batch_size, offset=0):
+    """Yields (records, offset after the batch), a batch has records of one type only"""
+    file.seek(offset)
+    records = []
+    while True:
+        line = file.readline()
+        if line.strip():
+            record = json.loads(line)
+            if records and (record['type'] != records[0]['type'] or len(records) == batch_size):
+                yield records, offset
+                records = []
+            records.append(record)
+        elif not line:
+            break
+        offset = file.tell()
+    if records:
+        yield records, offset
+
+
+class RateMeter:
+    """Measures rows per second of a long running command"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.rows = 0
+
+    def add(self, rows):
+        self.rows += rows
+
+    @property
+    def rate(self):
+        return self.rows / max(time.monotonic() - self.started, 1e-6)
@@ -1,9 +1,16 @@
+from django.conf import settings
 from django.urls import path
 import post.views as views
+import post.async_views as async_views
+
+# under ASGI the hot read views fetch their data concurrently
+home_view = async_views.AsyncHomeView if settings.ASYNC_VIEWS else views.HomeView
+detail_view = async_views.AsyncPostDetailView if settings.ASYNC_VIEWS else views.PostDetailView
 
 urlpatterns = [
-    path('', views.HomeView.as_view(), name='home'),
-    path('post/<str:slug>', views.PostDetailView.as_view(), name='about'),
+    path('', home_view.as_view(), name='home'),
+    path('search/', views.SearchView.as_view(), name='search'),
+    path('post/<str:slug>', detail_view.as_view(), name='about'),
     path('post_share/<str:slug>/', views.PostShareView.as_view(), name='post_send'),
     path('post/create/', views.PostCreateView.as_view(), name='create'),
     path('post/<str:slug>/edit/', views.PostEditView.as_view(), name='edit'),
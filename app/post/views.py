@@ -1,4 +1,5 @@
 from django.shortcuts import get_object_or_404, redirect
+from django.conf import settings
 from django.contrib import messages
 from post.models import Post, Comment
 from post.forms import PostForm, CommentForm, PostShareForm
@@ -6,83 +7,288 @@ from django.views.generic.edit import CreateView, UpdateView
 from django.urls import reverse_lazy
 from django.views.generic import DeleteView, DetailView, ListView, FormView
 from django.urls import reverse
-from django.db.models import Q, Count
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.core.cache import cache
+from django.core.paginator import Page
+from django.http import Http404
+from django.db import transaction
+from django.db.models import Max
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+import hashlib
+from taggit.models import Tag
 from post.tasks import post_share
+from outbox.dispatch import enqueue
+from post.counters import record_view
+from post import card_cache, feed_cache, leaderboards, tag_cloud
+from post.search import search_posts, get_headlines
+from post.pagination import KeysetPaginator, KeysetPage, InvalidCursor, decode_cursor
+from post.tag_index import TagIndexPaginator, get_tag_index
 
 
-class HomeView(ListView):
+class ConditionalGetMixin:
     """
-    Home view
+    Answers conditional GET requests with 304 before the page is rendered
+
+    Features:
+      * The ETag is built from get_etag_parts(), which uses a cheap query or none
+      * The ETag contains the url and the viewer, pages show the username and edit buttons of the author
+      * Pages with pending messages are always rendered
+      * Browsers are asked to revalidate the page on every visit
+    """
+    last_modified = None
+
+    def get_etag_parts(self):
+        """Returns the state the page depends on or None if the page can not be validated"""
+        raise NotImplementedError
+
+    def get_viewer(self):
+        user = self.request.user
+        return (user.pk, user.username, user.is_superuser) if user.is_authenticated else None
+
+    def not_modified(self):
+        """Called when the client has the current page"""
+
+    def get(self, request, *args, **kwargs):
+        """Returns 304 if the ETag or the modification date of the client is current, otherwise renders the page"""
+        if len(messages.get_messages(request)):  # messages are shown once, the page must be rendered
+            return super().get(request, *args, **kwargs)
+        parts = self.get_etag_parts()
+        if parts is None:
+            return super().get(request, *args, **kwargs)
+        etag = self.get_etag(parts)
+        response = get_conditional_response(request, etag=etag, last_modified=self.get_last_modified())
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        elif response.status_code == 304:
+            self.not_modified()
+        return self.set_validators(response, etag)
+
+    def get_etag(self, parts):
+        state = repr((parts, self.get_viewer(), self.request.get_full_path()))
+        return quote_etag(hashlib.md5(state.encode()).hexdigest())
+
+    def get_last_modified(self):
+        return int(self.last_modified.timestamp()) if self.last_modified else None
+
+    def set_validators(self, response, etag):
+        """Adds the ETag and the modification date to a rendered page or a 304 response"""
+        if response.status_code in (200, 304):
+            response.headers['ETag'] = etag
+            if self.get_last_modified():
+                response.headers['Last-Modified'] = http_date(self.get_last_modified())
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+class PostListView(ListView):
+    """
+    Base view of the pages with lists of posts
 
     Features:
-      * Shows the main page of the blog
-      * Accessible for all users
       * Shows 5 posts per page
       * Shows most viewed posts and most commented posts
+      * Shows the cloud of the most used tags
     """
     model = Post
-    template_name = 'post/home.html'
     context_object_name = 'posts'
     paginate_by = 5
 
+    def get_context_data(self, **kwargs):
+        """Adds the most views and most commented posts from the leaderboards to the context"""
+        context = super().get_context_data(**kwargs)
+        context['most_viewed_posts'] = leaderboards.most_viewed()
+        context['most_commented_posts'] = leaderboards.most_commented()
+        context['tag_cloud'] = tag_cloud.get_cloud()
+        return context
+
+
+class HomeView(ConditionalGetMixin, PostListView):
+    """
+    Home view
+
+    Features:
+      * Shows the main page of the blog
+      * Accessible for all users
+      * Uses cursor pagination, pages are addressed by an opaque ?cursor= token
+      * Redirects old search links with ?content= to the search page
+      * Filters posts by several tags, ?tag=a&tag=b shows posts with all tags and ?tag=a&tag=b&match=any with any
+      * Answers conditional requests with 304 while the feed version and the version of the side panels are the same
+      * Renders the reader-independent part of every post card from the fragment cache
+      * Reads posts from the read replicas
+    """
+    template_name = 'post/home.html'
+    replica_reads = True
+    cursor_kwarg = 'cursor'
+
+    def get_etag_parts(self):
+        """
+        Returns the feed version, bumped by every change of posts and comments, and the version of the panels,
+        bumped by flushed views, rebuilt leaderboards and changes of the tag cloud, both are read from the cache
+        """
+        return feed_cache.get_version(), feed_cache.get_panels_version()
+
+    def get_context_data(self, **kwargs):
+        """Adds the cached fragments of the post cards to the context"""
+        context = super().get_context_data(**kwargs)
+        context['cards'] = card_cache.get_cards(context['posts'])
+        return context
+
+    def get(self, request, *args, **kwargs):
+        """Redirects search queries to the search view"""
+        if request.GET.get('content'):
+            return redirect(f"{reverse('search')}?{request.GET.urlencode()}")
+        return super().get(request, *args, **kwargs)
+
     def get_queryset(self):
         """
         Returns a queryset of posts
 
         Features:
-          * Cached for 60 seconds to maintain performance and accuracy of the views counter
-          * Filters posts based on user posts, tags and search query parameters
+          * Filters posts based on user posts and tags query parameters
           * Returns an empty queryset if user is not authenticated and if user has no posts
-          * Solves the issue of N+1
+          * Only ids of the current page are taken from it, posts are hydrated in paginate_queryset
         """
-        qs = cache.get('posts')  # tries to get the queryset from cache
-        if not qs:
-            qs = Post.objects.select_related('author').prefetch_related('tags').order_by(
-                '-created_at')  # if cache is empty, creates a queryset, solves N+1 issue
-            cache.set('posts', qs, 60)  # set the queryset in cache for 60 seconds
+        qs = Post.objects.all()
         if self.request.GET.get('user_posts') == 'true':  # if user_posts in GET parameters, filters posts by user
             if self.request.user.is_authenticated:
                 qs = qs.filter(author=self.request.user)
             else:
                 qs = Post.objects.none()  # if user is not authenticated, returns an empty queryset
-        elif self.request.GET.get('tag'):  # if tag in GET parameters, filters posts by tag
-            tag = self.request.GET.get('tag')
-            qs = qs.filter(tags__name__icontains=tag)
-        elif self.request.GET.get('content'):  # if user used search bar, filters posts by content and title
-            content = self.request.GET.get('content')
-            qs = qs.filter(
-                Q(content__icontains=content) | Q(title__icontains=content) | Q(
-                    tags__name__icontains=content)).distinct()
+        elif self.get_tag_slugs():  # if tag in GET parameters, filters posts by the indexed slugs of the tags
+            slugs = self.get_tag_slugs()
+            if self.match_all_tags():
+                for slug in slugs:
+                    qs = qs.filter(tags__slug=slug)
+            else:
+                qs = qs.filter(tags__slug__in=slugs).distinct()
         return qs
 
+    def get_tag_slugs(self):
+        """Returns the slugs of the tag parameters, old links with tag names lead to the same page"""
+        slugify = Tag().slugify
+        return sorted({slugify(tag) for tag in self.request.GET.getlist('tag') if tag.strip()})
+
+    def match_all_tags(self):
+        """Posts have to have all tags unless ?match=any is given"""
+        return self.request.GET.get('match') != 'any'
+
+    def get_keyset_paginator(self, queryset, page_size):
+        """Returns a paginator of the tag index for tag filters with TAG_FILTER_BACKEND='index'"""
+        slugs = self.get_tag_slugs()
+        if settings.TAG_FILTER_BACKEND != 'index' or not slugs or self.request.GET.get('user_posts') == 'true':
+            return KeysetPaginator(queryset.only('pk', 'created_at'), page_size)
+        tag_ids = list(Tag.objects.filter(slug__in=slugs).values_list('pk', flat=True))
+        if self.match_all_tags() and len(tag_ids) < len(slugs):
+            tag_ids = []  # an unknown tag matches no post
+        return TagIndexPaginator(get_tag_index(), tag_ids, self.match_all_tags(), page_size)
+
+    def get_feed_filters(self):
+        """Returns the parameters which define the list of posts, they are a part of the page cache key"""
+        user_posts = self.request.GET.get('user_posts') == 'true'
+        return {
+            'user': self.request.user.pk if user_posts else None,
+            'user_posts': user_posts,
+            'tag': self.get_tag_slugs(),
+            'match': 'all' if self.match_all_tags() else 'any',
+        }
+
+    def get_cursor(self):
+        """Returns the cursor of the request, an invalid cursor raises 404 before it becomes a part of a cache key"""
+        cursor = self.request.GET.get(self.cursor_kwarg) or ''
+        if cursor:
+            try:
+                decode_cursor(cursor)
+            except InvalidCursor:
+                raise Http404('Invalid cursor')
+        return cursor
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Paginates posts with a keyset paginator using the feed cache
+
+        Features:
+          * Pages are fetched by (created_at, id) ranges, neither OFFSET nor COUNT(*) is used
+          * Pages of tag filters are read from the tag bitmaps with TAG_FILTER_BACKEND='index'
+          * Caches only the ordered ids of a page and the flags of neighbour pages, never a whole queryset
+          * Cache keys contain the feed version, which is bumped when posts or comments are changed
+          * Posts of the page are hydrated from the per-post cache
+          * An invalid cursor raises 404
+        """
+        cursor = self.get_cursor()
+        key = feed_cache.page_key(self.get_feed_filters(), cursor)
+        cached_page = cache.get(key)
+        if cached_page is None:  # if the page is not cached, paginates ids in the database and caches them
+            page = self.get_keyset_paginator(queryset, page_size).page(cursor)
+            cached_page = {'ids': [post.pk for post in page], 'has_next': page.has_next(),
+                           'has_previous': page.has_previous()}
+            cache.set(key, cached_page, feed_cache.FEED_CACHE_TIMEOUT)
+        posts = feed_cache.get_posts(cached_page['ids'])
+        page = KeysetPage(posts, cached_page['has_next'], cached_page['has_previous'])
+        return None, page, posts, page.has_other_pages()
+
+
+class SearchView(PostListView):
+    """
+    Search view
+
+    Features:
+      * Shows the posts found by the search bar
+      * Uses ranked full-text search on PostgreSQL and icontains on other databases
+      * Shows a snippet of the content with highlighted matches for every post
+    """
+    template_name = 'post/search.html'
+
+    def get_queryset(self):
+        """Returns the found posts or an empty queryset if the query is empty"""
+        query = self.request.GET.get('content', '').strip()
+        if not query:
+            return Post.objects.none()
+        return search_posts(Post.objects.order_by('-created_at'), query)
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Paginates found posts using the feed cache
+
+        Features:
+          * Results are ordered by rank, so they are paginated by page numbers
+          * Caches only the ordered ids of a page and the total count, never a whole queryset
+          * Posts of the page are hydrated from the per-post cache
+        """
+        filters = {'search': self.request.GET.get('content', '').strip()}
+        key = feed_cache.page_key(filters, self.request.GET.get(self.page_kwarg) or 1)
+        cached_page = cache.get(key)
+        if cached_page is None:  # if the page is not cached, paginates ids in the database and caches them
+            paginator, page, post_ids, is_paginated = super().paginate_queryset(
+                queryset.values_list('pk', flat=True), page_size)
+            cached_page = {'ids': list(post_ids), 'count': paginator.count, 'number': page.number}
+            cache.set(key, cached_page, feed_cache.FEED_CACHE_TIMEOUT)
+        posts = feed_cache.get_posts(cached_page['ids'])
+        paginator = feed_cache.CountedPaginator(queryset, page_size, cached_page['count'])
+        page = Page(posts, cached_page['number'], paginator)
+        return paginator, page, posts, paginator.num_pages > 1
+
     def get_context_data(self, **kwargs):
-        """Adds the most views and most commented posts to the context"""
+        """Adds the query and the highlighted snippets of the found posts to the context"""
         context = super().get_context_data(**kwargs)
-        most_viewed_posts = cache.get('most_viewed_posts')  # checks if most_viewed_posts is in cache
-        if not most_viewed_posts:  # if not, creates a queryset and caches it for 60 seconds
-            most_viewed_posts = Post.objects.order_by('-views')[:5]
-            cache.set('most_viewed_posts', most_viewed_posts, 60)
-        most_commented_posts = cache.get('most_commented_posts')  # checks if most_commented_posts is in cache
-        if not most_commented_posts:  # if not, creates a queryset and caches it for 60 seconds
-            most_commented_posts = Post.objects.annotate(num_comments=Count('comments')).order_by('-num_comments')[:5]
-            cache.set('most_commented_posts', most_commented_posts, 60)
-        context['most_viewed_posts'] = most_viewed_posts
-        context['most_commented_posts'] = most_commented_posts
+        query = self.request.GET.get('content', '').strip()
+        context['query'] = query
+        context['headlines'] = get_headlines([post.pk for post in context['posts']], query) if query else {}
         return context
 
 
-class PostDetailView(LoginRequiredMixin, DetailView):
+class PostDetailView(LoginRequiredMixin, ConditionalGetMixin, DetailView):
     """
     Post detail view
 
     Features:
-      * Cached for 60 seconds to maintain performance and accuracy of the views counter
       * Shows the post and its comments
       * Solves the issue of N+1
+      * Answers conditional requests with 304 while the post and its comments are the same, the hit is still recorded
+      * Reads the post and its comments from the read replicas
     """
     model = Post
+    replica_reads = True
     template_name = 'post/about.html'
     context_object_name = 'post'
     slug_field = 'slug'  # slug field name
@@ -99,11 +305,31 @@ class PostDetailView(LoginRequiredMixin, DetailView):
         context['comments'] = post.comments.select_related("author").order_by("-created_at")
         return context
 
+    def get_etag_parts(self):
+        """Returns the modification dates of the post and its comments with one query"""
+        return self.set_post_state(self.get_state_queryset().first())
+
+    def get_state_queryset(self):
+        return Post.objects.filter(slug=self.kwargs[self.slug_url_kwarg]).annotate(
+            comments_updated_at=Max('comments__updated_at')
+        ).values('pk', 'views', 'updated_at', 'comment_count', 'comments_updated_at')
+
+    def set_post_state(self, state):
+        """Keeps the state of the post for not_modified() and returns the ETag parts of it"""
+        if state is None:
+            return None  # the page renders 404
+        self.post_state = state
+        self.last_modified = max(filter(None, (state['updated_at'], state['comments_updated_at'])))
+        return state['updated_at'], state['comment_count'], state['comments_updated_at']
+
+    def not_modified(self):
+        """Records a hit of the reader who has the current page"""
+        record_view(Post(pk=self.post_state['pk'], views=self.post_state['views']))
+
     def get_object(self, queryset=None):
-        """Increases the views counter"""
+        """Records a hit in the view buffer, the counter is written to the database by the flush_post_views task"""
         obj = super().get_object(queryset)
-        obj.views += 1
-        obj.save()
+        obj.views = record_view(obj)  # shows the views including the hits which are not flushed yet
         return obj
 
 
@@ -127,8 +353,9 @@ class PostEditView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
     def form_valid(self, form):
         """Sends a success message and eliminates the cache"""
         messages.success(self.request, 'The post was successfully edited!')
-        cache.delete('posts')  # eliminates the cache
-        return super().form_valid(form)
+        response = super().form_valid(form)
+        feed_cache.invalidate_post(self.object.pk)  # eliminates the cache
+        return response
 
     def test_func(self):
         """Checks if the user is the author of the post or a superuser"""
@@ -160,9 +387,10 @@ class PostCreateView(LoginRequiredMixin, CreateView):
     def form_valid(self, form):
         """Sends a success message and eliminates the cache"""
         form.instance.author = self.request.user
-        cache.delete('posts')  # eliminates the cache
         messages.success(self.request, 'The post was successfully created!')
-        return super().form_valid(form)
+        response = super().form_valid(form)
+        feed_cache.bump_version()  # eliminates the cache
+        return response
 
 
 class PostDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
@@ -185,9 +413,15 @@ class PostDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     def post(self, request, *args, **kwargs):
         """Sends a success message and eliminates the cache if the post is deleted successfully"""
         messages.success(request, "The post was successfully deleted!")
-        cache.delete('posts')  # eliminates the cache
         return super().post(request, *args, **kwargs)
 
+    def form_valid(self, form):
+        """Deletes the post and eliminates the cache"""
+        post_id = self.object.pk  # the pk is cleared by delete()
+        response = super().form_valid(form)
+        feed_cache.invalidate_post(post_id)  # eliminates the cache
+        return response
+
     def test_func(self):
         """Checks if the user is the author of the post or a superuser"""
         post = self.get_object()
@@ -221,8 +455,8 @@ class PostShareView(LoginRequiredMixin, FormView):
         username = self.request.user.username
         description = form.cleaned_data['description']  # gets the description from the form
         email_to = form.cleaned_data['email']  # gets the email from the form
-        post_share.delay(slug, full_url, username, description,
-                         email_to)  # adds an async task of sending the post to the user's email
+        enqueue(post_share, post.title, full_url, username, description,
+                email_to)  # adds an async task of sending the post to the user's email to the outbox
         messages.success(self.request, 'The post was successfully shared!')
         return super().form_valid(form)
 
@@ -250,7 +484,10 @@ class CommentCreateView(LoginRequiredMixin, CreateView):
         form.instance.post = get_object_or_404(Post, slug=self.kwargs[
             'slug'])  # gets the post from the database using the slug from the URL
         messages.success(self.request, 'The comment was successfully added!')
-        return super().form_valid(form)
+        with transaction.atomic():  # the comment and the comment count of the post are saved together
+            response = super().form_valid(form)
+        feed_cache.invalidate_post(self.object.post_id)  # eliminates the cache
+        return response
 
     def get_success_url(self):
         """Returns the success url"""
@@ -275,9 +512,11 @@ class CommentEditView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
         return self.get_object().post.get_absolute_url()
 
     def form_valid(self, form):
-        """Sends a success message"""
+        """Sends a success message and eliminates the cache"""
         messages.success(self.request, 'The comment was successfully edited!')
-        return super().form_valid(form)
+        response = super().form_valid(form)
+        feed_cache.invalidate_post(self.object.post_id)  # eliminates the cache
+        return response
 
     def test_func(self):
         """Checks if the user is the author of the comment or a superuser"""
@@ -304,7 +543,10 @@ class CommentDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     def post(self, request, *args, **kwargs):
         """Sends a success message if a comment is deleted successfully"""
         messages.success(self.request, 'The comment was successfully deleted!')
-        return super().post(request, *args, **kwargs)
+        with transaction.atomic():  # the comment and the comment count of the post are deleted together
+            response = super().post(request, *args, **kwargs)
+        feed_cache.invalidate_post(self.object.post_id)  # eliminates the cache
+        return response
 
     def get_success_url(self):
         """Returns the success url"""